@@ -0,0 +1,150 @@
+'''
+Benchmark of the extraction pipeline on synthetic recordings.
+
+Times and profiles the memory of `best_crosscorrelation`,
+`best_channel_crosscorrelation`, `numpy_peaks` and `extract_peaks` for each
+combination of the given lengths, sample rates and dtypes, and writes the
+results as JSON. A previous results file can be given to compare against.
+
+    python benchmarks/bench_pipeline.py -s 10 60 -o results.json
+    python benchmarks/bench_pipeline.py -s 10 60 --compare results.json
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from scipy.io import wavfile
+import m2.rec2taps as rec2taps
+
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic import write_pair  # noqa: E402
+
+
+def measure(f, repeat):
+    '''
+    Returns the timings and the peak memory traced of calling f.
+
+    Timings are taken without tracing, which slows down allocations. The
+    memory is measured on an extra call.
+    '''
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'min_s': min(times),
+        'mean_s': sum(times) / len(times),
+        'peak_bytes': peak,
+    }
+
+
+def cases(sti_file, rec_file):
+    'Returns the functions benchmarked for a pair of files.'
+    sr, stim = wavfile.read(sti_file)
+    _, rec = wavfile.read(rec_file)
+    return {
+        'best_crosscorrelation':
+            lambda: rec2taps.best_crosscorrelation(rec, 0, stim, 0),
+        'best_channel_crosscorrelation':
+            lambda: rec2taps.best_channel_crosscorrelation(stim, rec),
+        'numpy_peaks':
+            lambda: rec2taps.numpy_peaks(rec[:, 1], sr),
+        'extract_peaks':
+            lambda: rec2taps.extract_peaks(sti_file, rec_file),
+    }
+
+
+def run(seconds, srs, dtypes, lag, repeat, only=None):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for s, sr, dtype in itertools.product(seconds, srs, dtypes):
+            sti_file, rec_file = write_pair(directory, s, sr, dtype, lag=lag)
+            for name, f in cases(sti_file, rec_file).items():
+                if only and name not in only:
+                    continue
+                r = measure(f, repeat)
+                r.update({'function': name, 'seconds': s, 'sr': sr,
+                          'dtype': dtype, 'lag': lag})
+                print('{function} {seconds}s {sr}Hz {dtype}: '
+                      '{min_s:.3f}s {peak_bytes} bytes'.format(**r),
+                      file=sys.stderr)
+                results.append(r)
+    return results
+
+
+def key(r):
+    return (r['function'], r['seconds'], r['sr'], r['dtype'])
+
+
+def compare(results, baseline):
+    'Prints the ratio of time and memory of results against a baseline.'
+    previous = {key(r): r for r in baseline['results']}
+    for r in results:
+        b = previous.get(key(r))
+        if b is None:
+            continue
+        print('{} {}s {}Hz {}: time x{:.2f}, memory x{:.2f}'.format(
+            *key(r), r['min_s'] / b['min_s'],
+            r['peak_bytes'] / max(b['peak_bytes'], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', dest='seconds', type=float, nargs='+',
+                        default=[10, 60], help='stimulus lengths (s)')
+    parser.add_argument('-r', dest='srs', type=int, nargs='+',
+                        default=[48000], help='sample rates')
+    parser.add_argument('-t', dest='dtypes', nargs='+', default=['int16'],
+                        choices=['int16', 'int32', 'float32'],
+                        help='sample types')
+    parser.add_argument('-l', dest='lag', type=float, default=50,
+                        help='loopback lag (ms)')
+    parser.add_argument('-n', dest='repeat', type=int, default=3,
+                        help='timed repetitions')
+    parser.add_argument('-f', dest='functions', nargs='+', default=None,
+                        help='only benchmark these functions')
+    parser.add_argument('-o', dest='output', default=None,
+                        help='JSON file for the results (default: stdout)')
+    parser.add_argument('--compare', default=None,
+                        help='previous results JSON file to compare against')
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.srs, args.dtypes, args.lag,
+                  args.repeat, args.functions)
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Latency benchmark of the online tap detector.
+
+Feeds a recording to `OnlineTapDetector` in small blocks, as an audio
+callback would, and reports the processing time of each block against the
+real-time duration of the block.
+
+    python benchmarks/online_latency.py [-b BLOCK_SIZE] [-s STIMULUS] [REC]
+'''
+import argparse
+import json
+import os
+import time
+import numpy as np
+from scipy.io import wavfile
+from m2.rec2taps.errors import LoopbackNotLocked
+from m2.rec2taps.online import OnlineTapDetector
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                         'extract_peaks_test')
+REC_FILE = os.path.join(TESTS_DIR, 'rec.wav')
+
+
+def run(recording, sr, block_size, **kwargs):
+    detector = OnlineTapDetector(sr, **kwargs)
+    times = []
+    taps = 0
+    for start in range(0, recording.shape[0], block_size):
+        block = recording[start:start + block_size]
+        t0 = time.perf_counter()
+        taps += len(detector.process(block))
+        times.append(time.perf_counter() - t0)
+    try:
+        taps += len(detector.flush())
+    except LoopbackNotLocked as e:
+        taps += len(e.taps)
+
+    times = np.array(times) * 1000
+    return {
+        'block_size': block_size,
+        'block_ms': block_size / sr * 1000,
+        'blocks': len(times),
+        'taps': taps,
+        'lag_ms': (None if detector.lag is None
+                   else detector.lag / sr * 1000),
+        'detection_latency_ms': detector.latency,
+        'processing_ms': {
+            'mean': times.mean(),
+            'p50': np.percentile(times, 50),
+            'p95': np.percentile(times, 95),
+            'p99': np.percentile(times, 99),
+            'max': times.max(),
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('recording_file', nargs='?', default=REC_FILE)
+    parser.add_argument('-s', dest='stimuli_file', default=None,
+                        help=('stimulus to lock onto the loopback lag '
+                              '(default: none)'))
+    parser.add_argument('-b', dest='block_sizes', type=int, nargs='+',
+                        default=[64, 256, 1024])
+    parser.add_argument('-i', dest='invert_input', action='store_true')
+    args = parser.parse_args()
+
+    sr, recording = wavfile.read(args.recording_file)
+    stimulus = None
+    if args.stimuli_file is not None:
+        _, stimulus = wavfile.read(args.stimuli_file)
+
+    results = [run(recording, sr, b, stimulus=stimulus,
+                   invert_input_signal=args.invert_input)
+               for b in args.block_sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
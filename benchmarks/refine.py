@@ -0,0 +1,118 @@
+'''
+Benchmark of sub-sample refinement against upsampling.
+
+Generates a band-limited stimulus and a recording whose loopback and taps
+are placed at known fractional sample positions, and compares the error and
+time of the integer positions, the 'parabolic' and 'sinc' refinements and
+the upsampling of the whole recording with `resample_poly`.
+
+    python benchmarks/refine.py [-s SECONDS] [-r SR] [-u FACTOR ...]
+'''
+import argparse
+import json
+import time
+import numpy as np
+from scipy import fft
+from scipy.signal import resample_poly
+import m2.rec2taps as rec2taps
+from m2.rec2taps import refine
+
+
+def delayed(signal, delay):
+    'Delays a signal by a fractional number of samples (circularly).'
+    freqs = fft.rfftfreq(signal.shape[0])
+    return fft.irfft(fft.rfft(signal) * np.exp(-2j * np.pi * freqs * delay),
+                     signal.shape[0])
+
+
+def synthetic(seconds, sr, lag, seed=0):
+    '''
+    Returns the stimulus, the loopback, the input signal, the true lag and
+    the true tap positions (in samples).
+    '''
+    rng = np.random.RandomState(seed)
+    n = seconds * sr
+    stimulus = resample_poly(rng.normal(size=n // 4), 4, 1)[:n]
+    loopback = delayed(np.concatenate([stimulus, np.zeros(sr)]), lag)
+
+    taps = np.arange(sr // 2, n - sr // 10, sr // 2)
+    taps = taps + rng.uniform(0, 1, taps.shape[0])
+    t = np.arange(n + sr)
+    width = 2
+    signal = rng.normal(0, 0.001, n + sr)
+    for tap in taps:
+        near = slice(int(tap) - 20 * width, int(tap) + 20 * width)
+        signal[near] += np.exp(-0.5 * ((t[near] - tap) / width) ** 2)
+    return stimulus, loopback, signal, lag, taps
+
+
+def timed(f, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def errors(estimated, expected):
+    diff = np.abs(np.asarray(estimated) - expected)
+    return {'mean': float(diff.mean()), 'max': float(diff.max())}
+
+
+def run(seconds, sr, factors, lag=123.37):
+    stimulus, loopback, signal, lag, taps = synthetic(seconds, sr, lag)
+    stimulus2d = stimulus[:, None]
+    recording = np.stack([loopback, signal], axis=1)
+
+    (_, _, lag_i), cc_ms = timed(rec2taps.best_channel_crosscorrelation,
+                                 stimulus2d, recording[:, :1])
+    peaks, peaks_ms = timed(rec2taps.numpy_peaks, signal, sr, 100, 5)
+    assert len(peaks) == len(taps)
+
+    results = {'seconds': seconds, 'sr': sr, 'taps': len(taps),
+               'integer': {'lag_error': abs(lag_i - lag),
+                           'tap_error': errors(peaks, taps),
+                           'ms': cc_ms + peaks_ms}}
+    for method in refine.REFINE_METHODS:
+        lag_r, lag_ms = timed(refine.refine_lag, stimulus2d, 0, recording,
+                              0, lag_i, method)
+        peaks_r, tap_ms = timed(refine.refine_maxima, signal, peaks, method)
+        results[method] = {'lag_error': abs(lag_r - lag),
+                           'tap_error': errors(peaks_r, taps),
+                           'ms': lag_ms + tap_ms}
+
+    for factor in factors:
+        t0 = time.perf_counter()
+        up_stimulus = resample_poly(stimulus2d, factor, 1)
+        up_recording = resample_poly(recording[:, :1], factor, 1)
+        _, _, lag_u = rec2taps.best_channel_crosscorrelation(up_stimulus,
+                                                             up_recording)
+        peaks_u = rec2taps.numpy_peaks(resample_poly(signal, factor, 1),
+                                       sr * factor, 100, 5)
+        ms = (time.perf_counter() - t0) * 1000
+        results['upsample_{}'.format(factor)] = {
+            'lag_error': abs(lag_u / factor - lag),
+            'tap_error': errors(peaks_u / factor, taps),
+            'ms': ms}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', dest='seconds', type=int, default=30)
+    parser.add_argument('-r', dest='sr', type=int, default=48000)
+    parser.add_argument('-u', dest='factors', type=int, nargs='+',
+                        default=[4, 16])
+    parser.add_argument('-o', dest='output', default=None,
+                        help='JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.sr, args.factors)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
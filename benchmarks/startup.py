@@ -0,0 +1,99 @@
+'''
+Cold-start benchmark of the rec2taps command line.
+
+Measures the wall time of starting the CLI in a fresh interpreter and the
+import time of its modules with `python -X importtime`, and writes the
+results as JSON.
+
+    python benchmarks/startup.py [-n RUNS] [-o results.json]
+'''
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+IMPORT_CLI = 'import m2.rec2taps.cli'
+RUN_HELP = 'from m2.rec2taps.cli import rec2taps; rec2taps()'
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def env():
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [environ.get('PYTHONPATH')] if p])
+    return environ
+
+
+def wall_time(code, args=(), runs=5):
+    'Returns the wall times of running code in fresh interpreters.'
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code, *args], env=env(),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def import_times(code=IMPORT_CLI):
+    '''
+    Returns the cumulative import time in seconds of each module imported
+    by code, as reported by `python -X importtime`.
+    '''
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       env=env(), stderr=subprocess.PIPE,
+                       stdout=subprocess.DEVNULL, text=True, check=True)
+    modules = {}
+    for line in p.stderr.splitlines():
+        m = IMPORTTIME.match(line)
+        if m is not None:
+            modules[m.group(4)] = {'self_s': int(m.group(1)) / 1e6,
+                                   'cumulative_s': int(m.group(2)) / 1e6,
+                                   'depth': len(m.group(3)) // 2}
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-n', dest='runs', type=int, default=5,
+                        help='number of interpreter launches per measure')
+    parser.add_argument('-t', dest='top', type=int, default=15,
+                        help='number of slowest top level imports reported')
+    parser.add_argument('-o', dest='output', default=None,
+                        help='JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    baseline = wall_time('pass', runs=args.runs)
+    import_cli = wall_time(IMPORT_CLI, runs=args.runs)
+    run_help = wall_time(RUN_HELP, ['-h'], runs=args.runs)
+    modules = import_times()
+    slowest = sorted(modules.items(), key=lambda m: -m[1]['cumulative_s'])
+
+    report = {
+        'python': sys.version.split()[0],
+        'interpreter_s': min(baseline),
+        'import_cli_s': min(import_cli),
+        'cli_help_s': min(run_help),
+        'import_cli_total_s': modules.get('m2.rec2taps.cli',
+                                          {}).get('cumulative_s'),
+        'slowest_imports': [dict(module=name, **times)
+                            for name, times in slowest[:args.top]],
+        'loaded': {m: any(k == m or k.startswith(m + '.') for k in modules)
+                   for m in ['matplotlib', 'scipy.signal', 'scipy.fft',
+                             'scipy.io']},
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
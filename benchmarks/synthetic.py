@@ -0,0 +1,84 @@
+'''
+Synthetic stimulus/recording pairs for benchmarks.
+
+The stimulus is stereo noise. The recording has a loopback of one stimulus
+channel, delayed by a configurable lag, and the signal of an input device
+with taps at regular intervals over background noise.
+'''
+import os
+import numpy as np
+from scipy.io import wavfile
+
+FULL_SCALE = {
+    'int16': 2 ** 15 - 1,
+    'int32': 2 ** 31 - 1,
+    'float32': 1.0,
+}
+
+
+def lag_signal(signal, lag, sr, rng=np.random):
+    'Lags signal by lag (in ms), as in the cross-correlation tests'
+    lag_s = int(lag * sr / 1000)
+    if lag < 0:
+        signal = signal[-lag_s:, :]
+    if lag > 0:
+        std = signal.std()
+        signal = np.concatenate([rng.uniform(-std, std,
+                                             (lag_s, signal.shape[1])),
+                                 signal])
+    return signal
+
+
+def synthetic_pair(seconds, sr=48000, dtype='int16', lag=50,
+                   tap_interval=500, channels=2, seed=0):
+    '''
+    Generates a stimulus and a recording of the given length.
+
+    Params:
+        seconds: length of the stimulus in seconds. The recording is one
+            second longer.
+        sr: sample rate
+        dtype: sample type ('int16', 'int32' or 'float32')
+        lag: delay in ms of the loopback in the recording
+        tap_interval: ms between taps
+        channels: number of channels of the recording. Channel 0 is the
+            loopback and the rest are input devices.
+        seed: random seed
+
+    Returns:
+        tuple (stimulus, recording) of 2d arrays of the given dtype
+    '''
+    rng = np.random.RandomState(seed)
+    n = int(seconds * sr)
+    stim = rng.normal(0, 0.2, (n, 2))
+
+    rec = np.empty((n + sr, channels))
+    loopback = lag_signal(stim[:, :1] * 0.8, lag, sr, rng)[:n + sr, 0]
+    rec[:loopback.shape[0], 0] = loopback
+    rec[loopback.shape[0]:, 0] = 0
+    rec[:, 1:] = rng.normal(0, 0.01, (n + sr, channels - 1))
+    width = int(0.02 * sr)
+    step = int(tap_interval * sr / 1000)
+    for t in range(step, n + sr - width, step):
+        rec[t:t + width, 1:] += 0.5 * np.hanning(width)[:, None]
+
+    scale = FULL_SCALE[dtype]
+    stim = np.clip(stim, -1, 1) * scale
+    rec = np.clip(rec, -1, 1) * scale
+    return stim.astype(dtype), rec.astype(dtype)
+
+
+def write_pair(directory, seconds, sr=48000, dtype='int16', **kwargs):
+    '''
+    Writes a synthetic pair as wav files.
+
+    Returns:
+        tuple with the paths of the stimulus and recording files
+    '''
+    stim, rec = synthetic_pair(seconds, sr, dtype, **kwargs)
+    name = '{}s_{}hz_{}'.format(seconds, sr, dtype)
+    sti_file = os.path.join(directory, name + '_stim.wav')
+    rec_file = os.path.join(directory, name + '_rec.wav')
+    wavfile.write(sti_file, sr, stim)
+    wavfile.write(rec_file, sr, rec)
+    return sti_file, rec_file
@@ -0,0 +1,100 @@
+'''
+Benchmark of the adaptive threshold against the global one.
+
+Generates the input signal of a session with taps at known positions over
+background noise, optionally adding a drift of the baseline and bursts of
+louder noise, and compares the time and the detection errors of
+`numpy_peaks` with the 'global' and 'adaptive' thresholds over a range of
+prominences.
+
+    python benchmarks/threshold.py [-s SECONDS] [-r SR] [--drift] [--bursts]
+'''
+import argparse
+import json
+import time
+import numpy as np
+import m2.rec2taps as rec2taps
+
+
+def synthetic(seconds, sr, drift=False, bursts=False, seed=0):
+    '''
+    Returns the input signal and the true tap positions (in samples).
+
+    Taps are 60 ms half sines of random amplitude every 400 to 800 ms. The
+    drift is a slow oscillation of the baseline with twice the amplitude of
+    the weakest taps. Bursts are 2 s of noise as loud as the weakest taps
+    every 20 s.
+    '''
+    rng = np.random.RandomState(seed)
+    n = seconds * sr
+    signal = rng.normal(0, 0.01, n)
+    width = int(0.06 * sr)
+    pulse = np.sin(np.pi * np.arange(width) / width)
+    taps = np.cumsum(rng.uniform(0.4, 0.8, seconds * 3) * sr).astype(int)
+    taps = taps[taps < n - width]
+    for tap in taps:
+        signal[tap:tap + width] += rng.uniform(0.3, 1) * pulse
+    if drift:
+        signal += 0.6 * np.sin(2 * np.pi * np.arange(n) / (45 * sr))
+    if bursts:
+        for start in range(10 * sr, n - 2 * sr, 20 * sr):
+            signal[start:start + 2 * sr] += rng.normal(0, 0.15, 2 * sr)
+    return signal, taps + width // 2
+
+
+def errors(peaks, taps, sr, tolerance=30):
+    'Number of missed and spurious taps, matching within tolerance ms.'
+    tolerance = tolerance * sr / 1000
+    idx = np.clip(np.searchsorted(peaks, taps), 1, max(len(peaks) - 1, 1))
+    if len(peaks) == 0:
+        return {'missed': len(taps), 'spurious': 0}
+    nearest = np.minimum(np.abs(peaks[idx - 1] - taps),
+                         np.abs(peaks[np.minimum(idx, len(peaks) - 1)] -
+                                taps))
+    hits = int((nearest <= tolerance).sum())
+    return {'missed': len(taps) - hits, 'spurious': len(peaks) - hits}
+
+
+def run(seconds, sr, drift, bursts, global_prominences,
+        adaptive_prominences):
+    signal, taps = synthetic(seconds, sr, drift, bursts)
+    results = {'seconds': seconds, 'sr': sr, 'taps': len(taps),
+               'drift': drift, 'bursts': bursts}
+    for threshold, prominences in [('global', global_prominences),
+                                   ('adaptive', adaptive_prominences)]:
+        for prominence in prominences:
+            t0 = time.perf_counter()
+            peaks = rec2taps.numpy_peaks(signal, sr, 100, prominence,
+                                         threshold=threshold)
+            ms = (time.perf_counter() - t0) * 1000
+            results['{}_{}'.format(threshold, prominence)] = dict(
+                errors(peaks, taps, sr), ms=ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', dest='seconds', type=int, default=600)
+    parser.add_argument('-r', dest='sr', type=int, default=48000)
+    parser.add_argument('--drift', action='store_true')
+    parser.add_argument('--bursts', action='store_true')
+    parser.add_argument('-p', dest='global_prominences', type=float,
+                        nargs='+', default=[1, 1.5, 2, 3])
+    parser.add_argument('-a', dest='adaptive_prominences', type=float,
+                        nargs='+', default=[5, 8, 12])
+    parser.add_argument('-o', dest='output', default=None,
+                        help='JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.sr, args.drift, args.bursts,
+                  args.global_prominences, args.adaptive_prominences)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
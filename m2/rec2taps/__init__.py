@@ -1,23 +1,34 @@
 import logging
+import os
 import numpy as np
-from scipy.signal import find_peaks, fftconvolve
-from scipy.io import wavfile
+from scipy import fft
 from m2.rec2taps import errors
+from m2.rec2taps import plotting
+from m2.rec2taps.stimulus import Stimulus, load_stimulus
+from m2.rec2taps.correlation import crosscorrelation_matrix
+from m2.rec2taps.streaming import stream_numpy_peaks
+from m2.rec2taps.readers import read_audio
+from m2.rec2taps.profiling import NULL_PROFILER, signal_metrics
+from m2.rec2taps.cache import entry_key, file_hash
+from m2.rec2taps.refine import refine_lag, refine_maxima
+from m2.rec2taps.threshold import adaptive_rectify, default_prominence
+from m2.rec2taps.qc import channel_margin, normalized_correlation
+from m2.rec2taps.qc import signal_report
 from m2.rec2taps.defaults import DEFAULT_DISTANCE, DEFAULT_PROMINENCE
+from m2.rec2taps.defaults import DEFAULT_CROSSCORRELATION_METHOD
+from m2.rec2taps.defaults import DEFAULT_DECIMATION, DEFAULT_MMAP
+from m2.rec2taps.defaults import DEFAULT_LAG_TEMPLATE
+from m2.rec2taps.defaults import LAG_TEMPLATE_BLOCKS, LAG_TEMPLATE_MIN_RMS
+from m2.rec2taps.defaults import REFINE_LAG_LENGTH
+from m2.rec2taps.defaults import RECTIFY_BLOCK_SIZE
 
-CAN_DEBUG_PLOT = False
-try:
-    import matplotlib
-    import matplotlib.pyplot as plt
-    matplotlib.use('Agg')
-    CAN_DEBUG_PLOT = True
-except ImportError as ie:
-    logging.warn(('Matplotlib is not available. If --debug_plot flag is used '
-                  'no plot will be produced.'))
-except Exception as e:
-    logging.error(
-        ('An error occured while loading matplotlib: {}'.format(str(e)))
-    )
+
+def __getattr__(name):
+    # Checking for matplotlib imports it, so it is only done when asked
+    if name == 'CAN_DEBUG_PLOT':
+        return plotting.can_debug_plot()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
 
 
 def prominence_amp(data, prominence=DEFAULT_PROMINENCE):
@@ -25,14 +36,30 @@ def prominence_amp(data, prominence=DEFAULT_PROMINENCE):
     return prominence_amp
 
 
-def rectify(data, prominence_amp):
-    rect_ys = data.copy()
-    rect_ys[data < prominence_amp] = 0
-    return rect_ys
+def rectify(data, prominence_amp, out=None):
+    '''
+    Sets the values of the signal below prominence_amp to 0.
+
+    Params:
+        data: 1d-array of signal values
+        prominence_amp: rectification threshold
+        out: array where the result is written, which may be data itself.
+            If None, a copy of data is used.
+    '''
+    if out is None:
+        out = data.copy()
+    elif out is not data:
+        np.copyto(out, data)
+    # Rectifying by blocks bounds the size of the temporary mask
+    for start in range(0, out.shape[0], RECTIFY_BLOCK_SIZE):
+        block = out[start:start + RECTIFY_BLOCK_SIZE]
+        block[block < prominence_amp] = 0
+    return out
 
 
 def numpy_peaks(data, sr, distance=DEFAULT_DISTANCE,
-                prominence=DEFAULT_PROMINENCE):
+                prominence=None, overwrite_data=False,
+                threshold='global'):
     '''
     Obtains peaks using scipy find_peaks adjusted to our FSR data.
     
@@ -41,22 +68,128 @@ def numpy_peaks(data, sr, distance=DEFAULT_DISTANCE,
         sr: int indicating sample rate
         distance: minimun distance in ms between peaks
 	prominence: minimun prominence as multiple of signal standard
-		    deviation
+		    deviation. If None, the default of the threshold method is
+		    used (see `threshold.default_prominence`).
+        overwrite_data: if True and data is a writeable float64 array, it
+            is rectified in place instead of in a new buffer
+        threshold: 'global' to rectify with the standard deviation of the
+            whole signal, or 'adaptive' to rectify with the local median and
+            noise level of the signal (see `threshold.adaptive_rectify`), in
+            which case prominence is a multiple of the local noise level
     '''
-    prominence_a = prominence_amp(data, prominence)
-    rect_ys = rectify(data, prominence_a)
+    from scipy.signal import find_peaks
+
+    prominence = default_prominence(threshold, prominence)
+    # find_peaks works on float64, so rectifying into a float64 buffer
+    # avoids a second copy of the signal
+    if (overwrite_data and data.dtype == np.float64 and
+            data.flags.writeable):
+        out = data
+    else:
+        out = np.empty(data.shape, dtype=np.float64)
+    if threshold == 'global':
+        prominence_a = prominence_amp(data, prominence)
+        rect_ys = rectify(data, prominence_a, out)
+    elif threshold == 'adaptive':
+        rect_ys, prominence_a = adaptive_rectify(data, sr, prominence,
+                                                 out=out)
+    else:
+        raise ValueError('Unknown threshold method: {}'.format(threshold))
     distance = distance * sr / 1000
     peaks, props = find_peaks(rect_ys, prominence=prominence_a,
                               distance=distance)
     return peaks
 
 
+def _tied_trials(buffer, stride, distance):
+    '''
+    Returns the trials with two local maxima of equal height closer than
+    distance.
+
+    find_peaks sorts peaks by height with an unstable sort to filter them by
+    distance, so which of such peaks is kept depends on the whole array.
+    '''
+    from scipy.signal import find_peaks
+
+    maxima, _ = find_peaks(buffer)
+    trial = maxima // stride
+    order = np.lexsort((maxima, buffer[maxima], trial))
+    maxima, trial = maxima[order], trial[order]
+    tied = ((trial[1:] == trial[:-1]) &
+            (buffer[maxima[1:]] == buffer[maxima[:-1]]) &
+            (maxima[1:] - maxima[:-1] < distance))
+    return np.unique(trial[1:][tied])
+
+
+def numpy_batch_peaks(trials, sr, distance=DEFAULT_DISTANCE,
+                      prominence=DEFAULT_PROMINENCE):
+    '''
+    Obtains peaks of many equal-length trials as `numpy_peaks` row by row.
+
+    Each trial is rectified with its own threshold in one vectorized pass.
+    Trials are then laid out in a single buffer separated by NaN gaps at
+    least `distance` long and searched with a single call to find_peaks. A
+    NaN behaves as the end of the signal for find_peaks, and no pair of
+    peaks of different trials is closer than the gap, so the result equals
+    that of each trial on its own. Trials where the distance filter depends
+    on the order of equally high peaks are searched on their own.
+
+    Params:
+        trials: 2d-array of signal values (trials x samples)
+        sr: int indicating sample rate
+        distance: minimun distance in ms between peaks
+        prominence: minimun prominence as multiple of the standard deviation
+            of each trial
+
+    Returns:
+        tuple (peaks, offsets) where peaks is a 1d-array with the peak
+        positions (in samples from the start of their trial) of all trials
+        and the peaks of trial i are peaks[offsets[i]:offsets[i + 1]]
+    '''
+    from scipy.signal import find_peaks, peak_prominences
+
+    n_trials, n_samples = trials.shape
+    distance = distance * sr / 1000
+    stride = n_samples + max(int(np.ceil(distance)), 1)
+
+    prominence_a = trials.std(axis=1) * prominence
+    buffer = np.full((n_trials, stride), np.nan)
+    rect_ys = buffer[:, :n_samples]
+    rect_ys[...] = trials
+    rect_ys[rect_ys < prominence_a[:, None]] = 0
+    buffer = buffer.reshape(-1)
+
+    # find_peaks filters by distance before prominence, so filtering by the
+    # per-trial prominence afterwards gives the same result
+    peaks, _ = find_peaks(buffer, distance=distance)
+    trial = peaks // stride
+    prominences, _, _ = peak_prominences(buffer, peaks)
+    keep = prominences >= prominence_a[trial]
+
+    tied = _tied_trials(buffer, stride, np.ceil(distance))
+    if tied.shape[0] > 0:
+        keep &= ~np.isin(trial, tied)
+        peaks = np.concatenate([peaks[keep]] + [
+            find_peaks(rect_ys[t], prominence=prominence_a[t],
+                       distance=distance)[0] + t * stride
+            for t in tied])
+        peaks.sort()
+    else:
+        peaks = peaks[keep]
+    trial = peaks // stride
+
+    offsets = np.searchsorted(trial, np.arange(n_trials + 1))
+    return peaks - trial * stride, offsets
+
+
 def best_crosscorrelation(signal_a, channel_a, signal_b, channel_b):
     '''
     Correlates both signals and return max crosscorr value and position.
 
     Args:
-        signal_a, signal_b: signals to be cross correlated as 2d array
+        signal_a, signal_b: signals to be cross correlated as 2d array.
+            signal_b can also be a `Stimulus`, in which case its cached
+            spectra are used.
         channel_a, channel_b: channels to be used from each signal
 
     Returns:
@@ -65,19 +198,37 @@ def best_crosscorrelation(signal_a, channel_a, signal_b, channel_b):
         { 'argmax': 12540, 'max': 45.6 }
 
     '''
-    if (signal_a[:, channel_a].shape[0] < signal_b[:, channel_b].shape[0]):
-        raise errors.SignalTooShortForConvolution()
+    if isinstance(signal_b, Stimulus):
+        cc = _stimulus_crosscorrelation(signal_a[:, channel_a], signal_b,
+                                        channel_b)
+    else:
+        from scipy.signal import fftconvolve
+
+        if (signal_a.shape[0] < signal_b.shape[0]):
+            raise errors.SignalTooShortForConvolution()
 
-    cc = fftconvolve(signal_a[:, channel_a],
-                     list(reversed(signal_b[:, channel_b])),
-                     'valid')
+        cc = fftconvolve(signal_a[:, channel_a], signal_b[::-1, channel_b],
+                         'valid')
     return {
         'argmax': np.argmax(cc),
         'max': np.max(cc)
     }
 
 
-def best_channel_crosscorrelation(stimulus_signal, recording_signal):
+def _stimulus_crosscorrelation(data, stimulus, channel):
+    'Valid cross-correlation of a 1d signal with a cached stimulus channel.'
+    if data.shape[0] < len(stimulus):
+        raise errors.SignalTooShortForConvolution()
+
+    n = fft.next_fast_len(data.shape[0], real=True)
+    cc = fft.irfft(fft.rfft(data, n) *
+                   stimulus.reversed_spectrum(channel, n), n)
+    return cc[len(stimulus) - 1:data.shape[0]]
+
+
+def best_channel_crosscorrelation(stimulus_signal, recording_signal,
+                                  method=DEFAULT_CROSSCORRELATION_METHOD,
+                                  dtype=np.float64, scores=None):
     '''
     Returns indexes and lag of the channels that best correlate the signals.
 
@@ -93,42 +244,485 @@ def best_channel_crosscorrelation(stimulus_signal, recording_signal):
 
     Args:
         stimulus_signal: 2d array with the signal time series from the stimulus
-            audio
+            audio or `Stimulus` instance
         recording_signal: 2d array with the signal time series from the
             recording audio
+        method: 'exhaustive' to cross-correlate every channel pair at the
+            native sample rate or 'coarse' to use
+            `coarse_channel_crosscorrelation`
+        dtype: float type used for the cross-correlation (np.float64 or
+            np.float32, which halves the memory required)
+        scores: if not None, a dictionary where the maximum
+            cross-correlation of every channel pair is stored as `maxima`
+            (2d array, stimulus channels x recording channels)
 
     Returns:
         Returns 3 elements as a tuple:
-            stimulus loopback channel (0 or 1)
-            recording loopback channel (0 or 1)
+            stimulus loopback channel
+            recording loopback channel
             delay between stimulus to recorded loopback in samples
     '''
-    corrs = [
-        [
-            best_crosscorrelation(recording_signal, ri, stimulus_signal, si)
-            for ri in [0, 1]
-        ]
-        for si in [0, 1]
-    ]
-    max_cor_idx = np.argmax([[c['max'] for c in x] for x in corrs])
+    if method == 'coarse':
+        return coarse_channel_crosscorrelation(stimulus_signal,
+                                               recording_signal, dtype=dtype,
+                                               scores=scores)
+    if method != 'exhaustive':
+        raise ValueError('Unknown cross-correlation method: {}'.format(
+            method))
+
+    maxima, argmaxima = crosscorrelation_matrix(recording_signal,
+                                                stimulus_signal, dtype)
+    if scores is not None:
+        scores['maxima'] = maxima
+    row, col = np.unravel_index(np.argmax(maxima), maxima.shape)
+    return (row, col, argmaxima[row, col])
+
+
+def coarse_channel_crosscorrelation(stimulus_signal, recording_signal,
+                                    decimation=DEFAULT_DECIMATION,
+                                    radius=None, dtype=np.float64,
+                                    scores=None):
+    '''
+    Coarse-to-fine version of `best_channel_crosscorrelation`.
+
+    Both signals are low-pass filtered and decimated by `decimation` to
+    select the channel pair and an approximate lag. The lag is then refined
+    at the native sample rate by direct correlation of the selected pair
+    within `radius` samples of the approximate lag.
+
+    Args:
+        stimulus_signal: 2d array with the signal time series from the stimulus
+            audio or `Stimulus` instance
+        recording_signal: 2d array with the signal time series from the
+            recording audio
+        decimation: integer decimation factor of the coarse search
+        radius: half width in samples of the refinement window. Defaults to
+            twice the decimation factor.
+        dtype: float type used for the coarse cross-correlation
+        scores: see `best_channel_crosscorrelation`. The maxima are those of
+            the decimated signals.
+
+    Returns:
+        Same as `best_channel_crosscorrelation`
+    '''
+    from scipy.signal import resample_poly
+
+    if isinstance(stimulus_signal, Stimulus):
+        stimulus_signal = stimulus_signal.signal
+    if radius is None:
+        radius = 2 * decimation
+
+    stimulus_length = stimulus_signal.shape[0]
+    if recording_signal.shape[0] < stimulus_length:
+        raise errors.SignalTooShortForConvolution()
+
+    si, ri, coarse_lag = best_channel_crosscorrelation(
+        resample_poly(stimulus_signal, 1, decimation, axis=0),
+        resample_poly(recording_signal, 1, decimation, axis=0),
+        'exhaustive', dtype, scores)
+
+    start = max(0, coarse_lag * decimation - radius)
+    end = min(recording_signal.shape[0] - stimulus_length,
+              coarse_lag * decimation + radius)
+    template = stimulus_signal[:, si].astype(np.float64)
+    segment = recording_signal[start:end + stimulus_length, ri].astype(
+        np.float64)
+    cc = [np.dot(segment[k:k + stimulus_length], template)
+          for k in range(end - start + 1)]
+    return (si, ri, start + int(np.argmax(cc)))
+
+
+def lag_template_offset(stimulus_signal, template_length,
+                        max_offset=None):
+    '''
+    Returns the start of the template of `windowed_channel_crosscorrelation`.
+
+    The template is placed at the first energetic region of the stimulus,
+    so that leading silence is skipped. The energy of the stimulus (over all
+    channels) is computed in blocks of `template_length /
+    LAG_TEMPLATE_BLOCKS` samples and the template starts at the first block
+    with at least half the energy of the most energetic one.
+
+    Args:
+        stimulus_signal: 2d array with the signal time series from the stimulus
+            audio or `Stimulus` instance
+        template_length: number of samples of the template
+        max_offset: if not None, maximum offset returned (e.g. for the
+            template to fit in the recording)
+
+    Returns:
+        offset of the template in samples
+    '''
+    if isinstance(stimulus_signal, Stimulus):
+        stimulus_signal = stimulus_signal.signal
+    limit = stimulus_signal.shape[0] - template_length
+    if max_offset is not None:
+        limit = min(limit, max_offset)
+    if limit <= 0:
+        return 0
+
+    block = max(1, template_length // LAG_TEMPLATE_BLOCKS)
+    blocks = (limit + template_length) // block
+    energy = np.empty(blocks)
+    # Read in chunks to bound the memory used by the float64 conversion
+    step = max(1, RECTIFY_BLOCK_SIZE // block)
+    for i in range(0, blocks, step):
+        j = min(i + step, blocks)
+        chunk = np.asarray(stimulus_signal[i * block:j * block],
+                           dtype=np.float64)
+        energy[i:j] = np.square(chunk).reshape(j - i, -1).sum(axis=1)
+    onset = int(np.argmax(energy >= energy.max() / 2)) * block
+    return min(onset, limit)
+
+
+def windowed_channel_crosscorrelation(stimulus_signal, recording_signal,
+                                      min_lag, max_lag,
+                                      template_length=None,
+                                      template_offset=None,
+                                      dtype=np.float64, scores=None):
+    '''
+    Version of `best_channel_crosscorrelation` for a bounded lag.
+
+    Only a part of the stimulus (`template_length` samples) is
+    cross-correlated with the part of the recording where it can start,
+    so the cost depends on the size of the window and not on the length
+    of the signals. The recording can be shorter or longer than the
+    stimulus.
+
+    Args:
+        stimulus_signal: 2d array with the signal time series from the stimulus
+            audio or `Stimulus` instance
+        recording_signal: 2d array with the signal time series from the
+            recording audio
+        min_lag, max_lag: range of lags in samples searched
+        template_length: number of samples of the stimulus correlated.
+            Defaults to the whole stimulus.
+        template_offset: start of the template in the stimulus. Defaults to
+            the first energetic region of the stimulus where the template
+            fits in the recording at max_lag (see `lag_template_offset`).
+        dtype: float type used for the cross-correlation
+        scores: see `best_channel_crosscorrelation`
+
+    Returns:
+        Same as `best_channel_crosscorrelation`
+
+    Raises:
+        SilentLagTemplate: if the template is silent, as any lag would
+            match it
+    '''
+    if isinstance(stimulus_signal, Stimulus):
+        stimulus_signal = stimulus_signal.signal
+    if min_lag < 0 or max_lag < min_lag:
+        raise ValueError('Invalid lag window: [{}, {}]'.format(min_lag,
+                                                              max_lag))
+    if template_length is None:
+        template_length = stimulus_signal.shape[0]
+    if template_offset is None:
+        template_offset = lag_template_offset(
+            stimulus_signal, template_length,
+            recording_signal.shape[0] - max_lag - template_length)
+
+    template = stimulus_signal[template_offset:
+                               template_offset + template_length]
+    rms = np.sqrt(np.mean(np.square(template, dtype=np.float64)))
+    if not rms > LAG_TEMPLATE_MIN_RMS:
+        raise errors.SilentLagTemplate(template_offset, template.shape[0])
+    segment = recording_signal[min_lag + template_offset:
+                               max_lag + template_offset + template.shape[0]]
+    maxima, argmaxima = crosscorrelation_matrix(segment, template, dtype)
+    if scores is not None:
+        scores['maxima'] = maxima
+    row, col = np.unravel_index(np.argmax(maxima), maxima.shape)
+    return (row, col, min_lag + argmaxima[row, col])
+
+
+def _lag_key(stimulus_file, recording_file, crosscorrelation_method,
+             refine=None, min_lag=None, max_lag=None,
+             resample_stimulus=False):
+    '''
+    Returns the key of the lag cache entry of a stimulus/recording pair.
+
+    Returns None if the stimulus was not read from a file.
+    '''
+    if isinstance(stimulus_file, Stimulus):
+        stimulus_file = stimulus_file.path
+    if stimulus_file is None:
+        return None
+    fields = ('lag', file_hash(stimulus_file), file_hash(recording_file),
+              crosscorrelation_method, bool(resample_stimulus))
+    if refine is not None:
+        fields += (refine,)
+    if min_lag is not None or max_lag is not None:
+        fields += ('window', min_lag, max_lag)
+    return entry_key(*fields)
+
+
+def _peaks_key(lag_key, distance, prominence, invert_input_signal,
+               threshold='global', input_channel=None):
+    'Returns the key of the peaks cache entry of an extraction.'
+    if lag_key is None:
+        return None
+    fields = ('peaks', lag_key, float(distance), float(prominence),
+              bool(invert_input_signal))
+    if threshold != 'global':
+        fields += (threshold,)
+    if input_channel is not None:
+        fields += ('channel', int(input_channel))
+    return entry_key(*fields)
+
+
+def _windowed_lag(stimulus_signal, recording_signal, sr, min_lag, max_lag,
+                  scores=None, recording_file=None):
+    '''
+    Calls windowed_channel_crosscorrelation with the lag window in ms.
+
+    The template is shortened if needed so that it fits in the recording at
+    every lag of the window, and placed with `lag_template_offset`.
+
+    Returns:
+        tuple (stimulus channel, recording channel, lag in samples,
+        template length in samples, template offset in samples)
+
+    Raises:
+        LagWindowOutsideRecording: if the window leaves no room in the
+            recording for the template
+    '''
+    length = recording_signal.shape[0]
+    template_length = min(int(DEFAULT_LAG_TEMPLATE * sr / 1000),
+                          len(stimulus_signal))
+    min_lag_s = 0 if min_lag is None else int(min_lag * sr / 1000)
+    last_lag_s = (min_lag_s if max_lag is None
+                  else int(np.ceil(max_lag * sr / 1000)))
+    if last_lag_s >= length:
+        raise errors.LagWindowOutsideRecording(
+            recording_file, min_lag or 0,
+            length / sr * 1000 if max_lag is None else max_lag,
+            length / sr * 1000)
+    template_length = min(template_length, length - last_lag_s)
+    offset = lag_template_offset(stimulus_signal, template_length,
+                                 length - last_lag_s - template_length)
+    max_lag_s = (length - offset - template_length if max_lag is None
+                 else last_lag_s)
+    si, ri, lag_s = windowed_channel_crosscorrelation(
+        stimulus_signal, recording_signal, min_lag_s, max_lag_s,
+        template_length, offset, scores=scores)
+    return si, ri, lag_s, template_length, offset
+
+
+def synchronize(stimulus_file, recording_file,
+                crosscorrelation_method=DEFAULT_CROSSCORRELATION_METHOD,
+                mmap=DEFAULT_MMAP, profiler=None, cache=None, refine=None,
+                resample_stimulus=False, min_lag=None, max_lag=None,
+                recording=None, qc=None):
+    '''
+    Reads the recording and finds its lag to the stimulus.
 
-    row = max_cor_idx // 2
-    col = max_cor_idx % 2
-    return (row, col, corrs[row][col]['argmax'])
+    Params:
+        stimulus_file, recording_file, crosscorrelation_method, mmap,
+        profiler, refine, resample_stimulus, min_lag, max_lag, recording:
+            see `extract_peaks`
+        cache: if not None, a `ResultCache` where the lag is looked up and
+            stored
+        qc: if not None, a dictionary that is filled with the normalized
+            `correlation` of the loopback at the lag and the
+            `channel_margin` of the loopback channel (see `m2.rec2taps.qc`).
+            Both are None when the lag is read from the cache.
+
+    Returns:
+        tuple (sample rate, recording signal, stimulus channel, loopback
+        channel of the recording, lag in samples). The lag is a float if
+        refine is not None.
+    '''
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    lag_key = cached_lag = None
+    if cache is not None:
+        with profiler.stage('lag_cache') as stage:
+            lag_key = _lag_key(stimulus_file, recording_file,
+                               crosscorrelation_method, refine, min_lag,
+                               max_lag, resample_stimulus)
+            if lag_key is not None:
+                cached_lag = cache.get_lag(lag_key)
+            stage['hit'] = cached_lag is not None
+
+    if cached_lag is None:
+        with profiler.stage('read_stimulus') as stage:
+            if isinstance(stimulus_file, Stimulus):
+                stimulus_sr, stimulus_signal = stimulus_file.sr, stimulus_file
+                stage['cached'] = True
+            elif resample_stimulus:
+                # Kept in the stimulus cache, which holds resampled stimuli
+                stimulus_signal = load_stimulus(stimulus_file)
+                stimulus_sr = stimulus_signal.sr
+            else:
+                stimulus_sr, stimulus_signal = read_audio(stimulus_file)
+                if profiler.enabled:
+                    stage['file_bytes'] = os.path.getsize(stimulus_file)
+                    stage.update(signal_metrics(stimulus_signal))
+
+    with profiler.stage('read_recording') as stage:
+        if recording is not None:
+            recording_sr, recording_signal = recording
+            stage['preloaded'] = True
+        else:
+            recording_sr, recording_signal = read_audio(recording_file, mmap)
+        if profiler.enabled and recording is None:
+            stage['file_bytes'] = os.path.getsize(recording_file)
+        if profiler.enabled:
+            stage['mmap'] = isinstance(recording_signal, np.memmap)
+            stage.update(signal_metrics(recording_signal))
+
+    if cached_lag is not None:
+        _, si, ri, lag_s, stimulus_sr = cached_lag
+        if stimulus_sr != recording_sr and not resample_stimulus:
+            raise errors.UnequalSampleRate(stimulus_file, recording_file,
+                                           stimulus_sr, recording_sr)
+        if qc is not None:
+            qc.update({'correlation': None, 'channel_margin': None})
+        return recording_sr, recording_signal, si, ri, lag_s
+
+    if (stimulus_sr != recording_sr):
+        if not resample_stimulus:
+            raise errors.UnequalSampleRate(stimulus_file, recording_file,
+                                           stimulus_sr, recording_sr)
+        with profiler.stage('resample_stimulus') as stage:
+            stage['from_sr'] = int(stimulus_sr)
+            stage['to_sr'] = int(recording_sr)
+            stimulus_signal = stimulus_signal.resampled(recording_sr)
+
+    scores = {} if qc is not None else None
+    # Part of the stimulus correlated to refine the lag. With a lag window,
+    # the template of the search is used.
+    refine_length = refine_offset = None
+    with profiler.stage('crosscorrelation') as stage:
+        stage['method'] = crosscorrelation_method
+        try:
+            if min_lag is None and max_lag is None:
+                si, ri, lag_s = best_channel_crosscorrelation(
+                    stimulus_signal, recording_signal,
+                    crosscorrelation_method, scores=scores)
+            else:
+                stage['method'] = 'windowed'
+                si, ri, lag_s, refine_length, refine_offset = _windowed_lag(
+                    stimulus_signal, recording_signal, recording_sr,
+                    min_lag, max_lag, scores, recording_file)
+        except errors.SignalTooShortForConvolution as r2te:
+            ne = errors.StimuliShorterThanRecording(stimulus_file,
+                                                    recording_file)
+            raise ne from r2te
+
+    if refine is not None:
+        with profiler.stage('refine_lag') as stage:
+            stage['method'] = refine
+            if isinstance(stimulus_signal, Stimulus):
+                stimulus_signal = stimulus_signal.signal
+            if refine_length is None:
+                # Same placement as the template of the windowed search, so
+                # leading silence is not correlated
+                refine_length = min(REFINE_LAG_LENGTH,
+                                    stimulus_signal.shape[0])
+                refine_offset = lag_template_offset(
+                    stimulus_signal, refine_length,
+                    recording_signal.shape[0] - lag_s - refine_length)
+            lag_s = refine_lag(stimulus_signal, si, recording_signal, ri,
+                               lag_s, refine, length=refine_length,
+                               offset=refine_offset)
+
+    if qc is not None:
+        with profiler.stage('qc_lag'):
+            if isinstance(stimulus_signal, Stimulus):
+                stimulus_signal = stimulus_signal.signal
+            qc.update({
+                'correlation': normalized_correlation(
+                    stimulus_signal, si, recording_signal, ri, lag_s),
+                'channel_margin': channel_margin(scores.get('maxima'), ri)
+            })
+
+    if lag_key is not None:
+        cache.put_lag(lag_key, recording_sr, si, ri, lag_s, stimulus_sr)
+
+    return recording_sr, recording_signal, si, ri, lag_s
+
+
+def select_input_channel(recording_file, channels, loopback_channel,
+                         channel=None):
+    '''
+    Returns the input channel of a recording.
+
+    Params:
+        recording_file: path of the recording, used in error messages
+        channels: number of channels of the recording
+        loopback_channel: channel of the stimulus loopback
+        channel: input channel requested, or None to use the channel that
+            is not the loopback in two channel recordings
+
+    Raises:
+        AmbiguousInputChannel: if channel is None and the recording has more
+            than two channels
+        InvalidInputChannel: if channel is not a channel of the recording
+    '''
+    if channel is None:
+        if channels > 2:
+            raise errors.AmbiguousInputChannel(recording_file, channels)
+        return 1 - int(loopback_channel)
+    if not 0 <= channel < channels:
+        raise errors.InvalidInputChannel(recording_file, channel, channels)
+    return int(channel)
+
+
+def lag_info(info, sr, si, ri, lag_s, input_channel=None):
+    '''
+    Fills an `extract_peaks` info dictionary with the result of
+    `synchronize`.
+
+    Params:
+        info: dictionary updated
+        sr, si, ri, lag_s: sample rate, stimulus and loopback channels and
+            lag in samples, as returned by `synchronize`
+        input_channel: channel of the input signal. Defaults to the channel
+            that is not the loopback, as in two channel recordings.
+    '''
+    info.update({
+        'sr': int(sr),
+        'stimulus_channel': int(si),
+        'loopback_channel': int(ri),
+        'input_channel': (1 - int(ri) if input_channel is None
+                          else int(input_channel)),
+        'lag_samples': float(lag_s),
+        'lag_ms': lag_s / sr * 1000
+    })
 
 
 def extract_peaks(stimulus_file, recording_file, 
                   distance=DEFAULT_DISTANCE, 
-                  prominence=DEFAULT_PROMINENCE,
+                  prominence=None,
                   debug_plot=None,
                   invert_input_signal=False,
+                  crosscorrelation_method=DEFAULT_CROSSCORRELATION_METHOD,
+                  block_size=None,
+                  mmap=DEFAULT_MMAP,
+                  profiler=None,
+                  cache=None,
+                  info=None,
+                  refine=None,
+                  resample_stimulus=False,
+                  min_lag=None,
+                  max_lag=None,
+                  debug_plot_window=None,
+                  plotter=None,
+                  recording=None,
+                  threshold='global',
+                  input_channel=None,
+                  qc=None,
                  ):
     '''
     Extracts peaks from recording file synchronized to the stimulus.
 
     The function extracts peaks from the recording file considering it has two
     channels, one with the loopback of the stimulus and another one with the
-    recording of the input device.
+    recording of the input device. Recordings with more channels require
+    the input channel to be given (see also `multichannel.extract_channels`).
 
     To select the channel from the recording file, it uses the one that has the
     lowest cross-correlation with any channel of the stimulus file.
@@ -141,38 +735,126 @@ def extract_peaks(stimulus_file, recording_file,
     as the recording file.
 
     Params:
-        stimulus_file: path to the stimulus audio file
-        recording_file: path to the recording audio file
+        stimulus_file: path to the stimulus audio file or `Stimulus` instance
+            (see `load_stimulus`) to reuse an already decoded stimulus
+        recording_file: path to the recording audio file. WAV files are read
+            with scipy, other formats (e.g. FLAC) with the reader of their
+            extension (see `readers.read_audio`).
         distance: minimum distance in ms between detected peaks
         prominence: minimum prominence of detected peaks in multiples of the
-            input recording signal in standard deviation
+            input recording signal in standard deviation (or of its local
+            noise level with the adaptive threshold). If None, the default of
+            the threshold method is used (see
+            `threshold.default_prominence`).
         debug_plot: if not None, string with file path to output a debug plot
             of the detected peaks
         invert_input_signal: if not True, input signal from recording_file
             is inverted (* -1)
+        crosscorrelation_method: method used to find the loopback channel
+            and lag (see `best_channel_crosscorrelation`)
+        block_size: if not None, the recording is memory-mapped and peaks
+            are found in blocks of this many samples (see
+            `stream_numpy_peaks`). Results are the same as when the input
+            signal is processed at once. Only WAV recordings are
+            memory-mapped, other formats are decoded in memory first.
+        mmap: if True, the recording is memory-mapped when its format
+            allows it (WAV), so that only the pages used are loaded
+        profiler: if not None, a `StageProfiler` where the time and metrics
+            of each stage (reading, cross-correlation, peak finding and
+            plotting) are recorded
+        cache: if not None, a `ResultCache` where results are looked up and
+            stored. If only the peak detection parameters changed since a
+            previous extraction, the cached lag is reused. The cache is not
+            used to skip the extraction when debug_plot is requested.
+        info: if not None, a dictionary that is filled with the sample rate
+            (`sr`), the channels used (`stimulus_channel`,
+            `loopback_channel` and `input_channel`) and the lag of the
+            recording (`lag_samples` and `lag_ms`)
+        refine: if not None, the lag and the peaks are refined to sub-sample
+            precision by interpolating the cross-correlation and the input
+            signal around each maximum, either with a parabola
+            ('parabolic') or a windowed sinc ('sinc'). See
+            `m2.rec2taps.refine`.
+        resample_stimulus: if True and the sample rates of the stimulus and
+            the recording differ, the stimulus is resampled to the rate of
+            the recording instead of raising `UnequalSampleRate`. Resampled
+            stimuli are cached per rate (see `Stimulus.resampled`). Tap times
+            are reported in the time base of the recording.
+        min_lag, max_lag: if either is not None, the lag of the recording
+            is only searched between min_lag (default: 0) and max_lag
+            (default: the length of the recording) ms, correlating
+            `DEFAULT_LAG_TEMPLATE` ms from the first energetic region of the
+            stimulus (see `windowed_channel_crosscorrelation`). The lag
+            search then takes the same time for any length of the session
+            and recordings shorter than the stimulus are accepted.
+        debug_plot_window: if not None, the debug plot only shows the
+            segments of this many ms around each peak (see
+            `plotting.debug_plot`)
+        plotter: if not None, a `plotting.BackgroundPlotter` where the debug
+            plot is queued instead of drawn before returning
+        recording: if not None, tuple (sample rate, signal) with the content
+            of recording_file already read (see `m2.rec2taps.aio`). The file
+            is then only used to key the cache.
+        threshold: 'global' or 'adaptive' (see `numpy_peaks`). The adaptive
+            threshold follows drifts and noise bursts of the input signal.
+            It can not be combined with block_size.
+        input_channel: if not None, the channel of the recording with the
+            input signal. Required if the recording has more than two
+            channels, otherwise the channel that is not the loopback is
+            used.
+        qc: if not None, a dictionary that is filled with quality control
+            metrics computed from the signals already read: the normalized
+            `correlation` of the loopback and the `channel_margin` of the
+            loopback channel (see `synchronize`), the clipping ratios, the
+            noise floor of the input channel and inter-tap interval
+            statistics (see `qc.signal_report`). As with debug_plot, the
+            cache is not used to skip the extraction.
 
     Returns:
         1d array of peaks in ms relative to the beginning of the stimulus
         signal
     '''
+    prominence = default_prominence(threshold, prominence)
     logging.debug(('Obtaining peaks for {} synched to {} with params '
                    'distance={} and prominence={}').format(
                        recording_file, stimulus_file, distance, prominence))
 
-    stimulus_sr, stimulus_signal = wavfile.read(stimulus_file)
-    recording_sr, recording_signal = wavfile.read(recording_file)
-
-    if (stimulus_sr != recording_sr):
-        raise errors.UnequalSampleRate(stimulus_file, recording_file,
-                                       stimulus_sr, recording_sr)
-
-    try:
-        si, ri, lag_s = best_channel_crosscorrelation(stimulus_signal,
-                                                      recording_signal)
-    except errors.SignalTooShortForConvolution as r2te:
-        ne = errors.StimuliShorterThanRecording(stimulus_file,
-                                                recording_file)
-        raise ne from r2te
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    if threshold != 'global' and block_size is not None:
+        raise ValueError('The {} threshold can not be used with '
+                         'block_size'.format(threshold))
+
+    peaks_key = None
+    if cache is not None and debug_plot is None and qc is None:
+        with profiler.stage('cache_lookup') as stage:
+            lag_key = _lag_key(stimulus_file, recording_file,
+                               crosscorrelation_method, refine, min_lag,
+                               max_lag, resample_stimulus)
+            peaks_key = _peaks_key(lag_key, distance, prominence,
+                                   invert_input_signal, threshold,
+                                   input_channel)
+            cached_peaks = (None if peaks_key is None
+                            else cache.get_peaks(peaks_key))
+            stage['hit'] = cached_peaks is not None
+        if cached_peaks is not None and info is not None:
+            cached_lag = cache.get_lag(lag_key)
+            if cached_lag is None:
+                cached_peaks = None
+            else:
+                lag_info(info, *cached_lag[:4], input_channel)
+        if cached_peaks is not None:
+            return cached_peaks
+
+    recording_sr, recording_signal, si, ri, lag_s = synchronize(
+        stimulus_file, recording_file, crosscorrelation_method,
+        mmap or block_size is not None, profiler, cache, refine,
+        resample_stimulus, min_lag, max_lag, recording, qc)
+    ii = select_input_channel(recording_file, recording_signal.shape[1], ri,
+                              input_channel)
+    if info is not None:
+        lag_info(info, recording_sr, si, ri, lag_s, ii)
 
     logging.debug(('Obtaining lag from recording to '
                    'stimulus using channels {} and {} '
@@ -182,24 +864,53 @@ def extract_peaks(stimulus_file, recording_file,
     lag = lag_s / recording_sr * 1000
     logging.debug(('Recording is delayed {} ms from the stimulus').format(lag))
 
-    fsr_signal = recording_signal[:, 1-ri]
-    
-    fsr_signal = fsr_signal * (1 - 2 * int(invert_input_signal))
-
-    peaks = numpy_peaks(fsr_signal, recording_sr, distance, prominence)
+    # Column view, not copied until rectification
+    fsr_signal = recording_signal[:, ii]
+
+    with profiler.stage('peaks') as stage:
+        if block_size is None:
+            if invert_input_signal:
+                fsr_signal = np.negative(fsr_signal, dtype=np.float64)
+            # The inverted copy is not used after finding the peaks, as
+            # refinement and plotting read the recording
+            peaks = numpy_peaks(fsr_signal, recording_sr, distance,
+                                prominence,
+                                overwrite_data=invert_input_signal,
+                                threshold=threshold)
+        else:
+            peaks = stream_numpy_peaks(fsr_signal, recording_sr, distance,
+                                       prominence, invert_input_signal,
+                                       block_size)
+        stage['threshold'] = threshold
+        stage['samples'] = fsr_signal.shape[0]
+        stage['peaks'] = len(peaks)
+
+    if refine is not None:
+        with profiler.stage('refine_peaks') as stage:
+            stage['method'] = refine
+            peaks = refine_maxima(recording_signal[:, ii], peaks, refine,
+                                  invert_input_signal)
 
     recording_peaks = (np.array(peaks) / recording_sr * 1000)
 
 
-    if debug_plot is not None and CAN_DEBUG_PLOT:
-        plt.figure(figsize=(10, 6))
-        plt.plot(np.arange(fsr_signal.shape[0]) / recording_sr * 1000,
-                 fsr_signal, color='C2')
-        ymin, ymax = plt.ylim()
-        plt.yticks([])
-        plt.vlines(recording_peaks, ymin, ymax, color='C1')
-        plt.xlabel('time (ms)')
-        plt.ylabel('amplitude')
-        plt.savefig(debug_plot)
-
-    return recording_peaks - lag
+    if debug_plot is not None:
+        with profiler.stage('debug_plot') as stage:
+            plot_args = (debug_plot, recording_signal[:, ii],
+                         recording_sr, recording_peaks, invert_input_signal,
+                         debug_plot_window)
+            if plotter is not None:
+                plotter.submit(*plot_args)
+                stage['background'] = True
+            else:
+                plotting.debug_plot(*plot_args)
+
+    peaks = recording_peaks - lag
+    if qc is not None:
+        with profiler.stage('qc'):
+            qc.update(signal_report(recording_signal, recording_sr, ii, ri,
+                                    peaks))
+
+    if peaks_key is not None:
+        cache.put_peaks(peaks_key, peaks)
+    return peaks
@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import functools
+import logging
+import m2.rec2taps
+from m2.rec2taps import batch
+from m2.rec2taps.readers import read_audio
+from m2.rec2taps.stimulus import Stimulus, load_stimulus
+from m2.rec2taps.defaults import DEFAULT_AIO_CONCURRENCY
+from m2.rec2taps.defaults import DEFAULT_AIO_READ_AHEAD
+
+
+async def read_pair(stimulus_file, recording_file, executor=None):
+    '''
+    Reads a stimulus/recording pair without blocking the event loop.
+
+    Files are read by `executor` (the default executor of the loop if None).
+    The stimulus is loaded through `load_stimulus`, so it is decoded once.
+    The recording is read into memory, so that later processing does not
+    wait for the storage.
+
+    Returns:
+        tuple (`Stimulus`, (sample rate, recording signal))
+    '''
+    loop = asyncio.get_running_loop()
+    if isinstance(stimulus_file, Stimulus):
+        stimulus = stimulus_file
+    else:
+        stimulus = await loop.run_in_executor(executor, load_stimulus,
+                                              stimulus_file)
+    recording = await loop.run_in_executor(executor, read_audio,
+                                           recording_file)
+    return stimulus, recording
+
+
+async def extract_peaks(stimulus_file, recording_file, executor=None,
+                        io_executor=None, **kwargs):
+    '''
+    Asynchronous version of `m2.rec2taps.extract_peaks`.
+
+    The files are read by `io_executor` (see `read_pair`) and the
+    cross-correlation and peak finding run in `executor`. Both default to
+    the default executor of the loop. Executors must be thread pools, as the
+    decoded stimulus is shared with the extraction.
+
+    Params:
+        stimulus_file, recording_file: see `m2.rec2taps.extract_peaks`
+        executor: executor where the extraction runs
+        io_executor: executor where the files are read
+        kwargs: additional keyword arguments for `m2.rec2taps.extract_peaks`
+
+    Returns:
+        1d array of peaks in ms relative to the beginning of the stimulus
+        signal
+    '''
+    loop = asyncio.get_running_loop()
+    stimulus, recording = await read_pair(stimulus_file, recording_file,
+                                          io_executor)
+    return await loop.run_in_executor(executor, functools.partial(
+        m2.rec2taps.extract_peaks, stimulus, recording_file,
+        recording=recording, **kwargs))
+
+
+async def _read_item(item, executor):
+    'Reads a batch item, returning None for the recording on failure.'
+    try:
+        return await read_pair(item['stimulus'], item['recording'], executor)
+    except (ValueError, OSError) as e:
+        # The error is reported by extract_item, which reads the files again
+        logging.debug('Failed to read {}: {}'.format(item['recording'], e))
+        return None, None
+
+
+async def _process_item(item, loaded, computing, executor, io_executor,
+                        options):
+    loop = asyncio.get_running_loop()
+    try:
+        _, recording = await _read_item(item, io_executor)
+        item_options = dict(options)
+        if recording is not None:
+            item_options['recording'] = recording
+        async with computing:
+            return await loop.run_in_executor(executor, functools.partial(
+                batch.extract_item, item, **item_options))
+    finally:
+        # The recording is released once its peaks are found
+        loaded.release()
+
+
+async def extract_stream(items, concurrency=DEFAULT_AIO_CONCURRENCY,
+                         read_ahead=DEFAULT_AIO_READ_AHEAD, executor=None,
+                         io_executor=None, **options):
+    '''
+    Extracts peaks for a stream of stimulus/recording pairs.
+
+    Processing is pipelined: while `concurrency` items are being extracted,
+    the files of up to `read_ahead` following items are read. At most
+    `concurrency + read_ahead` recordings are held in memory at a time.
+
+    Errors raised while processing an item are reported in its result, as
+    in `batch.extract_batch`.
+
+    Params:
+        items: iterable or asynchronous iterable of batch items (see
+            `batch.read_manifest`)
+        concurrency: maximum number of items extracted at a time
+        read_ahead: maximum number of items read while waiting to be
+            extracted
+        executor, io_executor: see `extract_peaks`
+        options: additional keyword arguments for `batch.extract_item`
+
+    Yields:
+        result dictionaries (see `batch.extract_item`), in the order of the
+        items
+    '''
+    if concurrency < 1 or read_ahead < 0:
+        raise ValueError('concurrency must be positive and read_ahead '
+                         'non-negative')
+    loaded = asyncio.Semaphore(concurrency + read_ahead)
+    computing = asyncio.Semaphore(concurrency)
+    if not hasattr(items, '__aiter__'):
+        items = _aiter(items)
+
+    pending = collections.deque()
+    try:
+        async for item in items:
+            await loaded.acquire()
+            pending.append(asyncio.ensure_future(_process_item(
+                item, loaded, computing, executor, io_executor, options)))
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
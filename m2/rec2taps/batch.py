@@ -0,0 +1,310 @@
+import csv
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import m2.rec2taps
+from m2.rec2taps import output
+from m2.rec2taps import plotting
+from m2.rec2taps import qc as quality
+from m2.rec2taps.readers import read_audio
+from m2.rec2taps.threshold import default_prominence
+from m2.rec2taps.defaults import DEFAULT_DISTANCE
+from m2.rec2taps.stimulus import load_stimulus
+from m2.rec2taps.profiling import StageProfiler
+
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def parse_parameters(row):
+    '''
+    Returns the detection parameters of a manifest row (or worker request).
+
+    The optional `distance`, `prominence` and `invert` values are converted
+    from text (or JSON) values, and missing or empty ones are left out.
+    '''
+    parameters = {}
+    if row.get('distance') not in (None, ''):
+        parameters['distance'] = int(row['distance'])
+    if row.get('prominence') not in (None, ''):
+        parameters['prominence'] = float(row['prominence'])
+    if row.get('invert') not in (None, ''):
+        parameters['invert'] = _parse_bool(row['invert'])
+    return parameters
+
+
+def _parse_row(row, base_dir):
+    'Normalizes a manifest row into a batch item dictionary.'
+    item = {
+        'stimulus': os.path.join(base_dir, row['stimulus']),
+        'recording': os.path.join(base_dir, row['recording']),
+    }
+    item.update(parse_parameters(row))
+    if row.get('output') not in (None, ''):
+        item['output'] = os.path.join(base_dir, row['output'])
+    return item
+
+
+def read_manifest(manifest_file):
+    '''
+    Reads a batch manifest from a CSV or JSON file.
+
+    The manifest lists one stimulus/recording pair per row with the columns
+    `stimulus` and `recording`, and optionally `distance`, `prominence`,
+    `invert` and `output`. CSV manifests must have a header row. JSON
+    manifests must contain a list of objects with the same keys.
+
+    Relative paths are resolved against the directory of the manifest.
+
+    Params:
+        manifest_file: path to a `.csv` or `.json` manifest
+
+    Returns:
+        list of dictionaries, one per row, in manifest order
+    '''
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, newline='') as f:
+        if manifest_file.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    return [_parse_row(row, base_dir) for row in rows]
+
+
+def extract_item(item, distance=DEFAULT_DISTANCE,
+                 prominence=None, invert_input_signal=False,
+                 profile=False, qc=False, **options):
+    '''
+    Extracts peaks for a single batch item, capturing per-file errors.
+
+    Values present in the item take precedence over the ones passed as
+    arguments. A prominence of None is the default of the threshold method
+    (see `threshold.default_prominence`). Additional `options` are passed
+    to `extract_peaks`. Stimuli are loaded through `load_stimulus`, so a
+    worker decodes each stimulus file once and reuses it for later items.
+
+    Returns:
+        dictionary with the item's `stimulus` and `recording`, the
+        parameters used (`distance`, `prominence` and `invert`), the `peaks`
+        found (None on failure), the `info` filled by `extract_peaks`, an
+        `error` message (None on success), if `profile` is True, the
+        `profile` report of `StageProfiler` and, if `qc` is True, the `qc`
+        report filled by `extract_peaks` with the names of the metrics out
+        of range as `qc_flags` (see `qc.qc_flags`)
+    '''
+    result = {
+        'stimulus': item['stimulus'],
+        'recording': item['recording'],
+        'distance': item.get('distance', distance),
+        'prominence': default_prominence(
+            options.get('threshold', 'global'),
+            item.get('prominence', prominence)),
+        'invert': item.get('invert', invert_input_signal),
+        'peaks': None,
+        'info': {},
+        'error': None
+    }
+    if profile:
+        profiler = options['profiler'] = StageProfiler()
+    if qc:
+        result['qc'] = options['qc'] = {}
+    try:
+        result['peaks'] = m2.rec2taps.extract_peaks(
+            load_stimulus(item['stimulus']), item['recording'],
+            distance=result['distance'],
+            prominence=result['prominence'],
+            invert_input_signal=result['invert'],
+            info=result['info'],
+            **options)
+    except (ValueError, OSError) as e:
+        # Rec2TapsError subclasses ValueError, as do malformed audio files
+        logging.debug('Failed to process {}: {}'.format(item['recording'],
+                                                        e))
+        result['error'] = str(e)
+    if profile:
+        result['profile'] = profiler.report()
+    if qc:
+        result['qc_flags'] = quality.qc_flags(result['qc'])
+    return result
+
+
+def _extract_item_star(args):
+    *args, options = args
+    return extract_item(*args, **options)
+
+
+def _extract_chunk(chunk):
+    return [_extract_item_star(args) for args in chunk]
+
+
+def plot_result(result, filename, window=None):
+    '''
+    Draws the debug plot of a successful batch result.
+
+    The input channel of the recording is read again (memory-mapped), so
+    the plot can be drawn apart from the extraction. The directory of the
+    file is created if needed.
+    '''
+    info = result['info']
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    sr, signal = read_audio(result['recording'], mmap=True)
+    plotting.debug_plot(filename, signal[:, info['input_channel']], sr,
+                        result['peaks'] + info['lag_ms'], result['invert'],
+                        window)
+
+
+def extract_batch(items, processes=None, distance=DEFAULT_DISTANCE,
+                  prominence=None, invert_input_signal=False,
+                  chunksize=1, profile=False, plot_dir=None,
+                  plot_window=None, qc=False, **options):
+    '''
+    Extracts peaks for many stimulus/recording pairs using a process pool.
+
+    Errors raised while processing an item (e.g. `Rec2TapsError`) are
+    reported in that item's result and do not stop the batch. Results are
+    returned in the same order as the items.
+
+    Params:
+        items: list of batch items as returned by `read_manifest`
+        processes: number of worker processes. If None, the number of CPUs
+            is used. If 1, items are processed in the calling process.
+        distance, prominence, invert_input_signal: defaults for items that
+            do not define their own values
+        chunksize: number of items sent to a worker at a time. Up to two
+            chunks per process are queued at a time.
+        profile: if True, each result includes a per-stage `profile` report
+        plot_dir: if not None, a debug plot of each item is written to this
+            directory (see `plot_path` and `recording_root`). Plots are
+            drawn by the pool as tasks of their own, queued between the
+            extractions of the next chunks, or by a background thread if
+            processes is 1, while the extraction of other items continues.
+        plot_window: see `debug_plot_window` of `extract_peaks`
+        qc: if True, each result includes a `qc` report and its `qc_flags`
+            (see `extract_item`)
+        options: additional keyword arguments for `extract_peaks`
+
+    Returns:
+        list of result dictionaries (see `extract_item`)
+    '''
+    args = [(item, distance, prominence, invert_input_signal, profile, qc,
+             options)
+            for item in items]
+    plots = []
+    if plot_dir is not None:
+        root = recording_root(items)
+        plots = [(plot_path(item, plot_dir, root=root), plot_window)
+                 for item in items]
+
+    if processes == 1:
+        results = []
+        plotter = plotting.BackgroundPlotter() if plots else None
+        try:
+            for i, a in enumerate(args):
+                results.append(_extract_item_star(a))
+                if plots and results[-1]['error'] is None:
+                    plotter.submit_call(plot_result, results[-1], *plots[i])
+        finally:
+            if plotter is not None:
+                plotter.close()
+        return results
+
+    chunks = iter([args[i:i + chunksize]
+                   for i in range(0, len(args), chunksize)])
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = []
+        futures = []
+        pending = deque()
+
+        def submit_chunk():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(_extract_chunk, chunk))
+
+        # Extractions are queued a few chunks at a time, so the plots of
+        # the chunks done are queued before the extraction of the remaining
+        # ones instead of after all of them
+        for _ in range(2 * (processes or os.cpu_count() or 1)):
+            submit_chunk()
+        while pending:
+            for result in pending.popleft().result():
+                if plots and result['error'] is None:
+                    futures.append(executor.submit(
+                        plot_result, result, *plots[len(results)]))
+                results.append(result)
+            submit_chunk()
+        for future in futures:
+            if future.exception() is not None:
+                logging.error('Failed to draw debug plot: {}'.format(
+                    future.exception()))
+    return results
+
+
+def recording_root(items):
+    '''
+    Returns the deepest directory that contains the recordings of the items.
+
+    Output and plot files are named after the path of each recording
+    relative to this directory (see `output_path`), so recordings with the
+    same name in different directories (e.g. one per participant) do not
+    overwrite each other.
+    '''
+    if not items:
+        return None
+    return os.path.commonpath([os.path.dirname(os.path.abspath(
+        item['recording'])) for item in items])
+
+
+def _item_name(item, root):
+    'Returns the recording path relative to root without extension.'
+    if root is None:
+        name = os.path.basename(item['recording'])
+    else:
+        name = os.path.relpath(os.path.abspath(item['recording']), root)
+    return os.path.splitext(name)[0]
+
+
+def output_path(item, output_dir, root=None):
+    '''
+    Returns the file where the peaks of a batch item are written.
+
+    If root is not None (see `recording_root`), the directories of the
+    recording below root are mirrored in output_dir.
+    '''
+    if 'output' in item:
+        return item['output']
+    return os.path.join(output_dir, _item_name(item, root) + '.txt')
+
+
+def format_peaks(peaks):
+    'Returns the text of peaks, one per line.'
+    return ''.join('{}\n'.format(p) for p in peaks)
+
+
+def plot_path(item, plot_dir, extension='.png', root=None):
+    '''
+    Returns the file where the debug plot of a batch item is drawn, mirroring
+    the directories of the recording below root as `output_path`.
+    '''
+    return os.path.join(plot_dir, _item_name(item, root) + extension)
+
+
+def write_peaks(peaks, filename):
+    'Writes peaks to a file, one per line.'
+    with open(filename, 'w') as f:
+        f.write(format_peaks(peaks))
+
+
+def result_sessions(results):
+    'Returns the successful batch results as `output.session` results.'
+    return [output.session(r['stimulus'], r['recording'], r['distance'],
+                           r['prominence'], r['invert'], r['info'],
+                           r['peaks'])
+            for r in results if r['error'] is None]
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+from m2.rec2taps.defaults import (DEFAULT_CACHE_SIZE, CACHE_DIR_ENV,
+                                  FILE_HASH_CACHE_SIZE)
+
+HASH_CHUNK_SIZE = 2 ** 20
+
+_file_hashes = OrderedDict()
+_file_hashes_lock = threading.Lock()
+
+
+def default_cache_dir():
+    'Cache directory from $REC2TAPS_CACHE_DIR or the user cache directory.'
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'rec2taps')
+
+
+def file_hash(path):
+    '''
+    Returns a hash of the content of a file.
+
+    Hashes are memoized in the process by path, size and modification time,
+    so a file is only read again if it changes. The `FILE_HASH_CACHE_SIZE`
+    most recently used hashes are kept.
+    '''
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        if key in _file_hashes:
+            _file_hashes.move_to_end(key)
+            return _file_hashes[key]
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[key] = digest
+        while len(_file_hashes) > FILE_HASH_CACHE_SIZE:
+            _file_hashes.popitem(last=False)
+    return digest
+
+
+def entry_key(*fields):
+    'Returns the cache key of the given fields.'
+    return hashlib.blake2b(repr(fields).encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    '''
+    On-disk cache of `extract_peaks` results.
+
+    Two kinds of entries are stored as `.npz` files:
+
+    * lag entries, keyed by the content of the stimulus and recording files
+      and the cross-correlation and resampling options, with the sample
+      rates, the loopback channels and the lag in samples.
+    * peaks entries, keyed by the lag entry key and the peak detection
+      parameters, with the resulting peaks.
+
+    As the lag does not depend on the peak detection parameters, changing
+    them only requires finding the peaks again.
+
+    The least recently used entries are removed when the size of the cache
+    exceeds `max_bytes`.
+
+    Params:
+        directory: cache directory. Defaults to `default_cache_dir()`.
+        max_bytes: maximum size of the cache in bytes
+    '''
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = (default_cache_dir() if directory is None
+                          else directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, '{}.{}.npz'.format(key, kind))
+
+    def _get(self, kind, key):
+        path = self._path(kind, key)
+        try:
+            with np.load(path) as entry:
+                values = {k: entry[k] for k in entry.files}
+        except (OSError, ValueError, EOFError, KeyError,
+                zipfile.BadZipFile):
+            # Missing, truncated or corrupt entries are computed again
+            return None
+        try:
+            # Entries are evicted by modification time
+            os.utime(path)
+        except OSError:
+            pass
+        logging.debug('Cache hit for {} entry {}'.format(kind, key))
+        return values
+
+    def _put(self, kind, key, **values):
+        # Written to a temporary file and renamed, so concurrent readers
+        # never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **values)
+            os.replace(tmp, self._path(kind, key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def get_lag(self, key):
+        '''
+        Returns the cached (sample rate, stimulus channel, recording channel,
+        lag in samples, stimulus sample rate) or None.
+        '''
+        entry = self._get('lag', key)
+        if entry is None:
+            return None
+        # The lag is a float if it was refined to sub-sample precision
+        return tuple(entry[k].item()
+                     for k in ['sr', 'si', 'ri', 'lag', 'stimulus_sr'])
+
+    def put_lag(self, key, sr, si, ri, lag, stimulus_sr):
+        self._put('lag', key, sr=sr, si=si, ri=ri, lag=lag,
+                  stimulus_sr=stimulus_sr)
+
+    def get_peaks(self, key):
+        'Returns the cached peaks or None.'
+        entry = self._get('peaks', key)
+        return None if entry is None else entry['peaks']
+
+    def put_peaks(self, key, peaks):
+        self._put('peaks', key, peaks=peaks)
+
+    def entries(self):
+        'Returns (path, size, mtime) of the entries, oldest first.'
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.npz'):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((e.path, st.st_size, st.st_mtime_ns))
+        return sorted(entries, key=lambda e: e[2])
+
+    def size(self):
+        'Total size in bytes of the entries.'
+        return sum(e[1] for e in self.entries())
+
+    def evict(self):
+        'Removes the least recently used entries beyond max_bytes.'
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        'Removes all the entries of the cache.'
+        for e in os.scandir(self.directory):
+            if e.name.endswith(('.npz', '.tmp')):
+                try:
+                    os.unlink(e.path)
+                except OSError:
+                    pass
@@ -1,10 +1,119 @@
 import argparse
+import csv
+import json
 import os
 import sys
 import m2.rec2taps
 import logging
+from m2.rec2taps import batch
+from m2.rec2taps import sweep
+from m2.rec2taps import multichannel
+from m2.rec2taps import qc as quality
+from m2.rec2taps import worker
+from m2.rec2taps import output
 from m2.rec2taps import defaults
 from m2.rec2taps import errors
+from m2.rec2taps.profiling import StageProfiler
+from m2.rec2taps.cache import ResultCache
+from m2.rec2taps.refine import REFINE_METHODS
+from m2.rec2taps.threshold import THRESHOLD_METHODS, default_prominence
+
+# Options forwarded as keyword arguments to extract_peaks only when given
+EXTRACT_OPTIONS = ['crosscorrelation_method', 'block_size', 'refine',
+                   'resample_stimulus', 'min_lag', 'max_lag',
+                   'debug_plot_window', 'threshold']
+
+
+def extract_options(args):
+    'Returns the optional extract_peaks arguments set in the command line.'
+    return {k: v for k, v in vars(args).items() if k in EXTRACT_OPTIONS}
+
+
+def add_cache_arguments(parser):
+    'Adds the result cache options to a parser.'
+    parser.add_argument('--cache', dest='cache', default=None, nargs='?',
+                        const='',
+                        help=('Stores results in an on-disk cache and reuses '
+                              'them for unchanged files and parameters. Can '
+                              'receive the cache directory (default: ${} or '
+                              '~/.cache/rec2taps). Enabled when ${} is '
+                              'set.').format(defaults.CACHE_DIR_ENV,
+                                             defaults.CACHE_DIR_ENV))
+    parser.add_argument('--no_cache', dest='no_cache', action='store_true',
+                        help='Disables the result cache.')
+    parser.add_argument('--clear_cache', dest='clear_cache',
+                        action='store_true',
+                        help=('Removes all the entries of the result cache '
+                              '(the default one if --cache is not given).'))
+
+
+def result_cache(args):
+    '''
+    Returns the ResultCache selected in the command line or None.
+
+    --clear_cache clears the given cache directory (or the default one) even
+    if the cache is not enabled.
+    '''
+    if args.clear_cache:
+        ResultCache(args.cache or None).clear()
+    if args.no_cache:
+        return None
+    if args.cache is None and not os.environ.get(defaults.CACHE_DIR_ENV):
+        return None
+    return ResultCache(args.cache or None)
+
+
+def add_timing_arguments(parser):
+    'Adds the lag window, refinement, resampling and threshold options.'
+    parser.add_argument('--min_lag', dest='min_lag', type=float,
+                        default=argparse.SUPPRESS,
+                        help=('Minimum delay (in ms) of the loopback '
+                              'recording (default: 0 if --max_lag is '
+                              'given).'))
+    parser.add_argument('--max_lag', dest='max_lag', type=float,
+                        default=argparse.SUPPRESS,
+                        help=('Maximum delay (in ms) of the loopback '
+                              'recording. When a lag window is given, only '
+                              'the first {} ms of the stimuli are '
+                              'correlated within the window, so the lag '
+                              'search does not depend on the session length '
+                              'and recordings may be shorter than the '
+                              'stimuli.').format(
+                                  defaults.DEFAULT_LAG_TEMPLATE))
+    parser.add_argument('--refine', dest='refine', choices=REFINE_METHODS,
+                        default=argparse.SUPPRESS,
+                        help=('Refines the lag and the tap times to '
+                              'sub-sample precision by interpolating around '
+                              'each maximum with a parabola or a windowed '
+                              'sinc.'))
+    parser.add_argument('--resample', dest='resample_stimulus',
+                        action='store_true', default=argparse.SUPPRESS,
+                        help=('Resamples the stimuli to the sample rate of '
+                              'the recording when they differ, instead of '
+                              'failing. Tap times are reported in the time '
+                              'base of the recording.'))
+    parser.add_argument('--threshold', dest='threshold',
+                        choices=THRESHOLD_METHODS, default=argparse.SUPPRESS,
+                        help=('Threshold used to detect taps: "global" uses '
+                              'the std of the whole input signal, '
+                              '"adaptive" follows the median and noise level '
+                              'of the input signal over {} ms windows, so '
+                              'drifts and noise bursts do not require other '
+                              '-p values. With "adaptive", -p is in '
+                              'multiples of the local noise level '
+                              '(default: {}).').format(
+                                  defaults.DEFAULT_THRESHOLD_WINDOW,
+                                  defaults.DEFAULT_ADAPTIVE_PROMINENCE))
+
+
+def write_profile(report, filename):
+    'Writes a profiling or QC report as JSON to a file or to stderr if "-".'
+    if filename == '-':
+        print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
+
 
 def rec2taps():
     parser = argparse.ArgumentParser(
@@ -26,9 +135,13 @@ def rec2taps():
                         type=int, default=defaults.DEFAULT_DISTANCE, 
                         help='Minimum distance (in ms) between detected peaks')
     parser.add_argument('-p', dest='prominence',
-                        type=float, default=defaults.DEFAULT_PROMINENCE,
+                        type=float, default=None,
                         help=('Minimum prominence of the detected peaks '
-                              '(in multiples of the input signal std).'))
+                              '(in multiples of the input signal std). '
+                              'Default: {} ({} with --threshold '
+                              'adaptive).').format(
+                                  defaults.DEFAULT_PROMINENCE,
+                                  defaults.DEFAULT_ADAPTIVE_PROMINENCE))
     parser.add_argument('-v', dest='verbose',
                         action='store_true', 
                         help=('Enables printing standard information.'))
@@ -37,13 +150,71 @@ def rec2taps():
                         default=None, nargs='?',
                         help=('Enables outputting a debug plot overlaying '
                               'peaks with the recording signal. Can receive '
-                              'an argument to define the output filename.'))
+                              'an argument to define the output filename, '
+                              'whose extension sets the format (e.g. .png '
+                              'for a raster image, faster for long '
+                              'recordings).'))
+    parser.add_argument('--plot_window', dest='debug_plot_window',
+                        type=float, default=argparse.SUPPRESS,
+                        help=('Plots only the given number of ms around '
+                              'each detected tap, overlaid, in the debug '
+                              'plot.'))
     parser.add_argument('-i', dest='invert_input',
                         default=False, action='store_true',
                         help=('Enables outputting a debug plot overlaying '
                               'peaks with the recording signal. Can receive '
                               'an argument to define the output filename.'))
+    parser.add_argument('--lag_method', dest='crosscorrelation_method',
+                        choices=['exhaustive', 'coarse'],
+                        default=argparse.SUPPRESS,
+                        help=('Method used to find the loopback lag: '
+                              '"exhaustive" cross-correlates at the native '
+                              'sample rate, "coarse" searches a decimated '
+                              'signal and refines the lag at full rate '
+                              '(default: {}).').format(
+                                  defaults.DEFAULT_CROSSCORRELATION_METHOD))
+    parser.add_argument('--stream', dest='block_size', type=int,
+                        nargs='?', const=defaults.DEFAULT_BLOCK_SIZE,
+                        default=argparse.SUPPRESS,
+                        help=('Memory-maps the recording and finds peaks in '
+                              'blocks of the given number of samples '
+                              '(default: {}), for WAV recordings larger than '
+                              'memory. Other formats are decoded in memory.'
+                              ).format(defaults.DEFAULT_BLOCK_SIZE))
+    parser.add_argument('--profile', dest='profile', default=None,
+                        nargs='?', const='-',
+                        help=('Emits a JSON report with the time and metrics '
+                              'of each extraction stage to the given file '
+                              '(default: standard error).'))
+    parser.add_argument('--qc', dest='qc', default=None,
+                        nargs='?', const='-',
+                        help=('Emits a JSON quality control report (loopback '
+                              'correlation and channel margin, clipping, '
+                              'noise floor and inter-tap interval '
+                              'statistics, with the "flags" of the metrics '
+                              'out of range) to the given file (default: '
+                              'standard error).'))
+    parser.add_argument('--output', dest='output', default=None,
+                        help=('Writes the tap times with the session '
+                              'metadata (files, channels, lag and '
+                              'parameters) to a table file instead of the '
+                              'standard output. The format is chosen by the '
+                              'extension: {}. Parquet and Arrow require '
+                              'pyarrow.').format(', '.join(output.FORMATS)))
+    parser.add_argument('-c', '--channels', dest='channels', type=int,
+                        nargs='+', default=argparse.SUPPRESS,
+                        help=('Input channels of a multichannel recording. '
+                              'The loopback is found once and taps are '
+                              'extracted from every channel given, written '
+                              'to the standard output as CSV with columns '
+                              '"input_channel" and "tap_ms" (or to the '
+                              '--output table). Can not be combined with '
+                              '-D.'))
+    add_timing_arguments(parser)
+    add_cache_arguments(parser)
     args = parser.parse_args()
+    args.prominence = default_prominence(getattr(args, 'threshold', 'global'),
+                                         args.prominence)
 
     if not os.path.isfile(args.stimuli_file):
         print('{} does not refer to a file.'.format(args.stimuli_file))
@@ -57,20 +228,356 @@ def rec2taps():
                             format="Debug: {message}",
                             style='{')
 
+    options = extract_options(args)
+    if args.profile is not None:
+        options['profiler'] = StageProfiler()
+    if args.qc is not None:
+        options['qc'] = {}
+    cache = result_cache(args)
+    if cache is not None:
+        options['cache'] = cache
+
+    if 'channels' in args:
+        if args.qc is not None:
+            print('QC reports are not supported with --channels.',
+                  file=sys.stderr)
+            sys.exit()
+        if args.debug_plot is not None:
+            print('Debug plots are not supported with --channels.',
+                  file=sys.stderr)
+            sys.exit()
+        extract_multichannel(args, options)
+        return
+
     try:
+        if args.output is not None:
+            output.output_format(args.output)
+            options['info'] = {}
         peaks = m2.rec2taps.extract_peaks(args.stimuli_file,
                                           args.recording_file,
                                           args.distance,
                                           args.prominence,
                                           args.debug_plot,
-                                          args.invert_input
+                                          args.invert_input,
+                                          **options
                                          )
+        if args.output is not None:
+            output.write_results([output.session(
+                args.stimuli_file, args.recording_file, args.distance,
+                args.prominence, args.invert_input, options['info'], peaks)
+            ], args.output)
+    except errors.Rec2TapsError as r2te:
+        print(r2te, file=sys.stderr)
+        sys.exit()
+
+    if args.profile is not None:
+        write_profile(options['profiler'].report(), args.profile)
+
+    if args.qc is not None:
+        write_profile(dict(options['qc'],
+                           flags=quality.qc_flags(options['qc'])), args.qc)
+
+    if args.output is None:
+        sys.stdout.write(batch.format_peaks(peaks))
+
+
+def extract_multichannel(args, options):
+    'Runs rec2taps with --channels.'
+    options.pop('debug_plot_window', None)
+    info = {}
+    try:
+        if args.output is not None:
+            output.output_format(args.output)
+        peaks = multichannel.extract_channels(
+            args.stimuli_file, args.recording_file, args.channels,
+            args.distance, args.prominence, args.invert_input, info=info,
+            **options)
+        if args.output is not None:
+            output.write_results([output.session(
+                args.stimuli_file, args.recording_file, args.distance,
+                args.prominence, args.invert_input,
+                dict(info, input_channel=c), p)
+                for c, p in peaks.items()], args.output)
     except errors.Rec2TapsError as r2te:
         print(r2te, file=sys.stderr)
         sys.exit()
 
-    for p in peaks:
-        print(p)
+    if args.profile is not None:
+        write_profile(options['profiler'].report(), args.profile)
+
+    if args.output is None:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['input_channel', 'tap_ms'])
+        writer.writerows((c, t) for c, p in peaks.items() for t in p)
+
+
+def rec2taps_batch():
+    parser = argparse.ArgumentParser(
+        description=('Obtain tap times for every stimuli/recording pair '
+                     'listed in a manifest file, using a pool of worker '
+                     'processes. The manifest is a CSV (with header) or JSON '
+                     'file with columns "stimulus" and "recording", and '
+                     'optionally "distance", "prominence", "invert" and '
+                     '"output".')
+    )
+
+    parser.add_argument('manifest_file', type=str,
+                        help='CSV or JSON manifest of the files to process')
+    parser.add_argument('-o', dest='output_dir', type=str, default='.',
+                        help=('Directory where tap times are written for '
+                              'rows without an "output" column (default: '
+                              'current directory).'))
+    parser.add_argument('-j', dest='processes', type=int, default=None,
+                        help=('Number of worker processes (default: number '
+                              'of CPUs).'))
+    parser.add_argument('-d', dest='distance',
+                        type=int, default=defaults.DEFAULT_DISTANCE,
+                        help=('Default minimum distance (in ms) between '
+                              'detected peaks'))
+    parser.add_argument('-p', dest='prominence',
+                        type=float, default=None,
+                        help=('Default minimum prominence of the detected '
+                              'peaks (in multiples of the input signal '
+                              'std). Default: {} ({} with --threshold '
+                              'adaptive).').format(
+                                  defaults.DEFAULT_PROMINENCE,
+                                  defaults.DEFAULT_ADAPTIVE_PROMINENCE))
+    parser.add_argument('-i', dest='invert_input',
+                        default=False, action='store_true',
+                        help='Inverts the input signal by default.')
+    parser.add_argument('--lag_method', dest='crosscorrelation_method',
+                        choices=['exhaustive', 'coarse'],
+                        default=argparse.SUPPRESS,
+                        help=('Method used to find the loopback lag (see '
+                              'rec2taps -h).'))
+    parser.add_argument('--stream', dest='block_size', type=int,
+                        nargs='?', const=defaults.DEFAULT_BLOCK_SIZE,
+                        default=argparse.SUPPRESS,
+                        help=('Finds peaks in blocks of the given number of '
+                              'samples (see rec2taps -h).'))
+    parser.add_argument('--profile', dest='profile', default=None,
+                        nargs='?', const='-',
+                        help=('Emits a JSON list with the profiling report of '
+                              'each row to the given file (default: standard '
+                              'error).'))
+    parser.add_argument('--qc', dest='qc', default=None,
+                        nargs='?', const='-',
+                        help=('Emits a JSON list with the quality control '
+                              'report of each row and the "flags" of its '
+                              'metrics out of range to the given file '
+                              '(default: standard error, see rec2taps -h).'))
+    parser.add_argument('-D', '--debug_plot', dest='plot_dir', default=None,
+                        help=('Directory where a debug plot of each row is '
+                              'written as PNG. Plots are drawn by the '
+                              'worker pool while other rows are '
+                              'processed.'))
+    parser.add_argument('--plot_window', dest='plot_window', type=float,
+                        default=None,
+                        help=('Plots only the given number of ms around '
+                              'each detected tap (see rec2taps -h).'))
+    parser.add_argument('--output', dest='output', default=None,
+                        help=('Writes the tap times of all rows with their '
+                              'metadata to a single table file instead of '
+                              'a text file per row (see rec2taps -h).'))
+    add_timing_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('-v', dest='verbose',
+                        action='store_true',
+                        help=('Enables printing standard information.'))
+    args = parser.parse_args()
+    args.prominence = default_prominence(getattr(args, 'threshold', 'global'),
+                                         args.prominence)
+
+    if not os.path.isfile(args.manifest_file):
+        print('{} does not refer to a file.'.format(args.manifest_file))
+        sys.exit()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG,
+                            format="Debug: {message}",
+                            style='{')
+
+    options = extract_options(args)
+    cache = result_cache(args)
+    if cache is not None:
+        options['cache'] = cache
+
+    if args.output is not None:
+        try:
+            output.output_format(args.output)
+        except errors.Rec2TapsError as r2te:
+            print(r2te, file=sys.stderr)
+            sys.exit()
+
+    items = batch.read_manifest(args.manifest_file)
+    if args.plot_dir is not None:
+        os.makedirs(args.plot_dir, exist_ok=True)
+    results = batch.extract_batch(items, args.processes, args.distance,
+                                  args.prominence, args.invert_input,
+                                  profile=args.profile is not None,
+                                  plot_dir=args.plot_dir,
+                                  plot_window=args.plot_window,
+                                  qc=args.qc is not None,
+                                  **options)
+
+    if args.output is None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    root = batch.recording_root(items)
+    for item, result in zip(items, results):
+        if result['error'] is not None:
+            print('{}: {}'.format(item['recording'], result['error']),
+                  file=sys.stderr)
+        elif args.output is None:
+            filename = batch.output_path(item, args.output_dir, root)
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            batch.write_peaks(result['peaks'], filename)
+
+    if args.output is not None:
+        try:
+            output.write_results(batch.result_sessions(results), args.output)
+        except errors.Rec2TapsError as r2te:
+            print(r2te, file=sys.stderr)
+
+    if args.profile is not None:
+        write_profile([{'recording': r['recording'], 'profile': r['profile']}
+                       for r in results], args.profile)
+
+    if args.qc is not None:
+        write_profile([{'recording': r['recording'], 'qc': r['qc'],
+                        'flags': r['qc_flags']}
+                       for r in results], args.qc)
+
+
+def rec2taps_sweep():
+    parser = argparse.ArgumentParser(
+        description=('Obtain tap times from a recording for every '
+                     'combination of the given distances and prominences. '
+                     'The recording is synchronized to the stimuli once. '
+                     'A CSV table with columns distance, prominence, taps '
+                     '(count) and times (space separated tap times) is '
+                     'written to the standard output.')
+    )
+
+    parser.add_argument('stimuli_file', type=str,
+                        help='audio file of the stimuli')
+    parser.add_argument('recording_file', type=str,
+                        help='audio file of the experiment recording')
+    parser.add_argument('-d', dest='distances', type=int, nargs='+',
+                        default=[defaults.DEFAULT_DISTANCE],
+                        help=('Minimum distances (in ms) between detected '
+                              'peaks to try'))
+    parser.add_argument('-p', dest='prominences', type=float, nargs='+',
+                        default=None,
+                        help=('Minimum prominences of the detected peaks '
+                              '(in multiples of the input signal std) to '
+                              'try. Default: {} ({} with --threshold '
+                              'adaptive).').format(
+                                  defaults.DEFAULT_PROMINENCE,
+                                  defaults.DEFAULT_ADAPTIVE_PROMINENCE))
+    parser.add_argument('-i', dest='invert_input',
+                        default=False, action='store_true',
+                        help='Inverts the input signal.')
+    parser.add_argument('-j', dest='workers', type=int, default=None,
+                        help='Number of threads used to find peaks.')
+    parser.add_argument('--lag_method', dest='crosscorrelation_method',
+                        choices=['exhaustive', 'coarse'],
+                        default=argparse.SUPPRESS,
+                        help=('Method used to find the loopback lag (see '
+                              'rec2taps -h).'))
+    add_timing_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('-v', dest='verbose',
+                        action='store_true',
+                        help=('Enables printing standard information.'))
+    args = parser.parse_args()
+    if args.prominences is None:
+        args.prominences = [default_prominence(
+            getattr(args, 'threshold', 'global'))]
+
+    if not os.path.isfile(args.stimuli_file):
+        print('{} does not refer to a file.'.format(args.stimuli_file))
+        sys.exit()
+    if not os.path.isfile(args.recording_file):
+        print('{} does not refer to a file.'.format(args.recording_file))
+        sys.exit()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG,
+                            format="Debug: {message}",
+                            style='{')
+
+    options = extract_options(args)
+    cache = result_cache(args)
+    if cache is not None:
+        options['cache'] = cache
+
+    try:
+        results = sweep.sweep_extract(args.stimuli_file, args.recording_file,
+                                      args.distances, args.prominences,
+                                      args.invert_input, args.workers,
+                                      **options)
+    except errors.Rec2TapsError as r2te:
+        print(r2te, file=sys.stderr)
+        sys.exit()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['distance', 'prominence', 'taps', 'times'])
+    for r in results:
+        writer.writerow([r['distance'], r['prominence'], len(r['peaks']),
+                         ' '.join(str(p) for p in r['peaks'])])
+
+
+def rec2taps_worker():
+    parser = argparse.ArgumentParser(
+        description=('Serves extraction requests as JSON lines, keeping '
+                     'decoded stimuli and other state between requests. '
+                     'Each request is a JSON object with the keys '
+                     '"stimulus" and "recording", and optionally "id", '
+                     '"distance", "prominence", "invert" and the timing '
+                     'options (e.g. "refine"). Each response is a JSON '
+                     'object with the "id", "peaks", "info" and "error" of '
+                     'a request, written when the request completes.')
+    )
+
+    parser.add_argument('--socket', dest='socket', type=str, default=None,
+                        help=('Serves requests on a Unix socket at the given '
+                              'path instead of the standard input and '
+                              'output.'))
+    parser.add_argument('-j', dest='workers', type=int, default=None,
+                        help=('Number of worker threads (default: see '
+                              'concurrent.futures.ThreadPoolExecutor).'))
+    parser.add_argument('--max_pending', dest='max_pending', type=int,
+                        default=defaults.DEFAULT_WORKER_PENDING,
+                        help=('Maximum number of requests being processed '
+                              'before reading more.'))
+    add_cache_arguments(parser)
+    parser.add_argument('-v', dest='verbose',
+                        action='store_true',
+                        help=('Enables printing standard information.'))
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG,
+                            format="Debug: {message}",
+                            style='{')
+
+    options = {}
+    cache = result_cache(args)
+    if cache is not None:
+        options['cache'] = cache
+
+    with worker.Worker(args.workers, args.max_pending, **options) as w:
+        try:
+            if args.socket is not None:
+                w.serve_unix(args.socket)
+            else:
+                w.serve_stream(sys.stdin, sys.stdout)
+        except FileExistsError as e:
+            print(e, file=sys.stderr)
+            sys.exit()
+        except KeyboardInterrupt:
+            pass
+
 
 if __name__ == '__main__':
-    main()
+    rec2taps()
@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import fft
+from m2.rec2taps import errors
+from m2.rec2taps.stimulus import Stimulus
+
+
+def _spectra(signal, n, dtype):
+    '''
+    Real FFT of every channel of a 2d signal.
+
+    Channels are transformed one at a time from strided views, so the only
+    copy of the signal made is one channel converted to dtype.
+    '''
+    channels = signal.shape[1]
+    spectra = np.empty((n // 2 + 1, channels),
+                       dtype=np.result_type(dtype, np.complex64))
+    for c in range(channels):
+        spectra[:, c] = fft.rfft(np.asarray(signal[:, c], dtype=dtype), n)
+    return spectra
+
+
+def reversed_spectra(signal, n, dtype=np.float64):
+    '''
+    Returns the real FFT of every reversed channel of a 2d signal.
+
+    Params:
+        signal: 2d array (samples x channels)
+        n: FFT length
+        dtype: float type used for the transform (np.float64 or np.float32)
+
+    Returns:
+        2d complex array (frequencies x channels)
+    '''
+    return _spectra(signal[::-1], n, dtype)
+
+
+def _correlation_spectra(signal_a, signal_b, dtype):
+    '''
+    Returns the FFT length and the spectra of both signals.
+
+    A circular convolution of length >= len(signal_a) has no wrap-around in
+    the 'valid' part of the linear convolution.
+    '''
+    if signal_a.shape[0] < len(signal_b):
+        raise errors.SignalTooShortForConvolution()
+
+    n = fft.next_fast_len(signal_a.shape[0], real=True)
+    spectra_a = _spectra(signal_a, n, dtype)
+    if isinstance(signal_b, Stimulus):
+        spectra_b = signal_b.reversed_spectra(n, dtype)
+    else:
+        spectra_b = reversed_spectra(signal_b, n, dtype)
+    return n, spectra_a, spectra_b
+
+
+def channel_crosscorrelations(signal_a, signal_b, dtype=np.float64):
+    '''
+    Cross-correlates every channel of signal_a with every channel of signal_b.
+
+    The forward transform of each channel is computed once at a shared fast
+    FFT length, all channel pairs are multiplied in one vectorized step and
+    inverse transformed together. Only the 'valid' part of the correlation
+    (where signal_b fully overlaps signal_a) is returned, as with
+    `fftconvolve(a, b[::-1], 'valid')`.
+
+    Params:
+        signal_a: 2d array (samples x channels)
+        signal_b: 2d array (samples x channels) or `Stimulus`, whose
+            reversed spectra are cached. Must not be longer than signal_a.
+        dtype: float type used for the computation. np.float32 halves the
+            memory required.
+
+    Returns:
+        3d array (lags x channels of signal_b x channels of signal_a)
+    '''
+    n, spectra_a, spectra_b = _correlation_spectra(signal_a, signal_b, dtype)
+    products = spectra_b[:, :, None] * spectra_a[:, None, :]
+    del spectra_a
+    cc = fft.irfft(products, n, axis=0, overwrite_x=True)
+    return cc[len(signal_b) - 1:signal_a.shape[0]]
+
+
+def crosscorrelation_matrix(signal_a, signal_b, dtype=np.float64):
+    '''
+    Returns max crosscorr value and position for every channel pair.
+
+    See `channel_crosscorrelations` for the arguments. The forward transforms
+    are shared as in `channel_crosscorrelations`, but the pairs are inverse
+    transformed and reduced one channel of signal_b at a time, so that only
+    the correlations against one channel are held in memory.
+
+    Returns:
+        tuple of two 2d arrays (channels of signal_b x channels of signal_a)
+        with the maximum cross-correlation values and their positions
+    '''
+    n, spectra_a, spectra_b = _correlation_spectra(signal_a, signal_b, dtype)
+    valid = slice(len(signal_b) - 1, signal_a.shape[0])
+
+    shape = (spectra_b.shape[1], spectra_a.shape[1])
+    maxima = np.empty(shape, dtype=dtype)
+    argmaxima = np.empty(shape, dtype=np.intp)
+    for b in range(shape[0]):
+        cc = fft.irfft(spectra_a * spectra_b[:, b:b + 1], n, axis=0,
+                       overwrite_x=True)[valid]
+        maxima[b] = cc.max(axis=0)
+        argmaxima[b] = cc.argmax(axis=0)
+        del cc
+    return maxima, argmaxima
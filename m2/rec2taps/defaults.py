@@ -1,3 +1,38 @@
 DEFAULT_PROMINENCE = 1.5
 DEFAULT_DISTANCE = 100
 DEFAULT_DEBUG_PLOT = 'debug_plot.pdf'
+STIMULUS_CACHE_SIZE = 8
+SPECTRUM_CACHE_BYTES = 128 * 2 ** 20
+DEFAULT_CROSSCORRELATION_METHOD = 'exhaustive'
+DEFAULT_DECIMATION = 8
+DEFAULT_BLOCK_SIZE = 2 ** 20
+DEFAULT_MMAP = True
+RECTIFY_BLOCK_SIZE = 2 ** 16
+DEFAULT_ONLINE_BUFFER = 5000
+DEFAULT_ONLINE_WARMUP = 1000
+DEFAULT_LOCK_TEMPLATE = 2000
+DEFAULT_MAX_LAG = 1000
+DEFAULT_CACHE_SIZE = 256 * 2 ** 20
+CACHE_DIR_ENV = 'REC2TAPS_CACHE_DIR'
+FILE_HASH_CACHE_SIZE = 1024
+SINC_HALF_WIDTH = 8
+SINC_RESOLUTION = 64
+REFINE_LAG_LENGTH = 2 ** 16
+DEFAULT_LAG_TEMPLATE = 2000
+LAG_TEMPLATE_BLOCKS = 16
+LAG_TEMPLATE_MIN_RMS = 1e-9
+PLOT_BUCKETS = 2000
+PLOT_BLOCK_SIZE = 2 ** 20
+PLOT_QUEUE_SIZE = 4
+DEFAULT_WORKER_PENDING = 64
+DEFAULT_AIO_CONCURRENCY = 2
+DEFAULT_AIO_READ_AHEAD = 2
+DEFAULT_THRESHOLD_WINDOW = 500
+DEFAULT_ADAPTIVE_PROMINENCE = 5
+THRESHOLD_SCALE_FLOOR = 0.05
+THRESHOLD_SAMPLES = 1024
+THRESHOLD_HOPS = 4
+QC_ITI_TOLERANCE = 0.4
+QC_MIN_CORRELATION = 0.5
+QC_MIN_MARGIN = 0.1
+QC_MAX_CLIPPING = 0.001
@@ -26,3 +26,73 @@ class StimuliShorterThanRecording(Rec2TapsError):
     def __init__(self, stimuli_file, recording_file):
         super().__init__(('Stimuli file ({}) is shorter than recording file '
                           '({}).').format(stimuli_file, recording_file))
+
+
+class UnsupportedOutputFormat(Rec2TapsError):
+    'Output file format is unknown or requires a missing library'
+
+    def __init__(self, filename, reason):
+        self.filename = filename
+        super().__init__('Can not write {}: {}'.format(filename, reason))
+
+
+class AmbiguousInputChannel(Rec2TapsError):
+    'Recording has more than two channels and no input channel was given'
+
+    def __init__(self, recording_file, channels):
+        self.recording_file = recording_file
+        self.channels = channels
+        super().__init__(('{} has {} channels, the input channel must be '
+                          'given.').format(recording_file, channels))
+
+
+class InvalidInputChannel(Rec2TapsError):
+    'Input channel requested is not a channel of the recording'
+
+    def __init__(self, recording_file, channel, channels):
+        self.recording_file = recording_file
+        self.channel = channel
+        super().__init__(('{} has no channel {} ({} channels).').format(
+            recording_file, channel, channels))
+
+
+class UnsupportedAudioFormat(Rec2TapsError):
+    'Audio file format requires a missing library'
+
+    def __init__(self, filename, reason):
+        self.filename = filename
+        super().__init__('Can not read {}: {}'.format(filename, reason))
+
+
+class LoopbackNotLocked(Rec2TapsError):
+    'Online detector received too little loopback audio to find the lag'
+
+    def __init__(self, taps, loopback_ms, template_ms):
+        self.taps = taps
+        super().__init__(('The loopback lag was not found: {:.0f} ms of '
+                          'loopback audio received, {:.0f} ms needed. {} '
+                          'taps are available relative to the start of the '
+                          'audio.').format(loopback_ms, template_ms,
+                                           len(taps)))
+
+
+class SilentLagTemplate(Rec2TapsError):
+    'Part of the stimulus correlated to find the lag is silent'
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+        super().__init__(('The stimulus is silent from sample {} to {}, the '
+                          'lag can not be found with it.').format(
+                              offset, offset + length))
+
+
+class LagWindowOutsideRecording(Rec2TapsError):
+    'Lag window searched does not fit in the recording'
+
+    def __init__(self, recording_file, min_lag, max_lag, recording_ms):
+        self.recording_file = recording_file
+        super().__init__(('The lag window [{}, {}] ms does not fit in {} '
+                          '({:.0f} ms long).').format(
+                              min_lag, max_lag, recording_file,
+                              recording_ms))
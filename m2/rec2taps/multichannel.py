@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import numpy as np
+import m2.rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps.streaming import stream_numpy_peaks
+from m2.rec2taps.refine import refine_maxima
+from m2.rec2taps.threshold import default_prominence
+from m2.rec2taps.defaults import DEFAULT_DISTANCE
+
+# Keys of the per-channel parameters of `extract_channels`
+CHANNEL_PARAMETERS = ['distance', 'prominence', 'invert', 'threshold']
+
+
+def channel_parameters(recording_file, channels, loopback_channel, n_channels,
+                       **defaults):
+    '''
+    Returns the parameters used for each input channel.
+
+    Params:
+        recording_file: path of the recording, used in error messages
+        channels: None for every channel but the loopback, a sequence of
+            channels, or a dictionary from channel to a dictionary with any
+            of the `CHANNEL_PARAMETERS`
+        loopback_channel: channel of the stimulus loopback
+        n_channels: number of channels of the recording
+        defaults: value of every `CHANNEL_PARAMETERS` key for channels that
+            do not define their own
+
+    Returns:
+        dictionary from channel to a dictionary with every
+        `CHANNEL_PARAMETERS` key, in the order of channels
+    '''
+    if channels is None:
+        channels = [c for c in range(n_channels) if c != loopback_channel]
+    if not isinstance(channels, dict):
+        channels = {c: {} for c in channels}
+
+    parameters = {}
+    for channel, values in channels.items():
+        if not 0 <= channel < n_channels:
+            raise errors.InvalidInputChannel(recording_file, channel,
+                                             n_channels)
+        unknown = set(values) - set(CHANNEL_PARAMETERS)
+        if unknown:
+            raise ValueError('Unknown channel parameters: {}'.format(
+                ', '.join(sorted(unknown))))
+        parameters[int(channel)] = dict(defaults, **values)
+    return parameters
+
+
+def channel_peaks(signal, sr, channel, distance=DEFAULT_DISTANCE,
+                  prominence=None, invert=False,
+                  threshold='global', refine=None, block_size=None):
+    '''
+    Finds the peaks of a channel of a recording as `extract_peaks`.
+
+    Params:
+        signal: 2d array (samples x channels), usually memory-mapped
+        sr: sample rate of the signal
+        channel: input channel
+        distance, prominence, threshold, refine, block_size: see
+            `extract_peaks`
+        invert: if True, the input signal is inverted (* -1)
+
+    Returns:
+        1d array of peaks in samples (a float array if refine is not None)
+    '''
+    prominence = default_prominence(threshold, prominence)
+    data = signal[:, channel]
+    if block_size is None:
+        if invert:
+            data = np.negative(data, dtype=np.float64)
+        peaks = m2.rec2taps.numpy_peaks(data, sr, distance, prominence,
+                                        overwrite_data=invert,
+                                        threshold=threshold)
+    elif threshold != 'global':
+        raise ValueError('The {} threshold can not be used with '
+                         'block_size'.format(threshold))
+    else:
+        peaks = stream_numpy_peaks(data, sr, distance, prominence, invert,
+                                   block_size)
+    if refine is not None:
+        peaks = refine_maxima(signal[:, channel], peaks, refine, invert)
+    return peaks
+
+
+def extract_channels(stimulus_file, recording_file, channels=None,
+                     distance=DEFAULT_DISTANCE, prominence=None,
+                     invert_input_signal=False, threshold='global',
+                     refine=None, block_size=None, workers=None, info=None,
+                     **options):
+    '''
+    Extracts peaks from several input channels of a recording.
+
+    The recording is read and synchronized to the stimulus once (see
+    `synchronize`), and the peaks of every input channel are then found by
+    a pool of threads that share the recording. Rigs recording several
+    participants or sensors on a multichannel interface are processed in a
+    single pass instead of once per channel.
+
+    Params:
+        stimulus_file, recording_file, refine, block_size: see
+            `extract_peaks`
+        channels: None to use every channel but the loopback, a sequence of
+            input channels, or a dictionary from input channel to a
+            dictionary with its own `distance`, `prominence`, `invert` or
+            `threshold`
+        distance, prominence, invert_input_signal, threshold: parameters of
+            the channels that do not define their own (see `extract_peaks`)
+        workers: number of threads. If None, the default of
+            `ThreadPoolExecutor` is used.
+        info: if not None, a dictionary that is filled as in
+            `extract_peaks`, with `input_channel` replaced by the list of
+            `input_channels`
+        options: additional keyword arguments for `synchronize`
+
+    Returns:
+        dictionary from input channel to 1d array of peaks in ms relative
+        to the beginning of the stimulus signal, in the order of channels
+    '''
+    sr, signal, si, ri, lag_s = m2.rec2taps.synchronize(
+        stimulus_file, recording_file, refine=refine, **options)
+    parameters = channel_parameters(
+        recording_file, channels, ri, signal.shape[1], distance=distance,
+        prominence=prominence, invert=invert_input_signal,
+        threshold=threshold)
+    if info is not None:
+        m2.rec2taps.lag_info(info, sr, si, ri, lag_s)
+        del info['input_channel']
+        info['input_channels'] = list(parameters)
+    logging.debug('Obtaining peaks of channels {} of {}'.format(
+        list(parameters), recording_file))
+
+    lag = lag_s / sr * 1000
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda c: channel_peaks(signal, sr, c, refine=refine,
+                                    block_size=block_size,
+                                    **parameters[c]),
+            parameters)
+        return {c: np.array(peaks) / sr * 1000 - lag
+                for c, peaks in zip(parameters, results)}
@@ -0,0 +1,227 @@
+import logging
+import numpy as np
+from m2.rec2taps import errors
+from m2.rec2taps import rectify
+from m2.rec2taps.correlation import crosscorrelation_matrix
+from m2.rec2taps.stimulus import Stimulus
+from m2.rec2taps.streaming import RunningStats
+from m2.rec2taps.defaults import DEFAULT_DISTANCE, DEFAULT_PROMINENCE
+from m2.rec2taps.defaults import DEFAULT_ONLINE_BUFFER, DEFAULT_ONLINE_WARMUP
+from m2.rec2taps.defaults import DEFAULT_LOCK_TEMPLATE, DEFAULT_MAX_LAG
+
+
+class OnlineTapDetector:
+    '''
+    Incremental tap detector for live sessions.
+
+    Audio blocks are passed to `process` as they arrive (e.g. from an audio
+    callback). The input channel is kept in a bounded buffer and rectified
+    with a threshold derived from the running standard deviation of all the
+    samples seen, as in `numpy_peaks`. A peak is reported once `distance` ms
+    of audio have arrived after it, when no later sample can suppress it, so
+    the latency of a tap is bounded by `distance` plus the block length.
+
+    If a stimulus is given, the loopback channel is cross-correlated with
+    the beginning of the stimulus once enough audio has arrived, and tap
+    times are reported relative to the start of the stimulus, as in
+    `extract_peaks`. Taps detected before the lag is found are reported
+    along with the first taps after it.
+
+    Params:
+        sr: sample rate of the audio
+        input_channel: channel of the input device
+        loopback_channel: channel of the stimulus loopback
+        stimulus: 2d array or `Stimulus` with the stimulus played, or None
+            to report tap times relative to the start of the audio
+        distance: minimum distance in ms between detected peaks
+        prominence: minimum prominence of detected peaks in multiples of
+            the running standard deviation of the input signal
+        invert_input_signal: if True, input signal is inverted (* -1)
+        buffer_length: length in ms of the input signal buffer. It is
+            extended to hold at least the warmup period.
+        warmup: ms of audio used to estimate the standard deviation before
+            detecting taps. Taps should be present in this period, otherwise
+            the threshold is set by the background noise alone.
+        std: if not None, fixed standard deviation of the input signal (e.g.
+            from a calibration recording) used instead of the running one
+        lock_template: length in ms of the beginning of the stimulus used to
+            find the loopback lag
+        max_lag: maximum loopback lag in ms
+    '''
+
+    def __init__(self, sr, input_channel=1, loopback_channel=0,
+                 stimulus=None, distance=DEFAULT_DISTANCE,
+                 prominence=DEFAULT_PROMINENCE, invert_input_signal=False,
+                 buffer_length=DEFAULT_ONLINE_BUFFER,
+                 warmup=DEFAULT_ONLINE_WARMUP,
+                 lock_template=DEFAULT_LOCK_TEMPLATE,
+                 max_lag=DEFAULT_MAX_LAG, std=None):
+        self.sr = sr
+        self.input_channel = input_channel
+        self.loopback_channel = loopback_channel
+        self.prominence = prominence
+        self.invert_input_signal = invert_input_signal
+        self.distance = distance * sr / 1000
+        self._hold = int(np.ceil(self.distance))
+        self._warmup = int(warmup * sr / 1000) if std is None else 0
+        self.std = std
+        # The buffer keeps the warmup audio so that its taps are reported
+        self._buffer_size = max(int(buffer_length * sr / 1000),
+                                4 * self._hold, self._warmup + self._hold)
+
+        # Ring buffer stored linearly: samples are appended until the storage
+        # is full and then the newest `buffer_size` are moved to its start
+        self._storage = np.empty(2 * self._buffer_size)
+        self._length = 0
+        self._offset = 0
+        self._stats = RunningStats()
+        self._last_tap = None
+        self._checked = 0
+        self._unsynced = []
+
+        self.lag = None
+        self.stimulus_channel = None
+        self._template = None
+        if stimulus is not None:
+            if isinstance(stimulus, Stimulus):
+                stimulus = stimulus.signal
+            self._template = stimulus[:int(lock_template * sr / 1000)]
+            self._lock_size = (self._template.shape[0] +
+                               int(max_lag * sr / 1000))
+            self._loopback = []
+            self._loopback_size = 0
+
+    @property
+    def latency(self):
+        'Maximum delay in ms between a tap and its report, excluding blocks'
+        return self._hold / self.sr * 1000
+
+    @property
+    def samples(self):
+        'Number of samples processed'
+        return self._offset + self._length
+
+    @property
+    def _buffer(self):
+        return self._storage[:self._length]
+
+    def _append(self, data):
+        'Appends samples to the buffer, dropping the oldest when full.'
+        n = data.shape[0]
+        if self._length + n > self._storage.shape[0]:
+            keep = min(max(self._buffer_size - n, 0), self._length)
+            drop = self._length - keep
+            self._storage[:keep] = self._storage[drop:self._length]
+            self._length = keep
+            self._offset += drop
+            if keep + n > self._storage.shape[0]:
+                self._storage = np.concatenate([self._storage[:keep],
+                                                np.empty(n)])
+        self._storage[self._length:self._length + n] = data
+        self._length += n
+
+    def process(self, block):
+        '''
+        Processes a block of audio.
+
+        Params:
+            block: 2d array (samples x channels) with the next audio samples
+
+        Returns:
+            1d array with the times in ms of the newly detected taps
+        '''
+        if self._template is not None and self.lag is None:
+            self._update_lag(block[:, self.loopback_channel])
+
+        data = np.array(block[:, self.input_channel], dtype=np.float64)
+        if self.invert_input_signal:
+            np.negative(data, out=data)
+        self._stats.update(data)
+
+        self._append(data)
+
+        return self._emit(self._detect(self.samples - self._hold))
+
+    def flush(self):
+        '''
+        Reports the taps still held at the end of the audio.
+
+        If the lag was not found yet, it is searched with the loopback
+        audio received so far.
+
+        Returns:
+            1d array with the times in ms of the remaining taps
+
+        Raises:
+            LoopbackNotLocked: if less loopback audio than the stimulus
+                template was received, so the lag can not be found. The
+                taps held, in ms relative to the start of the audio, are in
+                its `taps` attribute.
+        '''
+        if (self._template is not None and self.lag is None and
+                self._loopback_size >= self._template.shape[0]):
+            self._lock_size = self._loopback_size
+            self._update_lag(np.empty(0))
+        taps = self._emit(self._detect(self.samples))
+        if self._template is not None and self.lag is None:
+            raise errors.LoopbackNotLocked(
+                np.array(self._unsynced) / self.sr * 1000,
+                self._loopback_size / self.sr * 1000,
+                self._template.shape[0] / self.sr * 1000)
+        return taps
+
+    def _detect(self, until):
+        '''
+        Returns new peaks (in samples) found before sample `until`.
+
+        Only the samples after the last checked position, plus some context
+        before it, are searched for peaks.
+        '''
+        from scipy.signal import find_peaks
+
+        if self._stats.count < self._warmup:
+            return []
+
+        std = self._stats.std if self.std is None else self.std
+        prominence_a = std * self.prominence
+        start = max(self._checked - 3 * self._hold - self._offset, 0)
+        window = self._buffer[start:]
+        rect = rectify(window, prominence_a, np.empty(window.shape))
+        peaks, _ = find_peaks(rect, prominence=prominence_a,
+                              distance=self.distance)
+        peaks = peaks + self._offset + start
+        peaks = peaks[(peaks >= self._checked) & (peaks < until)]
+        self._checked = max(self._checked, until)
+
+        taps = []
+        for p in peaks:
+            if self._last_tap is None or p - self._last_tap >= self.distance:
+                taps.append(p)
+                self._last_tap = p
+        return taps
+
+    def _update_lag(self, loopback):
+        'Accumulates loopback audio and finds the lag once there is enough.'
+        self._loopback.append(np.array(loopback, dtype=np.float64))
+        self._loopback_size += loopback.shape[0]
+        if self._loopback_size < self._lock_size:
+            return
+
+        signal = np.concatenate(self._loopback)[:self._lock_size, None]
+        maxima, argmaxima = crosscorrelation_matrix(signal, self._template)
+        self.stimulus_channel = int(np.argmax(maxima[:, 0]))
+        self.lag = int(argmaxima[self.stimulus_channel, 0])
+        self._loopback = None
+        logging.debug('Locked on loopback lag of {} ms'.format(
+            self.lag / self.sr * 1000))
+
+    def _emit(self, taps):
+        if self._template is None:
+            return np.array(taps) / self.sr * 1000
+
+        self._unsynced.extend(taps)
+        if self.lag is None:
+            return np.array([])
+        taps = (np.array(self._unsynced) - self.lag) / self.sr * 1000
+        self._unsynced = []
+        return taps
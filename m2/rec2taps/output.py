@@ -0,0 +1,141 @@
+import csv
+import os
+import numpy as np
+from m2.rec2taps import errors
+
+# Columns of a results table, one row per tap, with the session metadata
+# repeated in every row. Sessions without taps have a single row with a NaN
+# tap_ms, so they are not missing from the table.
+METADATA_COLUMNS = ['stimulus', 'recording', 'sr', 'stimulus_channel',
+                    'loopback_channel', 'input_channel', 'lag_samples',
+                    'lag_ms', 'distance', 'prominence', 'invert']
+COLUMNS = METADATA_COLUMNS + ['tap_ms']
+
+COLUMN_TYPES = {
+    'sr': np.int64,
+    'stimulus_channel': np.int64,
+    'loopback_channel': np.int64,
+    'input_channel': np.int64,
+    'lag_samples': np.float64,
+    'lag_ms': np.float64,
+    'distance': np.float64,
+    'prominence': np.float64,
+    'invert': np.bool_,
+    'tap_ms': np.float64
+}
+
+ARROW_FORMATS = ['.parquet', '.arrow', '.feather']
+FORMATS = ['.npy', '.csv'] + ARROW_FORMATS
+
+
+def session(stimulus, recording, distance, prominence, invert, info, peaks):
+    '''
+    Returns the result of a session as written by `write_results`.
+
+    Params:
+        stimulus, recording: paths of the session files
+        distance, prominence, invert: parameters of `extract_peaks`
+        info: info dictionary filled by `extract_peaks`
+        peaks: tap times in ms
+    '''
+    result = {k: info[k] for k in METADATA_COLUMNS if k in info}
+    result.update({
+        'stimulus': str(stimulus),
+        'recording': str(recording),
+        'distance': distance,
+        'prominence': prominence,
+        'invert': bool(invert),
+        'peaks': np.asarray(peaks, dtype=np.float64)
+    })
+    return result
+
+
+def result_columns(sessions):
+    '''
+    Returns the columns of a results table with a row per tap.
+
+    Sessions without taps have a row with a NaN `tap_ms`.
+
+    Params:
+        sessions: sequence of session results (see `session`)
+
+    Returns:
+        dictionary from column name to 1d array
+    '''
+    sessions = list(sessions)
+    taps = [s['peaks'] if len(s['peaks']) > 0 else np.full(1, np.nan)
+            for s in sessions]
+    counts = [len(t) for t in taps]
+    columns = {}
+    for c in METADATA_COLUMNS:
+        values = np.array([s[c] for s in sessions], dtype=COLUMN_TYPES.get(c))
+        columns[c] = np.repeat(values, counts)
+    columns['tap_ms'] = np.concatenate(taps) if taps else np.empty(0)
+    return columns
+
+
+def output_format(filename):
+    'Returns the output format of a file from its extension.'
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in FORMATS:
+        raise errors.UnsupportedOutputFormat(
+            filename, 'unknown format (use one of {})'.format(
+                ', '.join(FORMATS)))
+    return ext
+
+
+def write_npy(columns, filename):
+    'Writes the columns as a structured array.'
+    n = len(columns['tap_ms'])
+    table = np.empty(n, dtype=[(c, columns[c].dtype) for c in COLUMNS])
+    for c in COLUMNS:
+        table[c] = columns[c]
+    np.save(filename, table)
+
+
+def write_csv(columns, filename):
+    'Writes the columns as CSV with a header row.'
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*[columns[c].tolist() for c in COLUMNS]))
+
+
+def write_arrow(columns, filename):
+    'Writes the columns as Parquet or Arrow IPC (Feather) with pyarrow.'
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise errors.UnsupportedOutputFormat(filename,
+                                             'pyarrow is not installed')
+
+    table = pa.table({c: columns[c] for c in COLUMNS})
+    if filename.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(table, filename)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, filename)
+
+
+def write_results(sessions, filename):
+    '''
+    Writes the taps of many sessions as a single table.
+
+    The format is chosen by the extension of the file: `.npy` (NumPy
+    structured array), `.csv`, or `.parquet`, `.arrow` and `.feather` if
+    pyarrow is installed. The table has a row per tap with the columns in
+    `COLUMNS` (and a row with a NaN `tap_ms` for sessions without taps).
+
+    Params:
+        sessions: sequence of session results (see `session`)
+        filename: output file
+    '''
+    ext = output_format(filename)
+    columns = result_columns(sessions)
+    if ext == '.npy':
+        write_npy(columns, filename)
+    elif ext == '.csv':
+        write_csv(columns, filename)
+    else:
+        write_arrow(columns, filename)
@@ -0,0 +1,210 @@
+import logging
+import queue
+import threading
+import numpy as np
+from m2.rec2taps.defaults import PLOT_BUCKETS, PLOT_BLOCK_SIZE
+from m2.rec2taps.defaults import PLOT_QUEUE_SIZE
+
+_pyplot = None
+_pyplot_error = None
+
+
+def load_pyplot():
+    '''
+    Imports matplotlib with the Agg backend on first use.
+
+    Matplotlib is only needed for debug plots, so it is not imported until
+    a plot is requested.
+
+    Returns:
+        the `matplotlib.pyplot` module or None if matplotlib is not available
+    '''
+    global _pyplot, _pyplot_error
+    if _pyplot is not None or _pyplot_error is not None:
+        return _pyplot
+
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        _pyplot = plt
+    except ImportError as ie:
+        _pyplot_error = ie
+        logging.warning(('Matplotlib is not available. If --debug_plot flag '
+                         'is used no plot will be produced.'))
+    except Exception as e:
+        _pyplot_error = e
+        logging.error(
+            ('An error occured while loading matplotlib: {}'.format(str(e)))
+        )
+    return _pyplot
+
+
+def can_debug_plot():
+    'Returns True if matplotlib can be loaded to produce debug plots.'
+    return load_pyplot() is not None
+
+
+def envelope(signal, buckets, invert=False):
+    '''
+    Returns the minimum and maximum of a signal in consecutive buckets.
+
+    Plotting the envelope of the buckets draws the same image as every
+    sample when there is a bucket per pixel, with far fewer points.
+
+    Params:
+        signal: 1d array-like signal (e.g. a column of a memory-mapped wav)
+        buckets: number of buckets
+        invert: if True, the envelope of the inverted signal (* -1) is
+            returned
+
+    Returns:
+        tuple (starts, minima, maxima) with the first sample, minimum and
+        maximum of each bucket
+    '''
+    n = signal.shape[0]
+    size = max(int(np.ceil(n / buckets)), 1)
+    starts = np.arange(0, n, size)
+    minima = np.empty(starts.shape[0])
+    maxima = np.empty(starts.shape[0])
+    # Buckets are reduced in blocks to bound the memory used
+    block = max(PLOT_BLOCK_SIZE // size, 1) * size
+    for start in range(0, n, block):
+        data = np.asarray(signal[start:start + block])
+        indices = np.arange(0, data.shape[0], size)
+        b = start // size
+        minima[b:b + indices.shape[0]] = np.minimum.reduceat(data, indices)
+        maxima[b:b + indices.shape[0]] = np.maximum.reduceat(data, indices)
+    if invert:
+        minima, maxima = -maxima, -minima
+    return starts, minima, maxima
+
+
+def tap_windows(signal, sr, peaks, window, invert=False):
+    '''
+    Returns the segments of the signal around each peak.
+
+    Params:
+        signal: 1d array-like signal
+        sr: sample rate of the signal
+        peaks: 1d array with the peaks in ms from the start of the signal
+        window: half length in ms of the segments
+        invert: if True, the signal is inverted (* -1)
+
+    Returns:
+        tuple (times, segments) with the times in ms relative to the peaks
+        and a 2d array (peaks x samples) with the segments, padded with NaN
+        beyond the signal
+    '''
+    half = int(window * sr / 1000)
+    offsets = np.arange(-half, half + 1)
+    positions = np.round(np.asarray(peaks) * sr / 1000).astype(np.intp)
+    idx = positions[:, None] + offsets[None, :]
+    inside = (idx >= 0) & (idx < signal.shape[0])
+    segments = np.asarray(signal[np.clip(idx, 0, signal.shape[0] - 1)],
+                          dtype=np.float64)
+    segments[~inside] = np.nan
+    if invert:
+        np.negative(segments, out=segments)
+    return offsets / sr * 1000, segments
+
+
+def debug_plot(filename, signal, sr, peaks, invert=False, window=None,
+               buckets=PLOT_BUCKETS):
+    '''
+    Plots the input signal overlaid with the detected peaks.
+
+    Long signals are drawn as the envelope of `buckets` buckets (see
+    `envelope`). The format is chosen by the extension of the file, e.g.
+    '.pdf' (vector) or '.png' (raster, faster to draw and smaller for long
+    recordings).
+
+    Nothing is plotted if matplotlib is not available. The figure is drawn
+    without pyplot's global state, so plots can be drawn from a background
+    thread (see `BackgroundPlotter`).
+
+    Params:
+        filename: output file of the plot
+        signal: 1d array with the input signal
+        sr: sample rate of the signal
+        peaks: 1d array with the peaks in ms from the start of the signal
+        invert: if True, the signal is inverted (* -1) before plotting
+        window: if not None, only the segments of `window` ms around each
+            peak are plotted, overlaid and aligned on the peaks
+        buckets: number of buckets of the envelope of long signals
+    '''
+    plt = load_pyplot()
+    if plt is None:
+        return
+
+    fig = plt.Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    if window is not None:
+        times, segments = tap_windows(signal, sr, peaks, window, invert)
+        ax.plot(times, segments.T, color='C2', alpha=0.3, linewidth=0.8)
+        ax.axvline(0, color='C1')
+        ax.set_xlabel('time from tap (ms)')
+    else:
+        if signal.shape[0] > 2 * buckets:
+            starts, minima, maxima = envelope(signal, buckets, invert)
+            ax.fill_between(starts / sr * 1000, minima, maxima, color='C2',
+                            linewidth=0, step='post')
+        else:
+            ax.plot(np.arange(signal.shape[0]) / sr * 1000,
+                    -signal if invert else signal, color='C2')
+        ymin, ymax = ax.get_ylim()
+        ax.vlines(peaks, ymin, ymax, color='C1')
+        ax.set_xlabel('time (ms)')
+    ax.set_yticks([])
+    ax.set_ylabel('amplitude')
+    fig.savefig(filename)
+
+
+class BackgroundPlotter:
+    '''
+    Draws debug plots in a background thread.
+
+    Plots are queued with `submit` and drawn one at a time, so extraction
+    can continue while they are rendered. At most `max_pending` plots are
+    queued; `submit` blocks when the queue is full. `close` waits until all
+    the plots are drawn. Errors are logged and do not stop the thread.
+    '''
+
+    def __init__(self, max_pending=PLOT_QUEUE_SIZE):
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            f, args, kwargs = job
+            try:
+                f(*args, **kwargs)
+            except Exception as e:
+                logging.error('Failed to draw debug plot {}: {}'.format(
+                    args[0] if args else '', e))
+
+    def submit(self, *args, **kwargs):
+        'Queues a call to `debug_plot` with the given arguments.'
+        self.submit_call(debug_plot, *args, **kwargs)
+
+    def submit_call(self, f, *args, **kwargs):
+        'Queues a call to a plotting function.'
+        if not self._thread.is_alive():
+            raise RuntimeError('BackgroundPlotter is closed')
+        self._queue.put((f, args, kwargs))
+
+    def close(self):
+        'Waits until all the queued plots are drawn and stops the thread.'
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,208 @@
+import numpy as np
+from m2.rec2taps.threshold import MAD_TO_STD, block_envelope
+from m2.rec2taps.defaults import DEFAULT_BLOCK_SIZE, DEFAULT_THRESHOLD_WINDOW
+from m2.rec2taps.defaults import QC_ITI_TOLERANCE, QC_MIN_CORRELATION
+from m2.rec2taps.defaults import QC_MIN_MARGIN, QC_MAX_CLIPPING
+
+
+def normalized_correlation(stimulus_signal, stimulus_channel,
+                           recording_signal, loopback_channel, lag,
+                           block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Normalized correlation of a stimulus channel and the loopback at a lag.
+
+    The value is 1 for a loopback that is a scaled copy of the stimulus and
+    close to 0 for unrelated signals. Only the samples where both signals
+    overlap are used, converted to float64 a block at a time.
+
+    Params:
+        stimulus_signal, recording_signal: 2d arrays (samples x channels)
+        stimulus_channel, loopback_channel: channels compared
+        lag: lag in samples of the loopback (rounded if fractional)
+
+    Returns:
+        float, or None if the signals do not overlap
+    '''
+    lag = int(round(lag))
+    n = min(stimulus_signal.shape[0], recording_signal.shape[0] - lag)
+    if n <= 0:
+        return None
+    dot = norm_a = norm_b = 0.0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        a = np.asarray(stimulus_signal[start:stop, stimulus_channel],
+                       dtype=np.float64)
+        b = np.asarray(recording_signal[lag + start:lag + stop,
+                                        loopback_channel],
+                       dtype=np.float64)
+        dot += np.dot(a, b)
+        norm_a += np.dot(a, a)
+        norm_b += np.dot(b, b)
+    if norm_a == 0 or norm_b == 0:
+        return 0.0
+    return float(dot / np.sqrt(norm_a * norm_b))
+
+
+def channel_margin(maxima, loopback_channel):
+    '''
+    Relative margin of the loopback channel over the other recording
+    channels.
+
+    Params:
+        maxima: 2d array (stimulus channels x recording channels) with the
+            maximum cross-correlation of every channel pair
+        loopback_channel: recording channel selected as loopback
+
+    Returns:
+        1 - (best maximum of the other recording channels / maximum of the
+        loopback channel), which is close to 0 when the loopback channel
+        could be confused with another one. None if maxima is None or the
+        recording has a single channel.
+    '''
+    if maxima is None:
+        return None
+    channel_maxima = np.asarray(maxima).max(axis=0)
+    if channel_maxima.shape[0] < 2:
+        return None
+    best = channel_maxima[loopback_channel]
+    other = np.delete(channel_maxima, loopback_channel).max()
+    if best <= 0:
+        return 0.0
+    return float(1 - max(other, 0) / best)
+
+
+def full_scale(dtype):
+    'Largest magnitude of a sample type (1.0 for floats).'
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        return np.iinfo(dtype).max
+    return 1.0
+
+
+def clipping_ratio(data, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Fraction of the samples of a 1d signal at the limits of its sample type
+    (or beyond 1 for floats).
+    '''
+    if data.shape[0] == 0:
+        return 0.0
+    dtype = np.dtype(data.dtype)
+    clipped = 0
+    for start in range(0, data.shape[0], block_size):
+        block = np.asarray(data[start:start + block_size])
+        if dtype.kind in 'iu':
+            info = np.iinfo(dtype)
+            clipped += np.count_nonzero((block == info.min) |
+                                        (block == info.max))
+        else:
+            clipped += np.count_nonzero(np.abs(block) >= 1.0)
+    return clipped / data.shape[0]
+
+
+def noise_floor(data, sr, window=DEFAULT_THRESHOLD_WINDOW):
+    '''
+    Noise level of a 1d signal.
+
+    The median of the local noise levels (the MAD of each window scaled to
+    the standard deviation of normal noise, see
+    `threshold.adaptive_envelope`), so that taps do not raise it.
+
+    Returns:
+        tuple (noise level in sample units, noise level in dB relative to
+        the full scale of the sample type, or None if it is 0)
+    '''
+    block = max(int(window * sr / 1000), 1)
+    _, deviations = block_envelope(data, block)
+    level = float(np.median(deviations) * MAD_TO_STD)
+    dbfs = (20 * np.log10(level / full_scale(data.dtype)) if level > 0
+            else None)
+    return level, dbfs
+
+
+def iti_stats(peaks, tolerance=QC_ITI_TOLERANCE):
+    '''
+    Statistics of the inter-tap intervals.
+
+    Params:
+        peaks: 1d array of tap times in ms
+        tolerance: intervals that differ from the median interval by more
+            than this fraction of it (e.g. a missed or a duplicated tap)
+            are counted as outliers
+
+    Returns:
+        dictionary with the number of `taps` and the `iti_mean`,
+        `iti_median`, `iti_std`, `iti_cv` (std / mean), `iti_min`,
+        `iti_max` and number of `iti_outliers`. Statistics are None with
+        less than two taps.
+    '''
+    itis = np.diff(np.asarray(peaks, dtype=np.float64))
+    stats = {'taps': int(len(peaks))}
+    if itis.shape[0] == 0:
+        stats.update({k: None for k in ['iti_mean', 'iti_median', 'iti_std',
+                                        'iti_cv', 'iti_min', 'iti_max',
+                                        'iti_outliers']})
+        return stats
+    median = np.median(itis)
+    mean = itis.mean()
+    stats.update({
+        'iti_mean': float(mean),
+        'iti_median': float(median),
+        'iti_std': float(itis.std()),
+        'iti_cv': float(itis.std() / mean) if mean > 0 else None,
+        'iti_min': float(itis.min()),
+        'iti_max': float(itis.max()),
+        'iti_outliers': int(np.count_nonzero(
+            np.abs(itis - median) > tolerance * median))
+    })
+    return stats
+
+
+def signal_report(recording_signal, sr, input_channel, loopback_channel,
+                  peaks):
+    '''
+    QC metrics of the channels of a recording and its taps.
+
+    Params:
+        recording_signal: 2d array (samples x channels)
+        sr: sample rate
+        input_channel, loopback_channel: channels of the recording
+        peaks: tap times in ms
+
+    Returns:
+        dictionary with the `input_clipping` and `loopback_clipping`
+        ratios, the `noise_floor` and `noise_floor_dbfs` of the input
+        channel and the `iti_stats` of the taps
+    '''
+    level, dbfs = noise_floor(recording_signal[:, input_channel], sr)
+    report = {
+        'input_clipping': clipping_ratio(recording_signal[:, input_channel]),
+        'loopback_clipping': clipping_ratio(
+            recording_signal[:, loopback_channel]),
+        'noise_floor': level,
+        'noise_floor_dbfs': dbfs
+    }
+    report.update(iti_stats(peaks))
+    return report
+
+
+def qc_flags(report, min_correlation=QC_MIN_CORRELATION,
+             min_margin=QC_MIN_MARGIN, max_clipping=QC_MAX_CLIPPING):
+    '''
+    Names of the QC metrics of a report outside their expected range.
+
+    Metrics that are None are not checked.
+
+    Returns:
+        list with any of 'correlation', 'channel_margin', 'input_clipping',
+        'loopback_clipping' and 'iti_outliers'
+    '''
+    flags = []
+    checks = [('correlation', lambda v: v < min_correlation),
+              ('channel_margin', lambda v: v < min_margin),
+              ('input_clipping', lambda v: v > max_clipping),
+              ('loopback_clipping', lambda v: v > max_clipping),
+              ('iti_outliers', lambda v: v > 0)]
+    for name, check in checks:
+        if report.get(name) is not None and check(report[name]):
+            flags.append(name)
+    return flags
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+from scipy.io import wavfile
+from m2.rec2taps import errors
+from m2.rec2taps.streaming import read_wav_mmap
+from m2.rec2taps.defaults import DEFAULT_BLOCK_SIZE
+
+# Sample types used for the PCM subtypes of soundfile. Wider or compressed
+# subtypes are decoded as float32.
+SOUNDFILE_DTYPES = {
+    'PCM_S8': 'int16',
+    'PCM_U8': 'int16',
+    'PCM_16': 'int16',
+    'PCM_24': 'int32',
+    'PCM_32': 'int32',
+    'FLOAT': 'float32',
+    'DOUBLE': 'float64',
+}
+
+SOUNDFILE_FORMATS = ['.flac', '.ogg', '.oga', '.aiff', '.aif', '.au', '.caf',
+                     '.w64', '.rf64', '.mp3']
+
+
+def read_wav(filename, mmap=False):
+    '''
+    Reads a wav file with `scipy.io.wavfile`, the default reader.
+
+    Params:
+        filename: path or file object
+        mmap: if True, the file is memory-mapped when its format allows it
+            (see `streaming.read_wav_mmap`)
+    '''
+    if mmap:
+        return read_wav_mmap(filename)
+    return wavfile.read(filename)
+
+
+def read_soundfile(filename, mmap=False, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Reads an audio file with soundfile (e.g. FLAC).
+
+    The file is decoded in blocks of `block_size` frames directly into the
+    returned array, so no temporary file or intermediate copy is used. The
+    whole recording is still held in memory: compressed files can not be
+    memory-mapped, so mmap is ignored, and the streaming peak detection of
+    `extract_peaks` (block_size) only bounds the memory used for WAV
+    recordings.
+
+    Returns:
+        tuple (sample rate, 2d array of frames x channels)
+    '''
+    try:
+        import soundfile
+    except ImportError:
+        raise errors.UnsupportedAudioFormat(filename,
+                                            'soundfile is not installed')
+
+    with soundfile.SoundFile(filename) as f:
+        dtype = SOUNDFILE_DTYPES.get(f.subtype, 'float32')
+        signal = np.empty((f.frames, f.channels), dtype=dtype)
+        for start in range(0, f.frames, block_size):
+            block = signal[start:start + block_size]
+            read = f.read(block.shape[0], dtype=dtype, always_2d=True,
+                          out=block)
+            if read.shape[0] < block.shape[0]:
+                # Some formats report an approximate number of frames
+                signal = signal[:start + read.shape[0]]
+                break
+        return f.samplerate, signal
+
+
+# Readers by file extension. Files with other extensions (or file objects)
+# are read with `read_wav`.
+READERS = {ext: read_soundfile for ext in SOUNDFILE_FORMATS}
+
+
+def register_reader(extensions, reader):
+    '''
+    Sets the reader of files with the given extensions.
+
+    Params:
+        extensions: sequence of extensions (e.g. ['.flac'])
+        reader: function called as reader(filename, mmap=...) that returns
+            a tuple (sample rate, signal) as `scipy.io.wavfile.read`
+    '''
+    for ext in extensions:
+        READERS[ext.lower()] = reader
+
+
+def audio_reader(filename):
+    'Returns the reader of a file from its extension.'
+    if not isinstance(filename, (str, os.PathLike)):
+        return read_wav
+    ext = os.path.splitext(os.fspath(filename))[1].lower()
+    return READERS.get(ext, read_wav)
+
+
+def read_audio(filename, mmap=False):
+    '''
+    Reads an audio file with the reader of its extension.
+
+    WAV files are read with `scipy.io.wavfile` and need no other library.
+    Other formats (e.g. FLAC) are decoded with soundfile if it is installed
+    (see `READERS` and `register_reader`).
+
+    Params:
+        filename: path or file object
+        mmap: if True, the file is memory-mapped when the reader allows it
+
+    Returns:
+        tuple (sample rate, signal) as `scipy.io.wavfile.read`
+    '''
+    return audio_reader(filename)(filename, mmap=mmap)
@@ -0,0 +1,172 @@
+import numpy as np
+from m2.rec2taps.defaults import SINC_HALF_WIDTH, SINC_RESOLUTION
+from m2.rec2taps.defaults import REFINE_LAG_LENGTH
+
+REFINE_METHODS = ['parabolic', 'sinc']
+
+
+def _gather(signal, positions, offsets, invert=False):
+    '''
+    Returns signal[positions + offsets] as a 2d float64 array (positions x
+    offsets), with zeros outside the signal.
+
+    Only the requested samples are read, so memory-mapped signals are not
+    loaded.
+    '''
+    idx = np.asarray(positions)[:, None] + np.asarray(offsets)[None, :]
+    inside = (idx >= 0) & (idx < signal.shape[0])
+    values = np.asarray(signal[np.clip(idx, 0, signal.shape[0] - 1)],
+                        dtype=np.float64)
+    values[~inside] = 0
+    if invert:
+        np.negative(values, out=values)
+    return values
+
+
+def parabolic_offsets(left, center, right):
+    '''
+    Offsets of the vertices of the parabolas through three equally spaced
+    points, relative to the center point.
+
+    Offsets are bounded to [-0.5, 0.5]. Where the points are collinear the
+    offset is 0.
+    '''
+    denominator = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offsets = 0.5 * (left - right) / denominator
+    offsets[~np.isfinite(offsets)] = 0
+    return np.clip(offsets, -0.5, 0.5)
+
+
+def sinc_kernel(half_width=SINC_HALF_WIDTH, resolution=SINC_RESOLUTION):
+    '''
+    Hann-windowed sinc interpolation kernel.
+
+    Returns:
+        tuple (grid, kernel) where grid are the fractional offsets in [-1, 1]
+        in steps of 1 / resolution and kernel is a 2d array (grid x 2 *
+        half_width + 1) such that `kernel @ y[p - half_width:p + half_width
+        + 1]` interpolates y at p + grid
+    '''
+    grid = np.arange(-resolution, resolution + 1) / resolution
+    taps = np.arange(-half_width, half_width + 1)
+    x = grid[:, None] - taps[None, :]
+    window = 0.5 * (1 + np.cos(np.pi * x / (half_width + 1)))
+    window[np.abs(x) >= half_width + 1] = 0
+    return grid, np.sinc(x) * window
+
+
+def sinc_offsets(values, half_width=SINC_HALF_WIDTH,
+                 resolution=SINC_RESOLUTION):
+    '''
+    Offsets of the maxima of the band-limited interpolation of rows of
+    samples, relative to their center sample.
+
+    The interpolation is evaluated on a grid of `resolution` points per
+    sample within one sample of the center and the maximum of the grid is
+    refined with a parabola.
+
+    Params:
+        values: 2d array (positions x 2 * half_width + 1) of samples around
+            each position
+    '''
+    grid, kernel = sinc_kernel(half_width, resolution)
+    interpolated = values @ kernel.T
+    best = np.clip(np.argmax(interpolated, axis=1), 1, grid.shape[0] - 2)
+    rows = np.arange(values.shape[0])
+    fine = parabolic_offsets(interpolated[rows, best - 1],
+                             interpolated[rows, best],
+                             interpolated[rows, best + 1])
+    return grid[best] + fine / resolution
+
+
+def refine_maxima(signal, positions, method='parabolic', invert=False,
+                  half_width=SINC_HALF_WIDTH):
+    '''
+    Refines the positions of local maxima of a signal to sub-sample
+    precision.
+
+    Only the samples around each position are read, so the time taken is
+    proportional to the number of positions and not to the signal length.
+
+    Params:
+        signal: 1d array-like signal (e.g. a column of a memory-mapped wav)
+        positions: 1d array of integer positions of local maxima
+        method: 'parabolic' fits a parabola through each maximum and its
+            neighbours. 'sinc' finds the maximum of the windowed-sinc
+            interpolation of `half_width` samples on each side.
+        invert: if True, the signal is inverted (* -1)
+
+    Returns:
+        1d float array of refined positions
+    '''
+    positions = np.asarray(positions, dtype=np.intp)
+    if positions.shape[0] == 0:
+        return positions.astype(np.float64)
+
+    if method == 'parabolic':
+        values = _gather(signal, positions, [-1, 0, 1], invert)
+        offsets = parabolic_offsets(values[:, 0], values[:, 1], values[:, 2])
+    elif method == 'sinc':
+        values = _gather(signal, positions,
+                         np.arange(-half_width, half_width + 1), invert)
+        offsets = sinc_offsets(values, half_width)
+    else:
+        raise ValueError('Unknown refinement method {!r} (use one of '
+                         '{})'.format(method, ', '.join(REFINE_METHODS)))
+    return positions + offsets
+
+
+def refine_lag(stimulus_signal, stimulus_channel, recording_signal,
+               recording_channel, lag, method='parabolic',
+               half_width=SINC_HALF_WIDTH, length=REFINE_LAG_LENGTH,
+               offset=0):
+    '''
+    Refines the lag of a recording to the stimulus to sub-sample precision.
+
+    The cross-correlation of the channels is computed directly for the lags
+    around `lag` (3 for 'parabolic' and 2 * half_width + 1 for 'sinc') over
+    `length` samples of the stimulus and its maximum is interpolated with
+    `refine_maxima`, so the cost does not depend on the length of the
+    signals. Lags are never
+    negative, so lags closer to 0 than the 'sinc' neighbourhood are refined
+    with 'parabolic' and a lag of 0 is returned as is.
+
+    Params:
+        stimulus_signal, recording_signal: 2d arrays (samples x channels)
+        stimulus_channel, recording_channel: channels correlated
+        lag: integer lag (in samples) of the correlation maximum
+        method: see `refine_maxima`
+        length: number of samples of the stimulus correlated (e.g. the
+            template of `windowed_channel_crosscorrelation`). If None, the
+            whole stimulus is correlated.
+        offset: first sample of the stimulus correlated (see
+            `lag_template_offset`)
+
+    Returns:
+        float lag in samples
+    '''
+    width = 1 if method == 'parabolic' else half_width
+    if lag < width:
+        if lag < 1:
+            return float(lag)
+        method, width = 'parabolic', 1
+    recording = recording_signal[:, recording_channel]
+    # Only the part of the stimulus that overlaps the recording at every
+    # lag is correlated, in case the recording ends before the stimulus
+    n = min(stimulus_signal.shape[0] - offset,
+            recording.shape[0] - lag - offset - width)
+    if length is not None:
+        n = min(n, length)
+    stimulus = np.asarray(stimulus_signal[offset:offset + n,
+                                          stimulus_channel],
+                          dtype=np.float64)
+
+    # The recording is converted once for all the lags
+    start = lag - width + offset
+    segment = np.asarray(recording[start:start + n + 2 * width],
+                         dtype=np.float64)
+    cc = np.array([np.dot(segment[i:i + n], stimulus)
+                   for i in range(2 * width + 1)])
+    return float(refine_maxima(cc, [width], method, half_width=width)[0]
+                 - width + lag)
@@ -0,0 +1,164 @@
+import os
+import math
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy import fft
+from m2.rec2taps.readers import read_audio
+from m2.rec2taps.defaults import STIMULUS_CACHE_SIZE, SPECTRUM_CACHE_BYTES
+
+
+class Stimulus:
+    '''
+    Decoded stimulus audio with cached cross-correlation templates.
+
+    Cross-correlating a recording channel against a stimulus channel requires
+    the spectrum of the reversed stimulus channel at an FFT length that
+    depends on the recording length. A `Stimulus` keeps these spectra so that
+    many recordings can be matched against it without transforming the
+    stimulus again.
+
+    Spectra span the FFT length of the recordings, so the cache is bounded
+    by its size in bytes (`max_spectra_bytes`) rather than by a number of
+    spectra.
+
+    Caches are safe to use from several threads. A spectrum requested by two
+    threads at once may be computed twice.
+
+    Attributes:
+        sr: sample rate of the stimulus
+        signal: 2d array with the stimulus time series
+        path: file the stimulus was read from (or None)
+    '''
+
+    def __init__(self, sr, signal, path=None,
+                 max_spectra_bytes=SPECTRUM_CACHE_BYTES):
+        self.sr = sr
+        self.signal = signal
+        self.path = path
+        self.max_spectra_bytes = max_spectra_bytes
+        self._spectra = OrderedDict()
+        self._spectra_bytes = 0
+        self._resampled = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        'Reads a stimulus from an audio file (see `readers.read_audio`).'
+        sr, signal = read_audio(path)
+        return cls(sr, signal, path, **kwargs)
+
+    def __str__(self):
+        return str(self.path) if self.path is not None else repr(self)
+
+    def __len__(self):
+        return self.signal.shape[0]
+
+    @property
+    def channels(self):
+        return self.signal.shape[1]
+
+    def reversed_spectra(self, n, dtype=np.float64):
+        '''
+        Returns the real FFT of every reversed channel zero-padded to length n.
+
+        Spectra are cached per (n, dtype), keeping the most recently used
+        ones up to `max_spectra_bytes`. Spectra larger than that are not
+        cached.
+
+        Returns:
+            2d complex array (frequencies x channels)
+        '''
+        key = (n, np.dtype(dtype))
+        with self._lock:
+            if key in self._spectra:
+                self._spectra.move_to_end(key)
+                return self._spectra[key]
+
+        channels = self.signal.shape[1]
+        spectra = np.empty((n // 2 + 1, channels),
+                           dtype=np.result_type(dtype, np.complex64))
+        for c in range(channels):
+            spectra[:, c] = fft.rfft(
+                np.asarray(self.signal[::-1, c], dtype=dtype), n)
+        if spectra.nbytes > self.max_spectra_bytes:
+            logging.debug('Spectra of {} at length {} are not cached ({} '
+                          'bytes)'.format(self, n, spectra.nbytes))
+            return spectra
+        with self._lock:
+            if key not in self._spectra:
+                self._spectra[key] = spectra
+                self._spectra_bytes += spectra.nbytes
+            while self._spectra_bytes > self.max_spectra_bytes:
+                _, evicted = self._spectra.popitem(last=False)
+                self._spectra_bytes -= evicted.nbytes
+        return spectra
+
+    def resampled(self, sr):
+        '''
+        Returns the stimulus resampled to another sample rate.
+
+        Every channel is resampled with a polyphase filter
+        (`scipy.signal.resample_poly`) by the ratio of the rates. Resampled
+        stimuli are cached per rate, along with their own spectra.
+
+        Params:
+            sr: target sample rate
+
+        Returns:
+            `Stimulus` with a float64 signal at rate sr (self if sr equals
+            the rate of the stimulus)
+        '''
+        if sr == self.sr:
+            return self
+        with self._lock:
+            if sr in self._resampled:
+                return self._resampled[sr]
+
+        from scipy.signal import resample_poly
+
+        logging.debug('Resampling {} from {} to {} Hz'.format(self, self.sr,
+                                                             sr))
+        g = math.gcd(int(sr), int(self.sr))
+        signal = resample_poly(self.signal, int(sr) // g, int(self.sr) // g,
+                               axis=0)
+        stimulus = Stimulus(sr, signal, self.path, self.max_spectra_bytes)
+        with self._lock:
+            return self._resampled.setdefault(sr, stimulus)
+
+    def reversed_spectrum(self, channel, n):
+        'Returns the real FFT of a reversed channel zero-padded to length n.'
+        return self.reversed_spectra(n)[:, channel]
+
+
+_stimulus_cache = OrderedDict()
+_stimulus_lock = threading.Lock()
+
+
+def load_stimulus(path, maxsize=STIMULUS_CACHE_SIZE):
+    '''
+    Returns a `Stimulus` for the file, reusing a cached one when possible.
+
+    Stimuli are cached by path and modification time, so a file that changes
+    on disk is read again. The `maxsize` most recently used stimuli are kept.
+    '''
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    with _stimulus_lock:
+        if key in _stimulus_cache:
+            _stimulus_cache.move_to_end(key)
+            return _stimulus_cache[key]
+
+    logging.debug('Loading stimulus {}'.format(path))
+    stimulus = Stimulus.from_file(path)
+    with _stimulus_lock:
+        _stimulus_cache[key] = stimulus
+        while len(_stimulus_cache) > maxsize:
+            _stimulus_cache.popitem(last=False)
+    return stimulus
+
+
+def clear_stimulus_cache():
+    'Removes all stimuli from the cache.'
+    with _stimulus_lock:
+        _stimulus_cache.clear()
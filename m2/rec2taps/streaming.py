@@ -0,0 +1,163 @@
+import logging
+import numpy as np
+from scipy.io import wavfile
+from m2.rec2taps.defaults import DEFAULT_DISTANCE, DEFAULT_PROMINENCE
+from m2.rec2taps.defaults import DEFAULT_BLOCK_SIZE
+
+
+def read_wav_mmap(filename):
+    '''
+    Reads a wav file memory-mapped when its format allows it.
+
+    scipy can not memory-map some formats (e.g. 24 bit PCM), in which case
+    the file is read into memory.
+    '''
+    try:
+        return wavfile.read(filename, mmap=True)
+    except ValueError as e:
+        logging.debug('Reading {} into memory: {}'.format(filename, e))
+        return wavfile.read(filename)
+
+
+def iter_blocks(data, block_size=DEFAULT_BLOCK_SIZE, invert=False):
+    '''
+    Yields consecutive float64 blocks of a 1d signal.
+
+    Blocks are always copies, so they can be rectified in place without
+    modifying the signal.
+
+    Params:
+        data: 1d array-like signal (e.g. a column of a memory-mapped wav)
+        block_size: number of samples per block
+        invert: if True, blocks are inverted (* -1) after being converted,
+            matching `extract_peaks`
+    '''
+    for start in range(0, data.shape[0], block_size):
+        block = data[start:start + block_size]
+        if invert:
+            yield np.negative(block, dtype=np.float64)
+        else:
+            yield np.array(block, dtype=np.float64)
+
+
+class RunningStats:
+    '''
+    Running mean and standard deviation of a signal provided in blocks.
+
+    Block statistics are merged with Chan's parallel algorithm, so the
+    result matches `np.mean` and `np.std` of the whole signal up to rounding.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, block):
+        'Adds a block of samples to the statistics.'
+        n = block.shape[0]
+        if n == 0:
+            return
+        block_mean = block.mean()
+        block_m2 = np.square(block - block_mean).sum()
+        delta = block_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self._m2 += block_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2 / self.count) if self.count > 0 else np.nan
+
+
+def running_std(blocks):
+    'Standard deviation of a signal provided as a sequence of blocks.'
+    stats = RunningStats()
+    for block in blocks:
+        stats.update(block)
+    return stats.std
+
+
+def _last_cut(rect, min_gap):
+    '''
+    Returns a position inside the last run of at least min_gap zeros.
+
+    Returns None if there is no such run.
+    '''
+    is_zero = np.concatenate([[False], rect == 0, [False]])
+    edges = np.flatnonzero(is_zero[1:] != is_zero[:-1])
+    starts, ends = edges[::2], edges[1::2]
+    long_runs = np.flatnonzero(ends - starts >= min_gap)
+    if long_runs.shape[0] == 0:
+        return None
+    run = long_runs[-1]
+    return (starts[run] + ends[run]) // 2
+
+
+def stream_peaks(blocks, prominence_amp, distance):
+    '''
+    Finds peaks of a rectified signal provided as a sequence of blocks.
+
+    The rectified signal is cut inside runs of at least `distance` zeros.
+    Peaks on either side of such a run are farther apart than `distance`
+    and the prominence of a peak can not extend past a zero, so finding
+    peaks on each piece gives the same result as on the whole signal.
+
+    Params:
+        blocks: iterable of 1d float64 arrays
+        prominence_amp: rectification threshold and minimum prominence
+        distance: minimum distance in samples between peaks
+
+    Yields:
+        arrays of peak positions relative to the start of the signal
+    '''
+    from scipy.signal import find_peaks
+
+    min_gap = max(int(np.ceil(distance)), 2)
+    pending = np.empty(0)
+    offset = 0
+    for block in blocks:
+        block[block < prominence_amp] = 0
+        pending = np.concatenate([pending, block])
+        cut = _last_cut(pending, min_gap)
+        if cut is None:
+            continue
+        peaks, _ = find_peaks(pending[:cut], prominence=prominence_amp,
+                              distance=distance)
+        yield peaks + offset
+        pending = pending[cut:]
+        offset += cut
+    peaks, _ = find_peaks(pending, prominence=prominence_amp,
+                          distance=distance)
+    yield peaks + offset
+
+
+def stream_numpy_peaks(data, sr, distance=DEFAULT_DISTANCE,
+                       prominence=DEFAULT_PROMINENCE, invert=False,
+                       block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Block by block version of `numpy_peaks` for signals larger than memory.
+
+    The signal is traversed twice: once to compute its standard deviation
+    and once to find the peaks. Only one block plus the samples since the
+    last long enough silence are held in memory at a time.
+
+    Params:
+        data: 1d array-like signal, usually memory-mapped
+        sr: int indicating sample rate
+        distance: minimun distance in ms between peaks
+        prominence: minimun prominence as multiple of signal standard
+            deviation
+        invert: if True, the signal is inverted (* -1)
+        block_size: number of samples read at a time
+
+    Returns:
+        1d array of peak positions (in samples), equal to
+        `numpy_peaks(data * (1 - 2 * invert), sr, distance, prominence)`
+    '''
+    prominence_a = running_std(iter_blocks(data, block_size, invert)) \
+        * prominence
+    distance = distance * sr / 1000
+    return np.concatenate(list(stream_peaks(
+        iter_blocks(data, block_size, invert), prominence_a, distance)))
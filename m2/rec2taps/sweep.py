@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import numpy as np
+import m2.rec2taps
+from m2.rec2taps import rectify
+from m2.rec2taps.refine import refine_maxima
+from m2.rec2taps.threshold import adaptive_envelope, envelope_rectify
+
+
+def _prominence_peaks(data, sr, level, prominence, distances):
+    '''
+    Finds the peaks for one prominence and several distances.
+
+    The signal is rectified once and shared by every distance. level is the
+    standard deviation of the signal or its adaptive envelope.
+    '''
+    from scipy.signal import find_peaks
+
+    out = np.empty(data.shape, dtype=np.float64)
+    if isinstance(level, tuple):
+        rect, prominence_a = envelope_rectify(data, level, prominence, out)
+    else:
+        prominence_a = level * prominence
+        rect = rectify(data, prominence_a, out)
+    return [find_peaks(rect, prominence=prominence_a,
+                       distance=distance * sr / 1000)[0]
+            for distance in distances]
+
+
+def sweep_peaks(data, sr, distances, prominences, workers=None,
+                threshold='global'):
+    '''
+    Obtains peaks as `numpy_peaks` for every distance/prominence pair.
+
+    The standard deviation (or the adaptive envelope) of the signal is
+    computed once. The signal is
+    rectified once per prominence and prominences are processed by a pool
+    of threads, which share the signal.
+
+    Params:
+        data: 1d-array of signal values
+        sr: int indicating sample rate
+        distances: sequence of minimum distances in ms between peaks
+        prominences: sequence of minimum prominences as multiples of signal
+            standard deviation
+        workers: number of threads. If None, the default of
+            `ThreadPoolExecutor` is used.
+        threshold: see `numpy_peaks`
+
+    Returns:
+        dictionary from (distance, prominence) to 1d array of peaks (in
+        samples), equal to `numpy_peaks(data, sr, distance, prominence,
+        threshold=threshold)`
+    '''
+    if threshold == 'global':
+        level = data.std()
+    elif threshold == 'adaptive':
+        level = adaptive_envelope(data, sr)
+    else:
+        raise ValueError('Unknown threshold method: {}'.format(threshold))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda p: _prominence_peaks(data, sr, level, p, distances),
+            prominences)
+        return {(d, p): peaks
+                for p, prominence_peaks in zip(prominences, results)
+                for d, peaks in zip(distances, prominence_peaks)}
+
+
+def sweep_extract(stimulus_file, recording_file, distances, prominences,
+                  invert_input_signal=False, workers=None, refine=None,
+                  threshold='global', input_channel=None, **options):
+    '''
+    Extracts peaks for every distance/prominence pair of a recording.
+
+    The recording is read and synchronized to the stimulus once (see
+    `synchronize`), so trying many detection parameters costs one
+    cross-correlation plus the peak finding of each pair.
+
+    Params:
+        stimulus_file, recording_file, invert_input_signal, refine,
+        threshold, input_channel: see `extract_peaks`
+        distances, prominences: grids of values of the `extract_peaks`
+            parameters
+        workers: number of threads used to find peaks (see `sweep_peaks`)
+        options: additional keyword arguments for `synchronize`
+
+    Returns:
+        list of dictionaries with the `distance`, `prominence` and `peaks`
+        (in ms relative to the beginning of the stimulus) of every pair,
+        ordered by distance and then prominence
+    '''
+    sr, signal, si, ri, lag_s = m2.rec2taps.synchronize(
+        stimulus_file, recording_file, refine=refine, **options)
+    logging.debug(('Sweeping {} distances and {} prominences for {}').format(
+        len(distances), len(prominences), recording_file))
+
+    fsr_signal = signal[:, m2.rec2taps.select_input_channel(
+        recording_file, signal.shape[1], ri, input_channel)]
+    if invert_input_signal:
+        fsr_signal = np.negative(fsr_signal, dtype=np.float64)
+    else:
+        fsr_signal = np.asarray(fsr_signal, dtype=np.float64)
+
+    lag = lag_s / sr * 1000
+    peaks = sweep_peaks(fsr_signal, sr, distances, prominences, workers,
+                        threshold)
+    if refine is not None:
+        peaks = {k: refine_maxima(fsr_signal, v, refine)
+                 for k, v in peaks.items()}
+    return [{'distance': d, 'prominence': p,
+             'peaks': peaks[d, p] / sr * 1000 - lag}
+            for d in distances for p in prominences]
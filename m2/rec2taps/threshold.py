@@ -0,0 +1,211 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from m2.rec2taps.defaults import (DEFAULT_PROMINENCE,
+                                  DEFAULT_ADAPTIVE_PROMINENCE)
+from m2.rec2taps.defaults import DEFAULT_THRESHOLD_WINDOW, THRESHOLD_HOPS
+from m2.rec2taps.defaults import THRESHOLD_SCALE_FLOOR, THRESHOLD_SAMPLES
+from m2.rec2taps.defaults import DEFAULT_BLOCK_SIZE, RECTIFY_BLOCK_SIZE
+
+THRESHOLD_METHODS = ['global', 'adaptive']
+
+# Ratio between the standard deviation and the median absolute deviation of
+# normally distributed noise
+MAD_TO_STD = 1.4826
+
+
+def default_prominence(threshold='global', prominence=None):
+    '''
+    Returns prominence, or the default prominence of the threshold method if
+    it is None.
+
+    The adaptive threshold measures prominence in multiples of the local
+    noise level, which is much lower than the standard deviation of a signal
+    with taps, so it has a higher default.
+    '''
+    if prominence is not None:
+        return prominence
+    if threshold == 'adaptive':
+        return DEFAULT_ADAPTIVE_PROMINENCE
+    return DEFAULT_PROMINENCE
+
+
+def block_envelope(data, block, samples=THRESHOLD_SAMPLES):
+    '''
+    Median and median absolute deviation (MAD) of consecutive blocks of a
+    signal.
+
+    The statistics of each block are estimated from about `samples` evenly
+    spaced samples of the block, converted to float64 a few blocks at a
+    time, so memory-mapped signals are not loaded at once. Each median is
+    found by partitioning, so the cost is linear in the number of samples
+    used.
+
+    Params:
+        data: 1d array-like signal
+        block: number of samples per block. The last block may be shorter.
+        samples: number of samples of each block used
+
+    Returns:
+        tuple (medians, deviations) of 1d arrays with a value per block
+    '''
+    n = data.shape[0]
+    full = n // block
+    count = full + (n % block > 0)
+    medians = np.empty(count)
+    deviations = np.empty(count)
+    per_chunk = max(DEFAULT_BLOCK_SIZE // block, 1)
+    step = max(block // samples, 1)
+
+    def stats(first, last, values):
+        values = np.array(values.reshape(last - first, -1)[:, ::step],
+                          dtype=np.float64)
+        medians[first:last] = np.median(values, axis=1)
+        values -= medians[first:last, None]
+        np.abs(values, out=values)
+        deviations[first:last] = np.median(values, axis=1)
+
+    for first in range(0, full, per_chunk):
+        last = min(first + per_chunk, full)
+        stats(first, last, data[first * block:last * block])
+    if count > full:
+        stats(full, count, data[full * block:])
+    return medians, deviations
+
+
+def rolling_envelope(data, window, hop, samples=THRESHOLD_SAMPLES):
+    '''
+    Running median and median absolute deviation (MAD) of a signal.
+
+    The statistics are computed over windows of `window` samples starting
+    every `hop` samples (the last window ends at the end of the signal), so
+    consecutive windows overlap when hop is smaller than window. Each
+    window is estimated from about `samples` evenly spaced samples: the
+    signal is subsampled once, a few blocks at a time, so memory-mapped
+    signals are not loaded at once.
+
+    Params:
+        data: 1d array-like signal
+        window: number of samples per window. Signals shorter than a window
+            have a single window.
+        hop: number of samples between window starts, rounded to a multiple
+            of the subsampling step
+        samples: number of samples of each window used
+
+    Returns:
+        tuple (centers, medians, deviations) of 1d arrays with the center
+        (in samples), median and MAD of each window
+    '''
+    n = data.shape[0]
+    step = max(window // samples, 1)
+    chunk = max(DEFAULT_BLOCK_SIZE // step, 1) * step
+    sub = np.empty(-(-n // step))
+    for start in range(0, n, chunk):
+        values = data[start:start + chunk:step]
+        sub[start // step:start // step + values.shape[0]] = values
+
+    width = max(min(window // step, sub.shape[0]), 1)
+    starts = np.arange(0, sub.shape[0] - width + 1, max(hop // step, 1))
+    if starts[-1] != sub.shape[0] - width:
+        starts = np.append(starts, sub.shape[0] - width)
+    windows = sliding_window_view(sub, width)
+    medians = np.empty(starts.shape[0])
+    deviations = np.empty(starts.shape[0])
+    per_chunk = max(DEFAULT_BLOCK_SIZE // width, 1)
+    for first in range(0, starts.shape[0], per_chunk):
+        rows = slice(first, first + per_chunk)
+        values = windows[starts[rows]]
+        medians[rows] = np.median(values, axis=1)
+        values -= medians[rows, None]
+        np.abs(values, out=values)
+        deviations[rows] = np.median(values, axis=1)
+    centers = (starts + (width - 1) / 2) * step
+    return centers, medians, deviations
+
+
+def adaptive_envelope(data, sr, window=DEFAULT_THRESHOLD_WINDOW):
+    '''
+    Local median and noise level of a signal.
+
+    The median and the MAD of the signal are computed over a running window
+    of `window` ms, evaluated every `window / THRESHOLD_HOPS` ms (see
+    `rolling_envelope`) and interpolated linearly in between by
+    `envelope_rectify`. The noise level is the highest MAD of the windows
+    whose middle half contains each point, scaled to the standard deviation
+    of normal noise and bounded below by `THRESHOLD_SCALE_FLOOR` times the
+    standard deviation of the signal, so that digital silence does not
+    yield a noise level of 0. Both statistics ignore taps as long as they
+    occupy less than half of every window, while noise lasting more than
+    half a window raises the noise level over all its length.
+
+    Params:
+        data: 1d array-like signal
+        sr: int indicating sample rate
+        window: length in ms of the windows
+
+    Returns:
+        tuple (centers, medians, levels) of 1d arrays with the center (in
+        samples), median and noise level of each window
+    '''
+    window = max(int(window * sr / 1000), 1)
+    centers, medians, levels = rolling_envelope(
+        data, window, max(window // THRESHOLD_HOPS, 1))
+    # The level at each center is the highest of the windows whose middle
+    # half contains it, so a burst of noise raises the threshold over all
+    # its length and not only where it fills more than half of a window
+    reach = max(THRESHOLD_HOPS // 4, 1)
+    levels = sliding_window_view(np.pad(levels, reach, 'edge'),
+                                 2 * reach + 1).max(axis=1)
+    levels *= MAD_TO_STD
+    np.maximum(levels, THRESHOLD_SCALE_FLOOR * np.std(data), out=levels)
+    return centers, medians, levels
+
+
+def envelope_rectify(data, envelope, prominence, out=None):
+    '''
+    Rectifies a signal with the threshold given by its envelope.
+
+    The envelope is interpolated linearly between window centers. The
+    median is subtracted from the signal, so slow drifts of the baseline
+    are removed, and values below `prominence` times the noise level are
+    set to 0.
+
+    Params:
+        data: 1d array-like signal
+        envelope: envelope of data as returned by `adaptive_envelope`
+        prominence: threshold as multiple of the noise level
+        out: float64 array where the result is written, which may be data
+            itself. If None, a new array is used.
+
+    Returns:
+        tuple (rectified signal, threshold of each sample), both 1d float64
+        arrays. The threshold is also the minimum prominence of a peak.
+    '''
+    centers, medians, levels = envelope
+    n = data.shape[0]
+    if out is None:
+        out = np.empty(n, dtype=np.float64)
+    thresholds = np.empty(n, dtype=np.float64)
+    for start in range(0, n, RECTIFY_BLOCK_SIZE):
+        stop = min(start + RECTIFY_BLOCK_SIZE, n)
+        positions = np.arange(start, stop)
+        rect = out[start:stop]
+        rect[:] = data[start:stop]
+        rect -= np.interp(positions, centers, medians)
+        threshold = thresholds[start:stop]
+        threshold[:] = np.interp(positions, centers, levels)
+        threshold *= prominence
+        rect[rect < threshold] = 0
+    return out, thresholds
+
+
+def adaptive_rectify(data, sr, prominence, window=DEFAULT_THRESHOLD_WINDOW,
+                     out=None):
+    '''
+    Rectifies a signal with a threshold that follows its local level.
+
+    Equivalent to `envelope_rectify(data, adaptive_envelope(data, sr,
+    window), prominence, out)`. The envelope is computed before data is
+    written, so out may be data itself.
+    '''
+    return envelope_rectify(data, adaptive_envelope(data, sr, window),
+                            prominence, out)
@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from m2.rec2taps import batch
+from m2.rec2taps.defaults import DEFAULT_WORKER_PENDING
+
+# Request keys passed as keyword arguments to extract_peaks
+REQUEST_OPTIONS = ['crosscorrelation_method', 'block_size', 'refine',
+                   'resample_stimulus', 'min_lag', 'max_lag', 'threshold',
+                   'input_channel']
+
+
+def handle_request(request, **options):
+    '''
+    Processes a worker request.
+
+    A request is a dictionary with the keys of a batch manifest row
+    (`stimulus`, `recording` and optionally `distance`, `prominence` and
+    `invert`, parsed as in manifests), any of the `REQUEST_OPTIONS`, an
+    optional `id` that is copied to the response and an optional `qc` flag
+    to include the QC report (see `batch.extract_item`).
+
+    Errors are reported in the response, as `extract_item` does, so a
+    failed request does not affect the others.
+
+    Params:
+        request: request dictionary
+        options: default keyword arguments for `extract_peaks` (e.g. a
+            `cache`)
+
+    Returns:
+        JSON serializable response with the `id`, `stimulus`, `recording`,
+        `peaks` (list of tap times in ms or None), `info`, `error` (None
+        on success) and, if requested, `qc` and `qc_flags`
+    '''
+    response = {'id': request.get('id')}
+    try:
+        item = {k: request[k] for k in ['stimulus', 'recording']}
+        item.update(batch.parse_parameters(request))
+        options = dict(options)
+        options.update({k: request[k] for k in REQUEST_OPTIONS
+                        if request.get(k) is not None})
+        if request.get('qc'):
+            options['qc'] = True
+        result = batch.extract_item(item, **options)
+    except Exception as e:
+        # Malformed requests (e.g. missing keys or unknown options)
+        logging.debug('Invalid request {}: {!r}'.format(request, e))
+        response.update({'stimulus': request.get('stimulus'),
+                         'recording': request.get('recording'),
+                         'peaks': None, 'info': None,
+                         'error': 'Invalid request: {!r}'.format(e)})
+        return response
+
+    response.update({
+        'stimulus': result['stimulus'],
+        'recording': result['recording'],
+        'peaks': (None if result['peaks'] is None
+                  else [float(p) for p in result['peaks']]),
+        'info': result['info'] or None,
+        'error': result['error']
+    })
+    if 'qc' in result:
+        response['qc'] = result['qc']
+        response['qc_flags'] = result['qc_flags']
+    return response
+
+
+def _parse_line(line):
+    'Returns the request of a line or an error response.'
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return None, {'id': None, 'peaks': None, 'info': None,
+                      'error': 'Invalid JSON: {}'.format(e)}
+    if not isinstance(request, dict):
+        return None, {'id': None, 'peaks': None, 'info': None,
+                      'error': 'Invalid request: not a JSON object'}
+    return request, None
+
+
+class Worker:
+    '''
+    Long-running extraction worker.
+
+    Requests are processed by a pool of threads that share the process
+    state, so stimuli decoded with `load_stimulus` (and their spectra) and
+    the FFT plans of scipy are reused by later requests. The numerical work
+    releases the GIL, so requests are processed concurrently.
+
+    Params:
+        workers: number of threads. If None, the default of
+            `ThreadPoolExecutor` is used.
+        max_pending: maximum number of requests queued or being processed.
+            Reading requests blocks while the limit is reached.
+        options: default keyword arguments for `extract_peaks`
+    '''
+
+    def __init__(self, workers=None, max_pending=DEFAULT_WORKER_PENDING,
+                 **options):
+        self.options = options
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, request, callback):
+        '''
+        Queues a request. callback is called with the response from a pool
+        thread.
+        '''
+        self._pending.acquire()
+
+        def run():
+            try:
+                callback(handle_request(request, **self.options))
+            except Exception as e:
+                logging.error('Failed to send response: {}'.format(e))
+            finally:
+                self._pending.release()
+
+        try:
+            return self._executor.submit(run)
+        except BaseException:
+            self._pending.release()
+            raise
+
+    def serve_lines(self, lines, write):
+        '''
+        Processes JSON-lines requests, writing a JSON line per response.
+
+        Responses are written as requests complete, which may not be the
+        order of the requests. Returns when all the requests are answered.
+        Only the requests in flight are kept (at most `max_pending`, as
+        reading blocks in `submit`), so lines can be served indefinitely.
+
+        Params:
+            lines: iterable of request lines (e.g. a file)
+            write: function called with each response line
+        '''
+        lock = threading.Lock()
+        in_flight = set()
+        in_flight_lock = threading.Lock()
+
+        def done(future):
+            with in_flight_lock:
+                in_flight.discard(future)
+
+        def respond(response):
+            try:
+                line = json.dumps(response) + '\n'
+            except (TypeError, ValueError) as e:
+                logging.error('Failed to serialize response: {}'.format(e))
+                line = json.dumps({
+                    'id': response.get('id'), 'peaks': None, 'info': None,
+                    'error': 'Invalid response: {}'.format(e)}) + '\n'
+            with lock:
+                write(line)
+
+        for line in lines:
+            if not line.strip():
+                continue
+            request, error = _parse_line(line)
+            if error is not None:
+                respond(error)
+            else:
+                future = self.submit(request, respond)
+                with in_flight_lock:
+                    in_flight.add(future)
+                future.add_done_callback(done)
+        with in_flight_lock:
+            remaining = list(in_flight)
+        wait(remaining)
+
+    def serve_stream(self, infile, outfile):
+        'Serves JSON-lines requests from a file (e.g. the standard input).'
+        def write(line):
+            outfile.write(line)
+            outfile.flush()
+        self.serve_lines(infile, write)
+
+    def serve_unix(self, path):
+        '''
+        Serves JSON-lines requests on a Unix socket until interrupted.
+
+        Every connection is served by its own thread, sharing the pool of
+        the worker. A socket left at path (e.g. by a killed worker) is
+        replaced, but FileExistsError is raised if path is another file.
+        '''
+        worker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                lines = (line.decode() for line in self.rfile)
+                worker.serve_lines(
+                    lines, lambda line: self.wfile.write(line.encode()))
+
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise FileExistsError('{} exists and is not a socket'.format(
+                    path))
+            os.unlink(path)
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+            logging.debug('Serving on {}'.format(path))
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(path)
+
+    def close(self):
+        'Waits for the pending requests and stops the pool.'
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -19,10 +19,19 @@ setup(name='m2-rec2taps',
       packages=['m2', 'm2.rec2taps'],
       namespace_packages=['m2'],
       entry_points={
-          'console_scripts': ['rec2taps=m2.rec2taps.cli:rec2taps']
+          'console_scripts': [
+              'rec2taps=m2.rec2taps.cli:rec2taps',
+              'rec2taps-batch=m2.rec2taps.cli:rec2taps_batch',
+              'rec2taps-sweep=m2.rec2taps.cli:rec2taps_sweep',
+              'rec2taps-worker=m2.rec2taps.cli:rec2taps_worker',
+          ]
       },
       install_requires=[
           'numpy',
           'scipy'
       ],
+      extras_require={
+          'arrow': ['pyarrow'],
+          'flac': ['soundfile']
+      },
       )
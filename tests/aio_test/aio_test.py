@@ -0,0 +1,74 @@
+import asyncio
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import aio
+
+SR = 8000
+
+
+def test_extract_peaks(tmp_path, write_pair):
+    sti, rec = write_pair(tmp_path, 'a')
+    info = {}
+
+    peaks = asyncio.run(aio.extract_peaks(sti, rec, distance=50, info=info))
+
+    np.testing.assert_array_equal(
+        peaks, m2.rec2taps.extract_peaks(sti, rec, distance=50))
+    assert info['lag_samples'] == 120
+
+
+@pytest.mark.parametrize('concurrency,read_ahead', [(1, 0), (2, 3)])
+def test_extract_stream(tmp_path, concurrency, read_ahead, write_pair):
+    pairs = [write_pair(tmp_path, 'a'), write_pair(tmp_path, 'bb', lag_s=40),
+             write_pair(tmp_path, 'ccc', lag_s=300)]
+    items = [{'stimulus': s, 'recording': r} for s, r in pairs]
+    items.insert(1, {'stimulus': pairs[0][0],
+                     'recording': str(tmp_path / 'missing.wav')})
+
+    async def collect():
+        return [r async for r in aio.extract_stream(
+            items, concurrency=concurrency, read_ahead=read_ahead)]
+
+    results = asyncio.run(collect())
+
+    assert [r['recording'] for r in results] == \
+        [item['recording'] for item in items]
+    assert results[1]['peaks'] is None
+    assert results[1]['error'] is not None
+    for (s, r), result in zip(pairs, results[:1] + results[2:]):
+        assert result['error'] is None
+        np.testing.assert_array_equal(result['peaks'],
+                                      m2.rec2taps.extract_peaks(s, r))
+
+
+def test_extract_stream_limits(tmp_path, mocker, write_pair):
+    pairs = [write_pair(tmp_path, str(i) * (i + 1)) for i in range(5)]
+    items = [{'stimulus': s, 'recording': r} for s, r in pairs]
+    counts = {'loaded': 0, 'max_loaded': 0}
+    read_pair = aio.read_pair
+
+    async def counting_read_pair(*args):
+        counts['loaded'] += 1
+        counts['max_loaded'] = max(counts['max_loaded'], counts['loaded'])
+        return await read_pair(*args)
+
+    extract_item = aio.batch.extract_item
+
+    def counting_extract_item(*args, **kwargs):
+        try:
+            return extract_item(*args, **kwargs)
+        finally:
+            counts['loaded'] -= 1
+
+    mocker.patch.object(aio, 'read_pair', counting_read_pair)
+    mocker.patch.object(aio.batch, 'extract_item', counting_extract_item)
+
+    async def collect():
+        return [r async for r in aio.extract_stream(
+            items, concurrency=1, read_ahead=1)]
+
+    results = asyncio.run(collect())
+
+    assert all(r['error'] is None for r in results)
+    assert counts['max_loaded'] <= 2
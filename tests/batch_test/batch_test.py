@@ -0,0 +1,174 @@
+import json
+import pytest
+from concurrent.futures import Future
+import numpy as np
+import m2.rec2taps
+from m2.rec2taps import batch
+from scipy.io import wavfile
+
+SR = 8000
+
+
+def test_read_manifest_csv(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('stimulus,recording,distance,prominence\n'
+                        's.wav,r.wav,50,\n'
+                        's.wav,r2.wav,,2.5\n')
+
+    items = batch.read_manifest(str(manifest))
+
+    assert items == [
+        {'stimulus': str(tmp_path / 's.wav'),
+         'recording': str(tmp_path / 'r.wav'),
+         'distance': 50},
+        {'stimulus': str(tmp_path / 's.wav'),
+         'recording': str(tmp_path / 'r2.wav'),
+         'prominence': 2.5},
+    ]
+
+
+def test_read_manifest_json(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([
+        {'stimulus': 's.wav', 'recording': 'r.wav', 'invert': 'true'}
+    ]))
+
+    items = batch.read_manifest(str(manifest))
+
+    assert items == [{'stimulus': str(tmp_path / 's.wav'),
+                      'recording': str(tmp_path / 'r.wav'),
+                      'invert': True}]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_extract_batch(tmp_path, processes, write_pair):
+    pairs = [write_pair(tmp_path, 'a'), write_pair(tmp_path, 'b', lag_s=40)]
+    items = [{'stimulus': s, 'recording': r} for s, r in pairs]
+    items.insert(1, {'stimulus': pairs[0][0],
+                     'recording': str(tmp_path / 'missing.wav')})
+
+    results = batch.extract_batch(items, processes=processes)
+
+    assert [r['recording'] for r in results] == [i['recording']
+                                                 for i in items]
+    assert results[1]['peaks'] is None
+    assert results[1]['error'] is not None
+    for i in [0, 2]:
+        expected = m2.rec2taps.extract_peaks(items[i]['stimulus'],
+                                             items[i]['recording'])
+        assert results[i]['error'] is None
+        assert (results[i]['peaks'] == expected).all()
+
+
+def test_extract_batch_reports_rec2taps_errors(tmp_path, write_pair):
+    sti_file, rec_file = write_pair(tmp_path, 'a')
+    wavfile.write(str(tmp_path / 'other_sr.wav'), SR * 2,
+                  np.zeros((SR * 3, 2), dtype=np.int16))
+
+    results = batch.extract_batch(
+        [{'stimulus': sti_file, 'recording': str(tmp_path / 'other_sr.wav')}],
+        processes=1)
+
+    assert 'do not have the same sample rate' in results[0]['error']
+
+
+def test_extract_batch_plots(tmp_path, mocker, write_pair):
+    debug_plot = mocker.patch('m2.rec2taps.plotting.debug_plot')
+    items = [{'stimulus': s, 'recording': r}
+             for s, r in [write_pair(tmp_path, 'a'),
+                          write_pair(tmp_path, 'b', lag_s=300)]]
+    items.append({'stimulus': items[0]['stimulus'], 'recording': 'missing'})
+
+    plot_dir = str(tmp_path / 'plots')
+
+    results = batch.extract_batch(items, processes=1, plot_dir=plot_dir,
+                                  plot_window=50)
+
+    assert debug_plot.call_count == 2
+    for (args, _), item, result in zip(debug_plot.call_args_list, items,
+                                       results):
+        filename, signal, sr, peaks, invert, window = args
+        assert filename == batch.plot_path(
+            item, plot_dir, root=batch.recording_root(items))
+        assert sr == SR and window == 50 and not invert
+        assert np.allclose(peaks, result['peaks'] +
+                           result['info']['lag_ms'])
+        assert list(np.round(peaks / 1000 * SR)) == [2009, 6009, 10009]
+
+
+class RecordingExecutor:
+    'Executor that runs tasks when submitted and records their order.'
+
+    def __init__(self):
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def submit(self, fn, *args):
+        self.calls.append(fn.__name__)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_extract_batch_pool_interleaves_plots(mocker):
+    executor = RecordingExecutor()
+    mocker.patch('m2.rec2taps.batch.ProcessPoolExecutor',
+                 return_value=executor)
+    mocker.patch('m2.rec2taps.batch.extract_item',
+                 side_effect=lambda item, *args, **kwargs: {
+                     'recording': item['recording'], 'error': None})
+    plot_result = mocker.patch('m2.rec2taps.batch.plot_result')
+    plot_result.__name__ = 'plot_result'
+    items = [{'stimulus': 's.wav', 'recording': '{}.wav'.format(i)}
+             for i in range(7)]
+
+    results = batch.extract_batch(items, processes=2, chunksize=1,
+                                  plot_dir='plots')
+
+    assert [r['recording'] for r in results] == [i['recording']
+                                                 for i in items]
+    assert [args[0] for args, _ in plot_result.call_args_list] == results
+    calls = executor.calls
+    assert calls.count('_extract_chunk') == 7
+    assert calls.count('plot_result') == 7
+    # Up to 2 chunks per process are queued before the first plot, the
+    # next chunk is queued after its plot
+    assert calls[:6] == ['_extract_chunk'] * 4 + ['plot_result',
+                                                   '_extract_chunk']
+
+
+def test_output_paths_mirror_directories(tmp_path):
+    items = [{'recording': str(tmp_path / 'a' / 's01.wav')},
+             {'recording': str(tmp_path / 'b' / 's01.wav')},
+             {'recording': str(tmp_path / 'b' / 'x' / 's02.wav'),
+              'output': 'given.txt'}]
+
+    root = batch.recording_root(items)
+
+    assert root == str(tmp_path)
+    assert [batch.output_path(item, 'out', root) for item in items] == [
+        'out/a/s01.txt', 'out/b/s01.txt', 'given.txt']
+    assert batch.plot_path(items[2], 'plots', root=root) == 'plots/b/x/s02.png'
+    assert batch.output_path(items[0], 'out') == 'out/s01.txt'
+
+
+def test_extract_batch_plots_same_names(tmp_path, mocker, write_pair):
+    debug_plot = mocker.patch('m2.rec2taps.plotting.debug_plot')
+    items = []
+    for name in ['a', 'b']:
+        (tmp_path / name).mkdir()
+        s, r = write_pair(tmp_path / name, 'p')
+        items.append({'stimulus': s, 'recording': r})
+    plot_dir = tmp_path / 'plots'
+
+    batch.extract_batch(items, processes=1, plot_dir=str(plot_dir))
+
+    filenames = sorted(args[0] for args, _ in debug_plot.call_args_list)
+    assert filenames == [str(plot_dir / 'a' / 'p_rec.png'),
+                         str(plot_dir / 'b' / 'p_rec.png')]
+    assert (plot_dir / 'a').is_dir() and (plot_dir / 'b').is_dir()
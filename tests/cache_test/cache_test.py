@@ -0,0 +1,139 @@
+import argparse
+import os
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import cache as result_cache
+from m2.rec2taps import errors
+from m2.rec2taps.cache import ResultCache
+from m2.rec2taps.cli import result_cache as cli_result_cache
+from m2.rec2taps.profiling import StageProfiler
+from scipy.io import wavfile
+
+SR = 8000
+
+
+@pytest.fixture
+def files(tmp_path, write_pair):
+    return write_pair(tmp_path)
+
+
+def stages(profiler):
+    return [s['stage'] for s in profiler.report()['stages']]
+
+
+def test_cached_peaks(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    expected = rec2taps.extract_peaks(*files)
+
+    first = rec2taps.extract_peaks(*files, cache=cache)
+    profiler = StageProfiler()
+    second = rec2taps.extract_peaks(*files, cache=cache, profiler=profiler)
+
+    assert len(expected) > 0
+    assert (first == expected).all()
+    assert (second == expected).all()
+    assert stages(profiler) == ['cache_lookup']
+
+
+def test_cached_lag(files, tmp_path, mocker):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    rec2taps.extract_peaks(*files, cache=cache)
+    expected = rec2taps.extract_peaks(*files, prominence=3)
+
+    bcc = mocker.spy(rec2taps, 'best_channel_crosscorrelation')
+    profiler = StageProfiler()
+    peaks = rec2taps.extract_peaks(*files, prominence=3, cache=cache,
+                                   profiler=profiler)
+
+    assert (peaks == expected).all()
+    bcc.assert_not_called()
+    assert 'read_stimulus' not in stages(profiler)
+
+
+def test_changed_file(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    rec2taps.extract_peaks(*files, cache=cache)
+
+    sr, rec = wavfile.read(files[1])
+    rec[:, 1] = 0
+    rec[SR:SR + 50, 1] = 10000
+    wavfile.write(files[1], sr, rec)
+    os.utime(files[1], ns=(0, 0))
+
+    peaks = rec2taps.extract_peaks(*files, cache=cache)
+    assert len(peaks) == 1
+
+
+def test_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10000)
+    for i in range(10):
+        cache.put_peaks(str(i), np.arange(200.0))
+        os.utime(cache._path('peaks', str(i)), ns=(i, i))
+
+    assert cache.size() <= 10000
+    assert cache.get_peaks('9') is not None
+    assert cache.get_peaks('0') is None
+
+
+def test_clear(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put_lag('a', SR, 0, 1, 100, SR)
+    (tmp_path / 'other.txt').write_text('kept')
+
+    assert cache.get_lag('a') == (SR, 0, 1, 100, SR)
+    cache.clear()
+    assert cache.get_lag('a') is None
+    assert (tmp_path / 'other.txt').exists()
+
+
+def test_corrupt_entry(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    rec2taps.extract_peaks(*files, cache=cache)
+    for path, _, _ in cache.entries():
+        with open(path, 'wb') as f:
+            f.write(b'PK\x03\x04 truncated')
+
+    peaks = rec2taps.extract_peaks(*files, cache=cache)
+
+    assert (peaks == rec2taps.extract_peaks(*files)).all()
+
+
+def test_resampled_lag_not_reused(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    sr, stim = wavfile.read(files[0])
+    wavfile.write(files[0], sr * 2, np.repeat(stim, 2, axis=0))
+    rec2taps.extract_peaks(*files, cache=cache, resample_stimulus=True)
+
+    with pytest.raises(errors.UnequalSampleRate):
+        rec2taps.extract_peaks(*files, cache=cache)
+
+
+def test_cached_lag_checks_sample_rate(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = rec2taps._lag_key(*files, 'exhaustive')
+    cache.put_lag(key, SR, 1, 0, 77, SR * 2)
+
+    with pytest.raises(errors.UnequalSampleRate):
+        rec2taps.synchronize(*files, cache=cache)
+
+
+def test_file_hashes_bounded(tmp_path, mocker):
+    mocker.patch('m2.rec2taps.cache.FILE_HASH_CACHE_SIZE', 2)
+    mocker.patch('m2.rec2taps.cache._file_hashes', result_cache.OrderedDict())
+    for i in range(5):
+        (tmp_path / str(i)).write_text(str(i))
+        result_cache.file_hash(str(tmp_path / str(i)))
+
+    assert len(result_cache._file_hashes) == 2
+
+
+def test_clear_default_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('REC2TAPS_CACHE_DIR', raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    cache = ResultCache()
+    cache.put_peaks('a', np.arange(3.0))
+    args = argparse.Namespace(cache=None, no_cache=False, clear_cache=True)
+
+    assert cli_result_cache(args) is None
+    assert cache.get_peaks('a') is None
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+
+def _write_pair(directory, name='', lag_s=120, taps=(2000, 6000, 10000),
+                loopback_channel=0, stimulus_channel=0, channels=2,
+                inverted=(), length=None, sr=8000):
+    '''
+    Writes a synthetic stimulus/recording pair and returns their paths.
+
+    The stimulus is 2 s of uniform noise in two channels (seeded by the
+    length of name). The recording has a channel of the stimulus delayed by
+    lag_s samples in its loopback channel and 20 samples long taps in the
+    others.
+
+    Params:
+        directory: directory of the files, named `<name>_stim.wav` and
+            `<name>_rec.wav` (or `stim.wav` and `rec.wav` without a name)
+        taps: tap positions (in samples) of the input channel of a two
+            channel recording, or a dictionary from channel to positions
+        inverted: channels whose taps are negative
+        length: samples of the recording. Defaults to the stimulus, the lag
+            and 500 samples.
+    '''
+    rng = np.random.RandomState(len(name))
+    stim = (rng.uniform(-1, 1, (sr * 2, 2)) * 10000).astype(np.int16)
+    if length is None:
+        length = stim.shape[0] + lag_s + 500
+    rec = np.zeros((length, channels), dtype=np.int16)
+    n = min(stim.shape[0], length - lag_s)
+    rec[lag_s:lag_s + n, loopback_channel] = stim[:n, stimulus_channel]
+    if not isinstance(taps, dict):
+        taps = {1 - loopback_channel: taps}
+    for channel, positions in taps.items():
+        for t in positions:
+            rec[t:t + 20, channel] = -20000 if channel in inverted else 20000
+    prefix = name + '_' if name else ''
+    sti_file = str(directory / (prefix + 'stim.wav'))
+    rec_file = str(directory / (prefix + 'rec.wav'))
+    wavfile.write(sti_file, sr, stim)
+    wavfile.write(rec_file, sr, rec)
+    return sti_file, rec_file
+
+
+@pytest.fixture
+def write_pair():
+    'Factory of synthetic stimulus/recording pairs (see `_write_pair`).'
+    return _write_pair
@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+from scipy.signal import fftconvolve
+from m2.rec2taps import errors
+from m2.rec2taps.correlation import channel_crosscorrelations
+from m2.rec2taps.correlation import crosscorrelation_matrix
+from m2.rec2taps.stimulus import Stimulus
+
+
+@pytest.fixture(scope='module')
+def signals():
+    rng = np.random.RandomState(0)
+    signal_b = rng.normal(0, 1000, (3000, 3)).astype(np.int16)
+    signal_a = rng.normal(0, 100, (5000, 4)).astype(np.int16)
+    signal_a[1234:1234 + 3000, 2] += signal_b[:, 1]
+    return signal_a, signal_b
+
+
+def test_channel_crosscorrelations(signals):
+    signal_a, signal_b = signals
+
+    cc = channel_crosscorrelations(signal_a, signal_b)
+
+    assert cc.shape == (5000 - 3000 + 1, 3, 4)
+    for b in range(3):
+        for a in range(4):
+            expected = fftconvolve(signal_a[:, a], signal_b[::-1, b], 'valid')
+            assert np.allclose(cc[:, b, a], expected, atol=1e-3)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('stimulus', [False, True])
+def test_crosscorrelation_matrix(signals, dtype, stimulus):
+    signal_a, signal_b = signals
+    if stimulus:
+        signal_b = Stimulus(1000, signal_b)
+
+    maxima, argmaxima = crosscorrelation_matrix(signal_a, signal_b, dtype)
+
+    assert maxima.dtype == dtype
+    assert maxima.shape == (3, 4)
+    assert np.unravel_index(np.argmax(maxima), maxima.shape) == (1, 2)
+    assert argmaxima[1, 2] == 1234
+
+
+def test_signal_too_short(signals):
+    signal_a, signal_b = signals
+    with pytest.raises(errors.SignalTooShortForConvolution):
+        channel_crosscorrelations(signal_b, signal_a)
@@ -109,3 +109,148 @@ def test_best_channel_crosscorrelation(stim_data, stim_alt_data, rec_data,
 
     assert r[1] == rec_channel
     assert abs((r[2] * 1000 / SR) - (stim_base_lag + lag)) < 1
+
+
+@pytest.fixture(scope='module')
+def synthetic_data():
+    'Noise stimulus with unequal channels and a recording with its loopback'
+    rng = np.random.RandomState(1)
+    stim = rng.normal(0, 3000, (SR, 2))
+    rec = np.array([rng.normal(0, 300, SR + 2 * SR // 10),
+                    np.zeros(SR + 2 * SR // 10)]).T
+    rec[SR // 10:SR // 10 + SR, 1] = stim[:, 1] * 0.5
+    return stim.astype(np.int16), rec.astype(np.int16)
+
+
+@pytest.mark.parametrize('lag', LAGS)
+@pytest.mark.parametrize('inverted', [False, True])
+def test_coarse_channel_crosscorrelation(synthetic_data, lag, inverted):
+    '''
+    Tests the coarse-to-fine method against the exhaustive one, with the
+    loopback in either channel of the recording.
+    '''
+    stim, rec = synthetic_data
+    if inverted:
+        rec = rec[:, ::-1]
+    rec = lag_signal(rec, lag, SR)
+
+    expected = rec2taps.best_channel_crosscorrelation(stim, rec)
+    r = rec2taps.best_channel_crosscorrelation(stim, rec, 'coarse')
+
+    assert expected[:2] == (1, 0 if inverted else 1)
+    assert r == expected
+
+
+@pytest.mark.parametrize('lag', [3, 4803, 9997])
+def test_coarse_channel_crosscorrelation_multichannel(lag):
+    '''
+    Lags that are not multiples of the decimation factor, with several
+    stimulus and recording channels.
+    '''
+    rng = np.random.RandomState(lag)
+    stim = rng.normal(0, 3000, (SR // 2, 3))
+    rec = rng.normal(0, 300, (SR // 2 + SR // 4, 4))
+    rec[lag:lag + stim.shape[0], 2] = stim[:, 1] * 0.5
+    stim, rec = stim.astype(np.int16), rec.astype(np.int16)
+
+    expected = rec2taps.best_channel_crosscorrelation(stim, rec)
+    r = rec2taps.best_channel_crosscorrelation(stim, rec, 'coarse')
+
+    assert lag % rec2taps.DEFAULT_DECIMATION != 0
+    assert expected == (1, 2, lag)
+    assert r == expected
+
+
+def test_unknown_crosscorrelation_method(synthetic_data):
+    with pytest.raises(ValueError):
+        rec2taps.best_channel_crosscorrelation(*synthetic_data, 'other')
+
+
+@pytest.mark.parametrize('lag', LAGS)
+def test_windowed_channel_crosscorrelation(synthetic_data, lag):
+    stim, rec = synthetic_data
+    rec = lag_signal(rec, lag, SR)
+
+    expected = rec2taps.best_channel_crosscorrelation(stim, rec)
+    r = rec2taps.windowed_channel_crosscorrelation(
+        stim, rec, max(expected[2] - 100, 0), expected[2] + 100, SR // 4)
+
+    assert r == expected
+
+
+def test_windowed_channel_crosscorrelation_short_recording(synthetic_data):
+    'The recording may end before the stimulus'
+    stim, rec = synthetic_data
+    expected = rec2taps.best_channel_crosscorrelation(stim, rec)
+
+    r = rec2taps.windowed_channel_crosscorrelation(stim, rec[:SR // 2], 0,
+                                                   SR // 4, SR // 8)
+    assert r == expected
+
+    with pytest.raises(ValueError):
+        rec2taps.windowed_channel_crosscorrelation(stim, rec, 100, 50)
+
+
+@pytest.fixture(scope='module')
+def leading_silence():
+    'Stimulus starting with 3 s of silence and a recording lagged 5760 samples'
+    rng = np.random.RandomState(3)
+    stim = np.zeros((SR * 6, 2))
+    stim[SR * 3:] = rng.normal(0, 3000, (SR * 3, 2))
+    rec = np.array([rng.normal(0, 300, SR * 7), np.zeros(SR * 7)]).T
+    rec[5760:5760 + stim.shape[0], 1] = stim[:, 0]
+    return stim.astype(np.int16), rec.astype(np.int16)
+
+
+def test_windowed_channel_crosscorrelation_leading_silence(leading_silence):
+    stim, rec = leading_silence
+
+    assert rec2taps.best_channel_crosscorrelation(stim, rec) == (0, 1, 5760)
+    assert rec2taps.windowed_channel_crosscorrelation(
+        stim, rec, 0, SR // 2, 2 * SR) == (0, 1, 5760)
+    assert rec2taps.lag_template_offset(stim, 2 * SR) == SR * 3
+
+
+def test_windowed_channel_crosscorrelation_silent_template(leading_silence):
+    stim, rec = leading_silence
+
+    with pytest.raises(rec2taps.errors.SilentLagTemplate):
+        rec2taps.windowed_channel_crosscorrelation(stim, rec, 0, SR // 2,
+                                                   2 * SR, 0)
+    with pytest.raises(rec2taps.errors.SilentLagTemplate):
+        rec2taps.windowed_channel_crosscorrelation(stim[:SR * 3], rec, 0,
+                                                   SR // 2, 2 * SR)
+
+
+def test_extract_peaks_lag_window_leading_silence(leading_silence, tmp_path):
+    stim, rec = leading_silence
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+
+    info = {}
+    rec2taps.extract_peaks(sti_file, rec_file, max_lag=500, info=info)
+    assert info['lag_samples'] == 5760
+
+
+def test_extract_peaks_lag_window(synthetic_data, tmp_path):
+    stim, rec = synthetic_data
+    rec = rec[:SR // 2].copy()
+    rec[:, 0] = 0
+    rec[SR // 5:SR // 5 + 10, 0] = 10000
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+
+    with pytest.raises(rec2taps.errors.StimuliShorterThanRecording):
+        rec2taps.extract_peaks(sti_file, rec_file)
+
+    info = {}
+    peaks = rec2taps.extract_peaks(sti_file, rec_file, max_lag=200,
+                                   info=info)
+    assert info['lag_samples'] == SR // 10
+    assert len(peaks) == 1
+    assert abs(peaks[0] - 100) < 1
+
+    with pytest.raises(rec2taps.errors.LagWindowOutsideRecording):
+        rec2taps.extract_peaks(sti_file, rec_file, max_lag=1000)
@@ -0,0 +1,82 @@
+import tracemalloc
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from scipy.io import wavfile
+
+SR = 8000
+SECONDS = 60
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('memory')
+    rng = np.random.RandomState(0)
+    stim = rng.normal(0, 3000, (SR * 10, 2)).astype(np.int16)
+    rec = np.zeros((SR * SECONDS, 2), dtype=np.int16)
+    rec[321:321 + stim.shape[0], 0] = stim[:, 1]
+    rec[:, 1] = rng.normal(0, 200, rec.shape[0])
+    for t in range(SR // 2, rec.shape[0] - SR, SR // 3):
+        rec[t:t + 50, 1] += 10000
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+    return sti_file, rec_file, rec
+
+
+def traced_peak(f, *args, **kwargs):
+    'Returns the result of the call and the peak memory traced during it'
+    tracemalloc.start()
+    try:
+        result = f(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_numpy_peaks_memory(files):
+    '''
+    numpy_peaks makes a single float64 copy of the signal, plus the
+    temporary arrays of find_peaks.
+    '''
+    signal = files[2][:, 1]
+    peaks, peak = traced_peak(rec2taps.numpy_peaks, signal, SR)
+
+    assert len(peaks) > 0
+    assert peak < 21 * signal.shape[0]
+
+
+@pytest.mark.parametrize('invert', [False, True])
+def test_extract_peaks_memory(files, invert):
+    '''
+    The recording is memory-mapped and the memory needed is bounded by the
+    cross-correlation spectra.
+    '''
+    sti_file, rec_file, rec = files
+    peaks, peak = traced_peak(rec2taps.extract_peaks, sti_file, rec_file,
+                              invert_input_signal=invert)
+
+    assert invert or len(peaks) == 3 * (SECONDS - 1) - 1
+    assert peak < 66 * rec.shape[0]
+
+
+def test_mmap_results(files):
+    sti_file, rec_file, _ = files
+    assert (rec2taps.extract_peaks(sti_file, rec_file, mmap=True) ==
+            rec2taps.extract_peaks(sti_file, rec_file, mmap=False)).all()
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float64])
+def test_rectify_out(dtype):
+    data = np.array([1, 5, 2, 7, 3], dtype=dtype)
+    expected = np.array([0, 5, 0, 7, 0])
+
+    assert (rec2taps.rectify(data, 4) == expected).all()
+    out = np.empty(5)
+    assert rec2taps.rectify(data, 4, out) is out
+    assert (out == expected).all()
+    assert (data == [1, 5, 2, 7, 3]).all()
+    if dtype == np.float64:
+        assert rec2taps.rectify(data, 4, data) is data
+        assert (data == expected).all()
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps import multichannel
+
+SR = 8000
+LAG = 120
+TAPS = {0: [2000, 6000, 10000], 1: [3000, 7000], 3: [4000, 8000, 12000]}
+
+
+@pytest.fixture
+def files(tmp_path, write_pair):
+    '''
+    A stimulus and a 4 channel recording with the loopback in channel 2 and
+    taps in the others. Taps of channel 1 are inverted.
+    '''
+    return write_pair(tmp_path, lag_s=LAG, taps=TAPS, loopback_channel=2,
+                      stimulus_channel=1, channels=4, inverted=(1,))
+
+
+def expected_ms(channel):
+    # Peaks are found at the middle of each plateau
+    return (np.array(TAPS[channel]) + 9 - LAG) / SR * 1000
+
+
+def test_extract_channels(files, mocker):
+    sti, rec = files
+    synchronize = mocker.spy(m2.rec2taps, 'synchronize')
+    info = {}
+
+    peaks = multichannel.extract_channels(
+        sti, rec, {0: {}, 1: {'invert': True}, 3: {'distance': 50}},
+        info=info)
+
+    assert synchronize.call_count == 1
+    assert list(peaks) == [0, 1, 3]
+    for channel in TAPS:
+        np.testing.assert_allclose(peaks[channel], expected_ms(channel))
+    assert info['loopback_channel'] == 2
+    assert info['stimulus_channel'] == 1
+    assert info['input_channels'] == [0, 1, 3]
+    assert 'input_channel' not in info
+
+
+def test_extract_channels_default(files):
+    sti, rec = files
+
+    peaks = multichannel.extract_channels(sti, rec, workers=1)
+
+    assert list(peaks) == [0, 1, 3]
+    assert len(peaks[1]) == 0
+
+
+@pytest.mark.parametrize('channel', [0, 3])
+def test_extract_peaks_input_channel(files, channel):
+    sti, rec = files
+    info = {}
+
+    peaks = m2.rec2taps.extract_peaks(sti, rec, input_channel=channel,
+                                      info=info)
+
+    np.testing.assert_array_equal(
+        peaks, multichannel.extract_channels(sti, rec, [channel])[channel])
+    assert info['input_channel'] == channel
+
+
+def test_ambiguous_input_channel(files):
+    sti, rec = files
+
+    with pytest.raises(errors.AmbiguousInputChannel):
+        m2.rec2taps.extract_peaks(sti, rec)
+
+
+def test_invalid_input_channel(files):
+    sti, rec = files
+
+    with pytest.raises(errors.InvalidInputChannel):
+        multichannel.extract_channels(sti, rec, [4])
+    with pytest.raises(ValueError):
+        multichannel.extract_channels(sti, rec, {0: {'width': 3}})
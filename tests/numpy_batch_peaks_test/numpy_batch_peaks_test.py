@@ -0,0 +1,43 @@
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+
+SR = 8000
+
+
+def trials_signal(n_trials, n_samples, seed=0):
+    'Noisy trials with taps of random height, some of them equally high'
+    rng = np.random.RandomState(seed)
+    trials = rng.normal(0, 200, (n_trials, n_samples))
+    for trial in trials:
+        for t in rng.randint(50, n_samples - 50, size=4):
+            trial[t:t + 40] += rng.uniform(1000, 9000) * np.hanning(40)
+    trials[1] *= 5
+    trials[2] = 0
+    trials[3, -1] = 10 ** 5
+    trials[4, :10] = 10 ** 5
+    trials[5, 300:340:8] = 10 ** 4
+    return trials.astype(np.int16)
+
+
+@pytest.mark.parametrize('distance', [1, 5, 50, 100.5])
+@pytest.mark.parametrize('prominence', [0.5, 1.5, 4])
+def test_numpy_batch_peaks(distance, prominence):
+    trials = trials_signal(40, 1000)
+    peaks, offsets = rec2taps.numpy_batch_peaks(trials, SR, distance,
+                                                prominence)
+
+    assert offsets.shape == (trials.shape[0] + 1,)
+    assert offsets[-1] == peaks.shape[0] > 0
+    for i, trial in enumerate(trials):
+        expected = rec2taps.numpy_peaks(trial, SR, distance, prominence)
+        assert list(peaks[offsets[i]:offsets[i + 1]]) == list(expected)
+
+
+def test_numpy_batch_peaks_float():
+    trials = trials_signal(10, 2000, seed=1).astype(np.float32) / 3
+    peaks, offsets = rec2taps.numpy_batch_peaks(trials, SR)
+
+    for i, trial in enumerate(trials):
+        expected = rec2taps.numpy_peaks(trial, SR)
+        assert list(peaks[offsets[i]:offsets[i + 1]]) == list(expected)
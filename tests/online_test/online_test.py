@@ -0,0 +1,111 @@
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps.online import OnlineTapDetector
+
+SR = 8000
+TAPS = np.arange(SR // 4, SR * 9, SR // 2)
+LAG = 437
+
+
+@pytest.fixture(scope='module')
+def session():
+    'Stimulus and a recording with loopback (channel 0) and taps (channel 1)'
+    rng = np.random.RandomState(0)
+    stim = rng.normal(0, 3000, (SR * 10, 2))
+    rec = np.zeros((SR * 10, 2))
+    rec[LAG:, 0] = stim[:-LAG, 1]
+    rec[:, 1] = rng.normal(0, 200, rec.shape[0])
+    for t in TAPS:
+        rec[t:t + 80, 1] += 8000 * np.hanning(80)
+    return stim, rec
+
+
+def feed(detector, rec, block_size):
+    'Feeds the recording in blocks, returning the taps and report delays'
+    taps, delays = [], []
+    for start in range(0, rec.shape[0], block_size):
+        block_taps = detector.process(rec[start:start + block_size])
+        end = min(start + block_size, rec.shape[0])
+        taps.extend(block_taps)
+        delays.extend(end / SR * 1000 - t for t in block_taps)
+    taps.extend(detector.flush())
+    return np.array(taps), np.array(delays)
+
+
+@pytest.mark.parametrize('block_size', [64, 512, 4000])
+def test_online_matches_offline(session, block_size):
+    _, rec = session
+    detector = OnlineTapDetector(SR)
+
+    taps, delays = feed(detector, rec, block_size)
+
+    offline = rec2taps.numpy_peaks(rec[:, 1], SR) / SR * 1000
+    assert len(taps) == len(TAPS)
+    assert np.abs(taps - offline).max() < 1
+    # Taps before the end of the warmup are reported when it ends
+    after_warmup = taps[:len(delays)] > 1000
+    assert (delays[after_warmup] <=
+            detector.latency + block_size / SR * 1000).all()
+
+
+def test_online_loopback_lock(session):
+    stim, rec = session
+    detector = OnlineTapDetector(SR, stimulus=stim)
+
+    taps, _ = feed(detector, rec, 256)
+
+    assert detector.lag == LAG
+    assert detector.stimulus_channel == 1
+    offline = (rec2taps.numpy_peaks(rec[:, 1], SR) - LAG) / SR * 1000
+    assert len(taps) == len(TAPS)
+    assert np.abs(taps - offline).max() < 1
+
+
+def test_online_invert(session):
+    _, rec = session
+    inverted = rec * [1, -1]
+    detector = OnlineTapDetector(SR, invert_input_signal=True)
+
+    taps, _ = feed(detector, inverted, 256)
+
+    assert len(taps) == len(TAPS)
+
+
+def test_online_fixed_std(session):
+    _, rec = session
+    detector = OnlineTapDetector(SR, std=rec[:, 1].std())
+
+    taps, _ = feed(detector, rec, 256)
+
+    offline = rec2taps.numpy_peaks(rec[:, 1], SR) / SR * 1000
+    assert len(taps) == len(offline)
+    assert np.abs(taps - offline).max() < 1
+
+
+@pytest.mark.parametrize('block_size', [100, 3000, 9000])
+def test_online_small_buffer(session, block_size):
+    _, rec = session
+    detector = OnlineTapDetector(SR, buffer_length=500)
+
+    taps, _ = feed(detector, rec, block_size)
+
+    offline = rec2taps.numpy_peaks(rec[:, 1], SR) / SR * 1000
+    assert len(taps) == len(TAPS)
+    assert np.abs(taps - offline).max() < 1
+
+
+def test_online_loopback_not_locked(session):
+    stim, rec = session
+    detector = OnlineTapDetector(SR, stimulus=stim)
+    short = rec[:SR * 3 // 2]
+
+    for start in range(0, short.shape[0], 256):
+        assert len(detector.process(short[start:start + 256])) == 0
+    with pytest.raises(errors.LoopbackNotLocked) as e:
+        detector.flush()
+
+    offline = rec2taps.numpy_peaks(short[:, 1], SR) / SR * 1000
+    assert len(e.value.taps) == len(offline) == 3
+    assert np.abs(e.value.taps - offline).max() < 1
@@ -0,0 +1,107 @@
+import csv
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps import output
+from m2.rec2taps.cache import ResultCache
+
+SR = 8000
+LAG = 91
+
+
+@pytest.fixture
+def files(tmp_path, write_pair):
+    return write_pair(tmp_path, lag_s=LAG, loopback_channel=1)
+
+
+def sessions(files, n=2):
+    results = []
+    for i in range(n):
+        info = {}
+        peaks = rec2taps.extract_peaks(*files, 100, 1 + i, info=info)
+        results.append(output.session(*files, 100, 1 + i, False, info,
+                                      peaks))
+    return results
+
+
+def test_info(files):
+    info = {}
+    rec2taps.extract_peaks(*files, info=info)
+    assert info == {'sr': SR, 'stimulus_channel': 0, 'loopback_channel': 1,
+                    'input_channel': 0, 'lag_samples': LAG,
+                    'lag_ms': LAG / SR * 1000}
+
+
+def test_info_cached(files, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    expected = {}
+    rec2taps.extract_peaks(*files, cache=cache, info=expected)
+    info = {}
+    rec2taps.extract_peaks(*files, cache=cache, info=info)
+    assert info == expected
+
+
+def test_write_npy(files, tmp_path):
+    results = sessions(files)
+    filename = str(tmp_path / 'taps.npy')
+    output.write_results(results, filename)
+
+    table = np.load(filename)
+    assert list(table.dtype.names) == output.COLUMNS
+    assert len(table) == sum(len(r['peaks']) for r in results)
+    assert (table['tap_ms'] ==
+            np.concatenate([r['peaks'] for r in results])).all()
+    assert (table['recording'] == files[1]).all()
+    assert (table['lag_samples'] == LAG).all()
+    assert sorted(set(table['prominence'])) == [1, 2]
+
+
+def test_write_csv(files, tmp_path):
+    results = sessions(files)
+    filename = str(tmp_path / 'taps.csv')
+    output.write_results(results, filename)
+
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0].keys()) == output.COLUMNS
+    assert [float(r['tap_ms']) for r in rows] == \
+        list(np.concatenate([r['peaks'] for r in results]))
+    assert rows[0]['input_channel'] == '0'
+    assert rows[0]['invert'] == 'False'
+
+
+def test_session_without_taps(files, tmp_path):
+    results = sessions(files, n=1)
+    results.append(dict(results[0], prominence=100,
+                        peaks=np.empty(0)))
+    filename = str(tmp_path / 'taps.npy')
+    output.write_results(results, filename)
+
+    table = np.load(filename)
+    assert len(table) == len(results[0]['peaks']) + 1
+    assert table['prominence'][-1] == 100
+    assert table['recording'][-1] == files[1]
+    assert np.isnan(table['tap_ms'][-1])
+
+
+def test_write_arrow(files, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    results = sessions(files)
+    filename = str(tmp_path / 'taps.parquet')
+    output.write_results(results, filename)
+
+    table = pq.read_table(filename)
+    assert table.column_names == output.COLUMNS
+    assert table.num_rows == sum(len(r['peaks']) for r in results)
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(errors.UnsupportedOutputFormat):
+        output.write_results([], str(tmp_path / 'taps.xls'))
+
+
+def test_missing_pyarrow(tmp_path, mocker):
+    mocker.patch.dict('sys.modules', {'pyarrow': None})
+    with pytest.raises(errors.UnsupportedOutputFormat):
+        output.write_results([], str(tmp_path / 'taps.arrow'))
@@ -0,0 +1,51 @@
+import threading
+import pytest
+import numpy as np
+from m2.rec2taps import plotting
+
+
+@pytest.mark.parametrize('n', [1000, 4096, 100003])
+@pytest.mark.parametrize('invert', [False, True])
+def test_envelope(n, invert, mocker):
+    mocker.patch('m2.rec2taps.plotting.PLOT_BLOCK_SIZE', 1000)
+    signal = np.random.RandomState(0).randint(-1000, 1000, n).astype(
+        np.int16)
+
+    starts, minima, maxima = plotting.envelope(signal, 100, invert)
+
+    sign = -1 if invert else 1
+    buckets = np.split(signal.astype(np.float64) * sign, starts[1:])
+    assert len(starts) <= 100
+    assert list(minima) == [b.min() for b in buckets]
+    assert list(maxima) == [b.max() for b in buckets]
+
+
+def test_tap_windows():
+    signal = np.arange(100.0)
+    times, segments = plotting.tap_windows(signal, 1000, [2, 50], 5, True)
+
+    assert list(times) == list(range(-5, 6))
+    assert np.isnan(segments[0, :3]).all()
+    assert list(segments[0, 3:]) == [-x for x in range(0, 8)]
+    assert list(segments[1]) == [-x for x in range(45, 56)]
+
+
+def test_background_plotter():
+    calls = []
+    main_thread = threading.current_thread()
+
+    def draw(name):
+        calls.append((name, threading.current_thread() is main_thread))
+
+    def fail(name):
+        raise ValueError(name)
+
+    with plotting.BackgroundPlotter(max_pending=1) as plotter:
+        for i in range(3):
+            plotter.submit_call(draw, i)
+        plotter.submit_call(fail, 'bad')
+        plotter.submit_call(draw, 3)
+
+    assert calls == [(i, False) for i in range(4)]
+    with pytest.raises(RuntimeError):
+        plotter.submit_call(draw, 4)
@@ -0,0 +1,69 @@
+import io
+import json
+import pytest
+import m2.rec2taps as rec2taps
+from m2.rec2taps.cli import rec2taps as rec2taps_cli
+from m2.rec2taps.profiling import StageProfiler, NULL_PROFILER
+from m2.rec2taps.stimulus import Stimulus
+
+SR = 8000
+
+
+@pytest.fixture
+def files(tmp_path, write_pair):
+    return write_pair(tmp_path, lag_s=100, taps=(SR,), length=SR * 3)
+
+
+def test_stage_profiler():
+    profiler = StageProfiler()
+    with profiler.stage('a') as stage:
+        stage['x'] = 1
+    with profiler.stage('b'):
+        pass
+
+    report = profiler.report()
+    assert [s['stage'] for s in report['stages']] == ['a', 'b']
+    assert report['stages'][0]['x'] == 1
+    assert report['total_seconds'] == sum(s['seconds']
+                                          for s in report['stages'])
+
+
+def test_null_profiler():
+    with NULL_PROFILER.stage('a') as stage:
+        stage['x'] = 1
+    assert NULL_PROFILER.report() is None
+    with NULL_PROFILER.stage('b') as stage:
+        assert stage == {}
+
+
+def test_extract_peaks_profile(files):
+    profiler = StageProfiler()
+    peaks = rec2taps.extract_peaks(*files, profiler=profiler)
+
+    stages = {s['stage']: s for s in profiler.report()['stages']}
+    assert list(stages) == ['read_stimulus', 'read_recording',
+                            'crosscorrelation', 'peaks']
+    assert stages['read_recording']['shape'] == [SR * 3, 2]
+    assert stages['read_recording']['file_bytes'] > SR * 3 * 4
+    assert stages['peaks']['peaks'] == len(peaks) == 1
+
+
+def test_extract_peaks_profile_cached_stimulus(files):
+    sti_file, rec_file = files
+    profiler = StageProfiler()
+    rec2taps.extract_peaks(Stimulus.from_file(sti_file), rec_file,
+                           profiler=profiler)
+
+    assert profiler.report()['stages'][0]['cached']
+
+
+def test_cli_profile(mocker, files):
+    mocker.patch('sys.argv', ['exec', *files, '--profile'])
+    stdout_mock = mocker.patch('sys.stdout', new_callable=io.StringIO)
+    stderr_mock = mocker.patch('sys.stderr', new_callable=io.StringIO)
+
+    rec2taps_cli()
+
+    assert len(stdout_mock.getvalue().split()) == 1
+    report = json.loads(stderr_mock.getvalue())
+    assert len(report['stages']) == 4
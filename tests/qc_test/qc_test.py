@@ -0,0 +1,124 @@
+import json
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import batch
+from m2.rec2taps import qc
+from m2.rec2taps.cache import ResultCache
+from scipy.io import wavfile
+
+SR = 8000
+
+
+@pytest.fixture
+def pair(tmp_path, write_pair):
+    'Synthetic pair whose first tap clips for 4 samples.'
+    sti, rec = write_pair(tmp_path)
+    sr, data = wavfile.read(rec)
+    data[2000:2004, 1] = 32767
+    wavfile.write(rec, sr, data)
+    return sti, rec
+
+
+def test_normalized_correlation():
+    rng = np.random.RandomState(0)
+    stim = rng.normal(size=(1000, 2))
+    rec = np.concatenate([rng.normal(size=(30, 2)), stim * [0.5, 0]])
+    rec[:, 1] = rng.normal(size=rec.shape[0])
+
+    assert qc.normalized_correlation(stim, 0, rec, 0, 30) == \
+        pytest.approx(1)
+    assert abs(qc.normalized_correlation(stim, 0, rec, 1, 30)) < 0.1
+    assert abs(qc.normalized_correlation(stim, 1, rec, 0, 30)) < 0.1
+    assert qc.normalized_correlation(stim, 0, rec, 0, 30,
+                                     block_size=64) == pytest.approx(1)
+    assert qc.normalized_correlation(stim, 0, rec[:20], 0, 30) is None
+
+
+def test_channel_margin():
+    maxima = np.array([[10., 2.], [4., 1.]])
+
+    assert qc.channel_margin(maxima, 0) == pytest.approx(0.8)
+    assert qc.channel_margin(maxima[:, :1], 0) is None
+    assert qc.channel_margin(None, 0) is None
+
+
+def test_clipping_ratio():
+    data = np.array([0, 32767, -32768, 100], dtype=np.int16)
+
+    assert qc.clipping_ratio(data) == 0.5
+    assert qc.clipping_ratio(data, block_size=3) == 0.5
+    assert qc.clipping_ratio(np.array([0.5, -1.0, 0.1, 0.2])) == 0.25
+
+
+def test_noise_floor():
+    rng = np.random.RandomState(0)
+    data = rng.normal(0, 100, SR * 10)
+    data[::SR // 2] += 10000
+
+    level, dbfs = qc.noise_floor(data.astype(np.int16), SR)
+
+    assert level == pytest.approx(100, rel=0.1)
+    assert dbfs == pytest.approx(20 * np.log10(100 / 32767), abs=1)
+    assert qc.noise_floor(np.zeros(SR, dtype=np.int16), SR) == (0, None)
+
+
+def test_iti_stats():
+    peaks = [0, 500, 1000, 2000, 2500, 2510]
+
+    stats = qc.iti_stats(peaks)
+
+    assert stats['taps'] == 6
+    assert stats['iti_median'] == 500
+    assert stats['iti_min'] == 10
+    assert stats['iti_max'] == 1000
+    assert stats['iti_outliers'] == 2
+    assert qc.iti_stats([100])['iti_mean'] is None
+
+
+def test_qc_flags():
+    report = {'correlation': 0.2, 'channel_margin': None,
+              'input_clipping': 0.0, 'loopback_clipping': 0.01,
+              'iti_outliers': 0}
+
+    assert qc.qc_flags(report) == ['correlation', 'loopback_clipping']
+
+
+def test_extract_peaks_qc(pair):
+    sti, rec = pair
+    report = {}
+
+    peaks = m2.rec2taps.extract_peaks(sti, rec, qc=report)
+
+    np.testing.assert_array_equal(peaks,
+                                  m2.rec2taps.extract_peaks(sti, rec))
+    assert report['correlation'] == pytest.approx(1)
+    assert report['channel_margin'] > 0.5
+    assert report['input_clipping'] == pytest.approx(4 / SR / 2, rel=0.1)
+    assert report['loopback_clipping'] == 0
+    assert report['noise_floor'] == 0
+    assert report['taps'] == 3
+    assert report['iti_median'] == pytest.approx(500, abs=1)
+    assert qc.qc_flags(report) == []
+    json.dumps(report)
+
+
+def test_extract_peaks_qc_cached_lag(tmp_path, pair):
+    sti, rec = pair
+    cache = ResultCache(str(tmp_path / 'cache'))
+    m2.rec2taps.extract_peaks(sti, rec, cache=cache)
+    report = {}
+
+    m2.rec2taps.extract_peaks(sti, rec, cache=cache, qc=report)
+
+    assert report['correlation'] is None
+    assert report['taps'] == 3
+
+
+def test_extract_item_qc(pair):
+    sti, rec = pair
+
+    result = batch.extract_item({'stimulus': sti, 'recording': rec}, qc=True)
+
+    assert result['qc']['taps'] == 3
+    assert result['qc_flags'] == []
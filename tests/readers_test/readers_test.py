@@ -0,0 +1,62 @@
+import io
+import sys
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps import readers
+from scipy.io import wavfile
+
+SR = 8000
+
+
+@pytest.mark.parametrize('filename,reader', [
+    ('rec.wav', readers.read_wav),
+    ('rec', readers.read_wav),
+    ('rec.FLAC', readers.read_soundfile),
+    ('rec.ogg', readers.read_soundfile),
+    (None, readers.read_wav),
+    (io.BytesIO(), readers.read_wav),
+])
+def test_audio_reader(filename, reader):
+    assert readers.audio_reader(filename) is reader
+
+
+def test_register_reader(tmp_path, monkeypatch, write_pair):
+    monkeypatch.setattr(readers, 'READERS', dict(readers.READERS))
+    sti, rec = write_pair(tmp_path)
+    for name in [sti, rec]:
+        sr, signal = wavfile.read(name)
+        np.save(name[:-4] + '.npy', signal)
+
+    def read_npy(filename, mmap=False):
+        return SR, np.load(filename, mmap_mode='r' if mmap else None)
+
+    readers.register_reader(['.NPY'], read_npy)
+
+    np.testing.assert_array_equal(
+        m2.rec2taps.extract_peaks(sti[:-4] + '.npy', rec[:-4] + '.npy'),
+        m2.rec2taps.extract_peaks(sti, rec))
+
+
+def test_soundfile_missing(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'soundfile', None)
+
+    with pytest.raises(errors.UnsupportedAudioFormat):
+        m2.rec2taps.extract_peaks(str(tmp_path / 'stim.flac'),
+                                  str(tmp_path / 'rec.flac'))
+
+
+def test_flac(tmp_path, write_pair):
+    soundfile = pytest.importorskip('soundfile')
+    sti, rec = write_pair(tmp_path)
+    for name in [sti, rec]:
+        sr, signal = wavfile.read(name)
+        soundfile.write(name[:-4] + '.flac', signal, sr)
+
+    sr, signal = readers.read_soundfile(rec[:-4] + '.flac', block_size=1000)
+
+    np.testing.assert_array_equal(signal, wavfile.read(rec)[1])
+    np.testing.assert_array_equal(
+        m2.rec2taps.extract_peaks(sti[:-4] + '.flac', rec[:-4] + '.flac'),
+        m2.rec2taps.extract_peaks(sti, rec))
@@ -1,3 +1,4 @@
+import json
 import sys
 import io
 import pytest
@@ -110,3 +111,118 @@ def test_peaks_output(mocker):
 
     assert stderr_mock.getvalue() == ''
     assert stdout_mock.getvalue() == '1\n2\n3\n'
+
+
+def test_lag_method(mocker):
+    mocker.patch('m2.rec2taps.extract_peaks')
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '--lag_method', 'coarse'])
+    mocker.patch('os.path.isfile', lambda x: True)
+
+    rec2taps()
+
+    m2.rec2taps.extract_peaks.assert_called_once_with(
+        'sti', 'rec', defaults.DEFAULT_DISTANCE, defaults.DEFAULT_PROMINENCE,
+        None, False, crosscorrelation_method='coarse')
+
+
+def test_lazy_imports():
+    'Plotting and scipy.signal are not imported until used'
+    import subprocess
+    code = ('import sys, m2.rec2taps.cli; '
+            'print(any(m.split(".")[0] == "matplotlib" or '
+            'm.startswith("scipy.signal") for m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                         text=True, check=True)
+    assert out.stdout.strip() == 'False'
+    assert out.stderr == ''
+
+
+def test_sweep(mocker):
+    from m2.rec2taps.cli import rec2taps_sweep
+    mocker.patch('m2.rec2taps.sweep.sweep_extract', return_value=[
+        {'distance': 50, 'prominence': 1.0, 'peaks': np.array([1.5, 2.5])},
+        {'distance': 50, 'prominence': 3.0, 'peaks': np.array([])}])
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '-d', '50', '-p', '1',
+                              '3'])
+    mocker.patch('os.path.isfile', lambda x: True)
+    stdout_mock = mocker.patch('sys.stdout', new_callable=io.StringIO)
+
+    rec2taps_sweep()
+
+    m2.rec2taps.sweep.sweep_extract.assert_called_once_with(
+        'sti', 'rec', [50], [1.0, 3.0], False, None)
+    assert stdout_mock.getvalue().splitlines() == [
+        'distance,prominence,taps,times', '50,1.0,2,1.5 2.5', '50,3.0,0,']
+
+
+def test_output(mocker, tmp_path):
+    def extract_peaks(*args, info):
+        info.update({'sr': 100, 'stimulus_channel': 1,
+                     'loopback_channel': 0, 'input_channel': 1,
+                     'lag_samples': 5, 'lag_ms': 50.0})
+        return np.array([1.5, 2.5])
+
+    filename = str(tmp_path / 'taps.npy')
+    mocker.patch('m2.rec2taps.extract_peaks', extract_peaks)
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '--output', filename])
+    mocker.patch('os.path.isfile', lambda x: True)
+    stdout_mock = mocker.patch('sys.stdout', new_callable=io.StringIO)
+
+    rec2taps()
+
+    table = np.load(filename)
+    assert stdout_mock.getvalue() == ''
+    assert list(table['tap_ms']) == [1.5, 2.5]
+    assert list(table['stimulus']) == ['sti', 'sti']
+    assert list(table['lag_samples']) == [5, 5]
+
+
+def test_channels(mocker):
+    extract_channels = mocker.patch(
+        'm2.rec2taps.multichannel.extract_channels',
+        return_value={0: np.array([1.5]), 3: np.array([2.5, 4.0])})
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '-c', '0', '3',
+                              '--refine', 'sinc'])
+    mocker.patch('os.path.isfile', lambda x: True)
+    stdout_mock = mocker.patch('sys.stdout', new_callable=io.StringIO)
+
+    rec2taps()
+
+    extract_channels.assert_called_once_with(
+        'sti', 'rec', [0, 3], defaults.DEFAULT_DISTANCE,
+        defaults.DEFAULT_PROMINENCE, False, info={}, refine='sinc')
+    assert stdout_mock.getvalue().splitlines() == [
+        'input_channel,tap_ms', '0,1.5', '3,2.5', '3,4.0']
+
+
+def test_qc(mocker, tmp_path):
+    def extract_peaks(*args, qc, **kwargs):
+        qc.update({'correlation': 0.1, 'taps': 2})
+        return [1, 2]
+
+    qc_file = str(tmp_path / 'qc.json')
+    mocker.patch('m2.rec2taps.extract_peaks', extract_peaks)
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '--qc', qc_file])
+    mocker.patch('os.path.isfile', lambda x: True)
+    stdout_mock = mocker.patch('sys.stdout', new_callable=io.StringIO)
+
+    rec2taps()
+
+    with open(qc_file) as f:
+        assert json.load(f) == {'correlation': 0.1, 'taps': 2,
+                                'flags': ['correlation']}
+    assert stdout_mock.getvalue() == '1\n2\n'
+
+
+def test_adaptive_default_prominence(mocker):
+    mocker.patch('m2.rec2taps.extract_peaks')
+    mocker.patch('sys.argv', ['exec', 'sti', 'rec', '--threshold',
+                              'adaptive'])
+    mocker.patch('os.path.isfile', lambda x: True)
+
+    rec2taps()
+
+    m2.rec2taps.extract_peaks.assert_called_once_with(
+        'sti', 'rec', defaults.DEFAULT_DISTANCE,
+        defaults.DEFAULT_ADAPTIVE_PROMINENCE, None, False,
+        threshold='adaptive')
@@ -0,0 +1,167 @@
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import refine
+from scipy import fft
+from scipy.signal import resample_poly
+from scipy.io import wavfile
+
+SR = 8000
+
+
+def delayed(signal, delay):
+    'Delays a signal by a fractional number of samples (circularly)'
+    freqs = fft.rfftfreq(signal.shape[0])
+    return fft.irfft(fft.rfft(signal) * np.exp(-2j * np.pi * freqs * delay),
+                     signal.shape[0])
+
+
+def pulses(positions, length, width=2):
+    t = np.arange(length)
+    return sum(np.exp(-0.5 * ((t - p) / width) ** 2) for p in positions)
+
+
+def test_parabolic_offsets():
+    x = np.array([-0.3, 0.1, 0.45])
+    left, center, right = [-(k - x) ** 2 for k in [-1, 0, 1]]
+    assert np.allclose(refine.parabolic_offsets(left, center, right), x)
+
+
+@pytest.mark.parametrize('method', refine.REFINE_METHODS)
+@pytest.mark.parametrize('invert', [False, True])
+def test_refine_maxima(method, invert):
+    rng = np.random.RandomState(0)
+    positions = np.arange(100, 2000, 150) + rng.uniform(0, 1, 13)
+    signal = pulses(positions, 2100) * (1 - 2 * invert)
+    peaks = np.round(positions).astype(int)
+
+    refined = refine.refine_maxima(signal, peaks, method, invert)
+
+    assert np.abs(refined - positions).max() < 0.05
+    assert np.abs(peaks - positions).max() > 0.3
+
+
+def test_refine_maxima_edges():
+    signal = np.array([3.0, 1, 0, 1, 2, 1])
+    refined = refine.refine_maxima(signal, [0, 4, 5], 'sinc')
+    assert refined.shape == (3,)
+    assert np.isclose(refine.refine_maxima(signal, [4])[0], 4)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        refine.refine_maxima(np.zeros(10), [5], 'cubic')
+
+
+@pytest.mark.parametrize('method', refine.REFINE_METHODS)
+def test_refine_lag(method):
+    rng = np.random.RandomState(1)
+    stimulus = resample_poly(rng.normal(size=SR // 2), 4, 1)[:, None]
+    lag = 321.3
+    recording = delayed(np.concatenate([stimulus[:, 0], np.zeros(1000)]),
+                        lag)[:, None]
+
+    refined = refine.refine_lag(stimulus, 0, recording, 0, 321, method)
+    assert abs(refined - lag) < 0.02
+
+
+@pytest.mark.parametrize('method', refine.REFINE_METHODS)
+def test_refine_lag_near_zero(method):
+    rng = np.random.RandomState(1)
+    stimulus = resample_poly(rng.normal(size=SR // 2), 4, 1)[:, None]
+    recording = np.concatenate([stimulus[:, 0], np.zeros(1000)])
+
+    assert refine.refine_lag(stimulus, 0, recording[:, None], 0, 0,
+                             method) == 0
+    refined = refine.refine_lag(stimulus, 0,
+                                delayed(recording, 2.3)[:, None], 0, 2,
+                                method)
+    assert abs(refined - 2.3) < 0.05
+
+
+@pytest.mark.parametrize('method', refine.REFINE_METHODS)
+def test_refine_lag_length(method):
+    rng = np.random.RandomState(1)
+    stimulus = resample_poly(rng.normal(size=SR // 2), 4, 1)[:, None]
+    lag = 321.3
+    recording = delayed(np.concatenate([stimulus[:, 0], np.zeros(1000)]),
+                        lag)[:, None]
+
+    refined = refine.refine_lag(stimulus, 0, recording, 0, 321, method,
+                                length=2000)
+    assert abs(refined - lag) < 0.02
+
+
+@pytest.mark.parametrize('method', refine.REFINE_METHODS)
+def test_refine_lag_offset(method):
+    rng = np.random.RandomState(1)
+    stimulus = np.concatenate([np.zeros(5000),
+                               resample_poly(rng.normal(size=SR // 2), 4,
+                                             1)])[:, None]
+    lag = 321.3
+    recording = delayed(np.concatenate([stimulus[:, 0], np.zeros(1000)]),
+                        lag)[:, None]
+
+    refined = refine.refine_lag(stimulus, 0, recording, 0, 321, method,
+                                length=2000, offset=5000)
+    assert abs(refined - lag) < 0.02
+
+
+def test_refine_bounded_without_window(tmp_path, mocker):
+    rng = np.random.RandomState(2)
+    stim = np.zeros((rec2taps.REFINE_LAG_LENGTH + SR * 4, 2), dtype=np.int16)
+    stim[-SR * 4:] = rng.normal(0, 3000, (SR * 4, 2))
+    rec = np.zeros((stim.shape[0] + SR, 2), dtype=np.int16)
+    rec[40:40 + stim.shape[0], 0] = stim[:, 1]
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+    refine_lag = mocker.spy(rec2taps, 'refine_lag')
+
+    sr, _, si, ri, lag = rec2taps.synchronize(sti_file, rec_file,
+                                              refine='sinc')
+
+    assert np.isclose(lag, 40, atol=0.01)
+    kwargs = refine_lag.call_args.kwargs
+    assert kwargs['length'] == rec2taps.REFINE_LAG_LENGTH
+    # As late as the template fits in the stimulus
+    assert kwargs['offset'] == stim.shape[0] - rec2taps.REFINE_LAG_LENGTH
+
+
+def test_windowed_refine_uses_template(tmp_path, mocker):
+    rng = np.random.RandomState(2)
+    stim = (rng.normal(0, 3000, (SR * 4, 2))).astype(np.int16)
+    rec = np.zeros((SR * 5, 2), dtype=np.int16)
+    rec[40:40 + stim.shape[0], 0] = stim[:, 1]
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+    refine_lag = mocker.spy(rec2taps, 'refine_lag')
+
+    sr, _, si, ri, lag = rec2taps.synchronize(sti_file, rec_file,
+                                              refine='sinc', max_lag=100)
+
+    assert np.isclose(lag, 40, atol=0.01)
+    assert refine_lag.call_args.kwargs['length'] == \
+        rec2taps.DEFAULT_LAG_TEMPLATE * SR // 1000
+
+
+def test_extract_peaks_refine(tmp_path):
+    rng = np.random.RandomState(2)
+    stim = (rng.normal(0, 3000, (SR * 2, 2))).astype(np.int16)
+    rec = np.zeros((SR * 3, 2))
+    rec[40:40 + stim.shape[0], 0] = stim[:, 1]
+    positions = np.arange(SR // 2, SR * 3 - SR // 2, SR // 3) + 0.4
+    rec[:, 1] = rng.normal(0, 10, rec.shape[0]) + 10000 * pulses(
+        positions, rec.shape[0])
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec.astype(np.int16))
+
+    info = {}
+    peaks = rec2taps.extract_peaks(sti_file, rec_file, refine='sinc',
+                                   info=info)
+    expected = (positions - 40) / SR * 1000
+
+    assert np.isclose(info['lag_samples'], 40, atol=0.01)
+    assert np.abs(peaks - expected).max() < 0.05 / SR * 1000
@@ -0,0 +1,144 @@
+import os
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import errors
+from m2.rec2taps.stimulus import Stimulus, load_stimulus, clear_stimulus_cache
+from scipy.io import wavfile
+
+SR = 8000
+
+
+@pytest.fixture
+def signals():
+    rng = np.random.RandomState(0)
+    stim = (rng.uniform(-1, 1, (SR, 2)) * 10000).astype(np.int16)
+    rec = np.zeros((stim.shape[0] + 700, 2), dtype=np.int16)
+    rec[333:333 + stim.shape[0], 1] = stim[:, 0]
+    rec[:, 0] = (rng.uniform(-1, 1, rec.shape[0]) * 100).astype(np.int16)
+    return stim, rec
+
+
+@pytest.fixture
+def stim_file(tmp_path, signals):
+    path = str(tmp_path / 'stim.wav')
+    wavfile.write(path, SR, signals[0])
+    clear_stimulus_cache()
+    yield path
+    clear_stimulus_cache()
+
+
+@pytest.mark.parametrize('ri', [0, 1])
+@pytest.mark.parametrize('si', [0, 1])
+def test_stimulus_crosscorrelation(signals, si, ri):
+    stim, rec = signals
+    expected = rec2taps.best_crosscorrelation(rec, ri, stim, si)
+    r = rec2taps.best_crosscorrelation(rec, ri, Stimulus(SR, stim), si)
+
+    assert r['argmax'] == expected['argmax']
+    assert np.isclose(r['max'], expected['max'])
+
+
+def test_stimulus_best_channel(signals):
+    stim, rec = signals
+    assert (rec2taps.best_channel_crosscorrelation(Stimulus(SR, stim), rec) ==
+            rec2taps.best_channel_crosscorrelation(stim, rec))
+
+
+def test_stimulus_too_short(signals):
+    stim, rec = signals
+    with pytest.raises(errors.SignalTooShortForConvolution):
+        rec2taps.best_crosscorrelation(stim[:10], 0, Stimulus(SR, stim), 0)
+
+
+def test_spectrum_cache(signals):
+    # Spectra of 2 * SR take 256032 bytes (128016 in float32), spectra of
+    # 4 * SR 512032 bytes
+    stimulus = Stimulus(SR, signals[0], max_spectra_bytes=600000)
+
+    s = stimulus.reversed_spectra(2 * SR)
+    assert stimulus.reversed_spectra(2 * SR) is s
+    assert stimulus.reversed_spectra(2 * SR, np.float32) is not s
+    assert stimulus._spectra_bytes == 384048
+    stimulus.reversed_spectra(4 * SR)
+    assert stimulus._spectra_bytes == 512032
+    assert stimulus.reversed_spectra(2 * SR) is not s
+
+
+def test_spectrum_cache_too_large(signals):
+    stimulus = Stimulus(SR, signals[0], max_spectra_bytes=1000)
+
+    s = stimulus.reversed_spectra(2 * SR)
+    assert stimulus.reversed_spectra(2 * SR) is not s
+    assert stimulus._spectra_bytes == 0
+
+
+def test_load_stimulus_cache(stim_file, signals):
+    stimulus = load_stimulus(stim_file)
+
+    assert load_stimulus(stim_file) is stimulus
+    assert stimulus.sr == SR
+    assert (stimulus.signal == signals[0]).all()
+
+    wavfile.write(stim_file, SR, signals[0][:SR // 2])
+    st = os.stat(stim_file)
+    os.utime(stim_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert len(load_stimulus(stim_file)) == SR // 2
+
+
+def test_load_stimulus_eviction(tmp_path, stim_file):
+    first = load_stimulus(stim_file, maxsize=1)
+    other_file = str(tmp_path / 'other.wav')
+    wavfile.write(other_file, SR, np.zeros((10, 2), dtype=np.int16))
+    load_stimulus(other_file, maxsize=1)
+
+    assert load_stimulus(stim_file, maxsize=1) is not first
+
+
+def test_extract_peaks_with_stimulus(tmp_path, stim_file, signals):
+    rec = signals[1].copy()
+    rec[2000:2010, 0] = 20000
+    rec_file = str(tmp_path / 'rec.wav')
+    wavfile.write(rec_file, SR, rec)
+
+    expected = rec2taps.extract_peaks(stim_file, rec_file)
+    peaks = rec2taps.extract_peaks(load_stimulus(stim_file), rec_file)
+
+    assert len(peaks) == 1
+    assert (peaks == expected).all()
+
+
+def test_resampled():
+    rng = np.random.RandomState(0)
+    stimulus = Stimulus(8000, rng.normal(size=(8000, 2)))
+
+    resampled = stimulus.resampled(12000)
+
+    assert resampled.sr == 12000
+    assert resampled.signal.shape == (12000, 2)
+    assert stimulus.resampled(12000) is resampled
+    assert stimulus.resampled(8000) is stimulus
+
+
+def test_extract_peaks_resampled(tmp_path):
+    from scipy.signal import resample_poly
+
+    rng = np.random.RandomState(1)
+    stim = resample_poly(rng.normal(0, 3000, (4000, 2)), 2, 1, axis=0)
+    lag = 300
+    rec = np.zeros((12000 * 2, 2))
+    rec[lag:lag + 12000, 1] = resample_poly(stim[:, 0], 3, 2)
+    taps = np.arange(3000, 22000, 4000)
+    rec[:, 0] = rng.normal(0, 100, rec.shape[0])
+    for t in taps:
+        rec[t - 5:t + 6, 0] += 10000 * np.hanning(11)
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, 8000, stim.astype(np.int16))
+    wavfile.write(rec_file, 12000, rec.astype(np.int16))
+
+    with pytest.raises(errors.UnequalSampleRate):
+        rec2taps.extract_peaks(sti_file, rec_file)
+
+    peaks = rec2taps.extract_peaks(sti_file, rec_file,
+                                   resample_stimulus=True)
+    assert np.allclose(peaks, (taps - lag) / 12000 * 1000)
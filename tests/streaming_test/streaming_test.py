@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import streaming
+from scipy.io import wavfile
+
+SR = 8000
+
+
+def tapping_signal(seconds, seed=0, dtype=np.int16):
+    'Noise with taps of random height and shape every 150 to 400 ms'
+    rng = np.random.RandomState(seed)
+    signal = rng.normal(0, 200, SR * seconds)
+    t = 0
+    while True:
+        t += rng.randint(SR * 150 // 1000, SR * 400 // 1000)
+        width = rng.randint(10, 200)
+        if t + width >= signal.shape[0]:
+            break
+        signal[t:t + width] += (rng.uniform(1000, 10000) *
+                                np.hanning(width) *
+                                (1 + 0.3 * rng.normal(size=width)))
+    return signal.astype(dtype)
+
+
+@pytest.mark.parametrize('block_size', [100, 1000, 4096, 10 ** 6])
+@pytest.mark.parametrize('distance', [1, 100, 300])
+@pytest.mark.parametrize('invert', [False, True])
+def test_stream_numpy_peaks(block_size, distance, invert):
+    signal = tapping_signal(10) * np.int16(1 - 2 * invert)
+
+    expected = rec2taps.numpy_peaks(signal * (1 - 2 * invert), SR, distance)
+    peaks = streaming.stream_numpy_peaks(signal, SR, distance, invert=invert,
+                                         block_size=block_size)
+
+    assert len(expected) > 0
+    assert (peaks == expected).all()
+
+
+@pytest.mark.parametrize('block_size', [1000, 10 ** 6])
+def test_stream_numpy_peaks_full_scale_invert(block_size):
+    rng = np.random.RandomState(1)
+    signal = rng.normal(0, 200, SR * 3).astype(np.int16)
+    for t in [4000, 12000, 20000]:
+        signal[t:t + 20] = -32768
+
+    expected = rec2taps.numpy_peaks(np.negative(signal, dtype=np.float64),
+                                    SR)
+    peaks = streaming.stream_numpy_peaks(signal, SR, invert=True,
+                                         block_size=block_size)
+
+    assert len(expected) == 3
+    assert (peaks == expected).all()
+
+
+def test_running_std():
+    signal = tapping_signal(3).astype(np.float64)
+    blocks = [signal[i:i + 777] for i in range(0, signal.shape[0], 777)]
+    assert np.isclose(streaming.running_std(blocks), signal.std())
+
+
+def test_extract_peaks_streaming(tmp_path):
+    rng = np.random.RandomState(2)
+    stim = rng.normal(0, 3000, (SR * 4, 2)).astype(np.int16)
+    rec = np.array([np.zeros(SR * 5), tapping_signal(5, seed=3)]).T
+    rec[123:123 + stim.shape[0], 0] = stim[:, 0]
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec.astype(np.int16))
+
+    expected = rec2taps.extract_peaks(sti_file, rec_file)
+    peaks = rec2taps.extract_peaks(sti_file, rec_file, block_size=1000)
+
+    assert len(expected) > 0
+    assert (peaks == expected).all()
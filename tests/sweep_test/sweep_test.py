@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+import m2.rec2taps as rec2taps
+from m2.rec2taps import sweep
+from scipy.io import wavfile
+
+SR = 8000
+DISTANCES = [1, 50, 200]
+PROMINENCES = [0.5, 1.5, 4]
+
+
+def tapping_signal(seconds, seed=0):
+    'Noise with taps of random height every 100 to 400 ms'
+    rng = np.random.RandomState(seed)
+    signal = rng.normal(0, 200, SR * seconds)
+    t = 0
+    while True:
+        t += rng.randint(SR // 10, SR * 4 // 10)
+        width = rng.randint(10, 200)
+        if t + width >= signal.shape[0]:
+            break
+        signal[t:t + width] += rng.uniform(1000, 10000) * np.hanning(width)
+    return signal.astype(np.int16)
+
+
+@pytest.fixture
+def files(tmp_path):
+    rng = np.random.RandomState(1)
+    stim = rng.normal(0, 3000, (SR * 2, 2)).astype(np.int16)
+    rec = np.array([np.zeros(SR * 3), tapping_signal(3)]).T.astype(np.int16)
+    rec[55:55 + stim.shape[0], 0] = stim[:, 0]
+    sti_file, rec_file = str(tmp_path / 'stim.wav'), str(tmp_path / 'rec.wav')
+    wavfile.write(sti_file, SR, stim)
+    wavfile.write(rec_file, SR, rec)
+    return sti_file, rec_file
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_sweep_peaks(workers):
+    signal = tapping_signal(5)
+    peaks = sweep.sweep_peaks(signal, SR, DISTANCES, PROMINENCES, workers)
+
+    assert len(peaks) == len(DISTANCES) * len(PROMINENCES)
+    for d in DISTANCES:
+        for p in PROMINENCES:
+            expected = rec2taps.numpy_peaks(signal, SR, d, p)
+            assert (peaks[d, p] == expected).all()
+
+
+@pytest.mark.parametrize('invert', [False, True])
+def test_sweep_extract(files, invert):
+    results = sweep.sweep_extract(*files, DISTANCES, PROMINENCES, invert)
+
+    assert [(r['distance'], r['prominence']) for r in results] == \
+        [(d, p) for d in DISTANCES for p in PROMINENCES]
+    for r in results:
+        expected = rec2taps.extract_peaks(*files, r['distance'],
+                                          r['prominence'],
+                                          invert_input_signal=invert)
+        assert (r['peaks'] == expected).all()
+
+
+def test_sweep_extract_synchronizes_once(files, mocker):
+    bcc = mocker.spy(rec2taps, 'best_channel_crosscorrelation')
+    sweep.sweep_extract(*files, DISTANCES, PROMINENCES)
+    bcc.assert_called_once()
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import threshold
+from m2.rec2taps.sweep import sweep_peaks
+
+SR = 4000
+
+
+def drifting_taps(seconds=30, seed=0):
+    '''
+    Returns a signal with taps over a drifting baseline and noise bursts,
+    and the tap positions.
+    '''
+    rng = np.random.RandomState(seed)
+    n = seconds * SR
+    signal = rng.normal(0, 0.01, n)
+    signal += 0.6 * np.sin(2 * np.pi * np.arange(n) / (20 * SR))
+    signal[10 * SR:12 * SR] += rng.normal(0, 0.15, 2 * SR)
+    width = int(0.06 * SR)
+    pulse = np.sin(np.pi * np.arange(width) / width)
+    taps = np.arange(SR // 2, n - SR, SR // 2)
+    taps = taps[(taps < 10 * SR - width) | (taps > 12 * SR)]
+    for tap in taps:
+        signal[tap:tap + width] += rng.uniform(0.3, 1) * pulse
+    return signal, taps + width // 2
+
+
+def test_block_envelope():
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=1050)
+
+    medians, deviations = threshold.block_envelope(data, 100)
+
+    assert medians.shape == (11,)
+    for i, start in enumerate(range(0, 1050, 100)):
+        block = data[start:start + 100]
+        assert medians[i] == pytest.approx(np.median(block))
+        assert deviations[i] == pytest.approx(
+            np.median(np.abs(block - np.median(block))))
+
+
+def test_block_envelope_int():
+    data = np.arange(400, dtype=np.int16)
+
+    medians, _ = threshold.block_envelope(data, 200, samples=20)
+
+    np.testing.assert_allclose(medians, [95, 295])
+
+
+def test_rolling_envelope():
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=1060)
+
+    centers, medians, deviations = threshold.rolling_envelope(data, 100, 25)
+
+    starts = list(range(0, 961, 25)) + [960]
+    np.testing.assert_allclose(centers, np.array(starts) + 49.5)
+    for i, start in enumerate(starts):
+        window = data[start:start + 100]
+        assert medians[i] == pytest.approx(np.median(window))
+        assert deviations[i] == pytest.approx(
+            np.median(np.abs(window - np.median(window))))
+
+
+def test_rolling_envelope_short():
+    data = np.arange(400, dtype=np.int16)
+
+    centers, medians, _ = threshold.rolling_envelope(data, 1000, 250,
+                                                     samples=20)
+
+    # A single window of every 50th sample (0, 50, ..., 350)
+    np.testing.assert_allclose(centers, [175])
+    np.testing.assert_allclose(medians, [175])
+
+
+def test_adaptive_envelope_burst():
+    'The noise level is raised over the whole burst'
+    rng = np.random.RandomState(0)
+    data = rng.normal(0, 0.01, 10 * SR)
+    data[4 * SR:6 * SR] = rng.normal(0, 0.2, 2 * SR)
+
+    centers, _, levels = threshold.adaptive_envelope(data, SR)
+
+    inside = (centers >= 4 * SR) & (centers <= 6 * SR)
+    assert levels[inside].min() > 0.1
+    assert levels[(centers < 3.5 * SR) | (centers > 6.5 * SR)].max() < 0.02
+
+
+def test_adaptive_peaks():
+    signal, taps = drifting_taps()
+
+    peaks = m2.rec2taps.numpy_peaks(signal, SR, 100, 6, threshold='adaptive')
+    global_peaks = m2.rec2taps.numpy_peaks(signal, SR, 100)
+
+    assert len(peaks) == len(taps)
+    assert np.abs(peaks - taps).max() <= 0.01 * SR
+    assert len(global_peaks) != len(taps)
+
+
+def test_adaptive_default_prominence():
+    signal, taps = drifting_taps()
+
+    peaks = m2.rec2taps.numpy_peaks(signal, SR, 100, threshold='adaptive')
+
+    np.testing.assert_array_equal(
+        peaks, m2.rec2taps.numpy_peaks(
+            signal, SR, 100, m2.rec2taps.defaults.DEFAULT_ADAPTIVE_PROMINENCE,
+            threshold='adaptive'))
+    assert len(peaks) == len(taps)
+    assert threshold.default_prominence('global') == \
+        m2.rec2taps.defaults.DEFAULT_PROMINENCE
+    assert threshold.default_prominence('adaptive', 2) == 2
+
+
+def test_adaptive_overwrite():
+    signal, _ = drifting_taps()
+    expected = m2.rec2taps.numpy_peaks(signal, SR, threshold='adaptive')
+
+    peaks = m2.rec2taps.numpy_peaks(signal.copy(), SR, overwrite_data=True,
+                                    threshold='adaptive')
+
+    np.testing.assert_array_equal(peaks, expected)
+
+
+def test_unknown_threshold():
+    with pytest.raises(ValueError):
+        m2.rec2taps.numpy_peaks(np.zeros(100), SR, threshold='local')
+
+
+def test_sweep_adaptive():
+    signal, _ = drifting_taps()
+
+    peaks = sweep_peaks(signal, SR, [50, 100], [5, 8], threshold='adaptive')
+
+    for (d, p), v in peaks.items():
+        np.testing.assert_array_equal(
+            v, m2.rec2taps.numpy_peaks(signal, SR, d, p,
+                                       threshold='adaptive'))
+
+
+def test_extract_peaks_adaptive_stream():
+    with pytest.raises(ValueError):
+        m2.rec2taps.extract_peaks('sti.wav', 'rec.wav', block_size=1024,
+                                  threshold='adaptive')
@@ -0,0 +1,138 @@
+import json
+import weakref
+import os
+import socket
+import threading
+import time
+import numpy as np
+import pytest
+import m2.rec2taps
+from m2.rec2taps import worker
+
+SR = 8000
+
+
+def test_handle_request(tmp_path, write_pair):
+    sti, rec = write_pair(tmp_path, 'a')
+
+    response = worker.handle_request({'id': 7, 'stimulus': sti,
+                                      'recording': rec, 'distance': 50})
+
+    assert response['id'] == 7
+    assert response['error'] is None
+    assert response['info']['lag_samples'] == 120
+    np.testing.assert_array_equal(
+        response['peaks'], m2.rec2taps.extract_peaks(sti, rec, distance=50))
+    json.dumps(response)
+
+
+def test_handle_request_parses_parameters(tmp_path, write_pair):
+    sti, rec = write_pair(tmp_path, 'a')
+
+    response = worker.handle_request({'stimulus': sti, 'recording': rec,
+                                      'distance': '50', 'invert': 'false'})
+
+    assert response['error'] is None
+    np.testing.assert_array_equal(
+        response['peaks'], m2.rec2taps.extract_peaks(sti, rec, distance=50))
+
+
+def test_serve_lines_isolates_errors(tmp_path, write_pair):
+    pairs = [write_pair(tmp_path, 'a'), write_pair(tmp_path, 'bb', lag_s=40)]
+    lines = [json.dumps({'id': i, 'stimulus': s, 'recording': r})
+             for i, (s, r) in enumerate(pairs)]
+    lines += [json.dumps({'id': 'missing', 'stimulus': pairs[0][0],
+                          'recording': str(tmp_path / 'missing.wav')}),
+              json.dumps({'id': 'bad', 'recording': pairs[0][1]}),
+              'not json', '']
+    written = []
+
+    with worker.Worker(workers=2, max_pending=2) as w:
+        w.serve_lines(lines, written.append)
+
+    responses = [json.loads(line) for line in written]
+    assert len(responses) == 5
+    by_id = {r['id']: r for r in responses}
+    for i, (s, r) in enumerate(pairs):
+        assert by_id[i]['error'] is None
+        np.testing.assert_array_equal(by_id[i]['peaks'],
+                                      m2.rec2taps.extract_peaks(s, r))
+    assert by_id['missing']['peaks'] is None
+    assert by_id['missing']['error'] is not None
+    assert by_id['bad']['error'].startswith('Invalid request')
+    assert by_id[None]['error'].startswith('Invalid JSON')
+
+
+def test_serve_unix(tmp_path, write_pair):
+    sti, rec = write_pair(tmp_path, 'a')
+    path = str(tmp_path / 'worker.sock')
+    w = worker.Worker(workers=1)
+    thread = threading.Thread(target=w.serve_unix, args=(path,), daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((json.dumps({'id': 1, 'stimulus': sti,
+                               'recording': rec}) + '\n').encode())
+        s.shutdown(socket.SHUT_WR)
+        response = json.loads(s.makefile().readline())
+
+    assert response['id'] == 1
+    np.testing.assert_array_equal(response['peaks'],
+                                  m2.rec2taps.extract_peaks(sti, rec))
+
+
+def test_serve_lines_unserializable_response(mocker):
+    mocker.patch('m2.rec2taps.worker.handle_request',
+                 return_value={'id': 3, 'peaks': [object()]})
+    written = []
+
+    with worker.Worker(workers=1) as w:
+        w.serve_lines([json.dumps({'id': 3})], written.append)
+
+    response = json.loads(written[0])
+    assert response['id'] == 3
+    assert response['peaks'] is None
+    assert response['error'].startswith('Invalid response')
+
+
+def test_serve_lines_drops_completed_requests(mocker):
+    mocker.patch('m2.rec2taps.worker.handle_request',
+                 side_effect=lambda request, **options: request)
+    submit = worker.Worker.submit
+    futures = []
+
+    def tracked_submit(self, request, callback):
+        future = submit(self, request, callback)
+        futures.append(weakref.ref(future))
+        return future
+
+    mocker.patch.object(worker.Worker, 'submit', tracked_submit)
+    alive = []
+
+    def lines():
+        for i in range(200):
+            yield json.dumps({'id': i})
+            alive.append(sum(f() is not None for f in futures))
+
+    written = []
+    with worker.Worker(workers=2, max_pending=2) as w:
+        w.serve_lines(lines(), written.append)
+
+    assert len(written) == 200
+    assert max(alive) <= 4
+
+
+def test_serve_unix_keeps_other_files(tmp_path):
+    path = tmp_path / 'worker.sock'
+    path.write_text('data')
+
+    with worker.Worker(workers=1) as w:
+        with pytest.raises(FileExistsError):
+            w.serve_unix(str(path))
+
+    assert path.read_text() == 'data'